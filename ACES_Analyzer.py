@@ -34,6 +34,7 @@ from ACES_ToolKit import Signal_2_Noise
 from ACES_ToolKit import ACES_Binned_Saver
 from ACES_ToolKit import ACES_Restoration
 
+from ACES_Cache import ACES_Stage_Cache
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -43,7 +44,11 @@ import numpy as np
 # GET PROCESSED DATA
 ##########################
 
-data, meta, logs, working_dir = ACES_Processor()
+#Data is only read from the processed file when sliced (e.g. the ROI below)
+data, meta, logs, working_dir = ACES_Processor(lazy=True)
+
+#Stages below are cached in the dataset directory, re-running with the same inputs loads them instead
+cache = ACES_Stage_Cache(working_dir + 'Cache/')
 
 ###########################
 # IMAGE VIEWIER
@@ -91,16 +96,16 @@ ACES_Multi_Frame_Image(data_sub, 50)
 #Bin by a set amount
 x_bin = 2
 y_bin = 2
-data_sub = Pixel_Averager(data_sub, y_bin, x_bin)
+data_sub = cache.run(Pixel_Averager, data_sub, y_bin, x_bin)
 
 
 ###
 #Or full frame averaging (ONLY RUN TO BIN ENTIRE FRAMES, SKIP OTHERWISE)
-data_sub = Pixel_Averager(data_sub, fullframe='y')
+data_sub = cache.run(Pixel_Averager, data_sub, fullframe='y')
 ####
 
 
-#TAKES AWHILE SO MAY WANT TO SAVE AFTER
+#Save the binned subset to restore it later without redoing the steps above
 data_date = working_dir.split('/')[-2]
 data_filename = working_dir + 'Binned/'+data_date+'_binned_data.h5'
 
@@ -117,6 +122,7 @@ ACES_Binned_Saver(data_sub, meta, logs, data_filename)
 
 #SKIP AND RESTORE DATA (Restore binned subset data and all meta/log files)
 data_sub, meta,logs, working_dir = ACES_Restoration('/Users/lguliano/ACES/Data/')
+cache = ACES_Stage_Cache(working_dir + 'Cache/')
 
 #######################################################
 
@@ -126,7 +132,7 @@ data_sub, meta,logs, working_dir = ACES_Restoration('/Users/lguliano/ACES/Data/'
 #####################################
 path_length = 25 #Full path length of travel from center in mm
 
-scan_list = Scan_Selector(meta, path_length/2)
+scan_list = cache.run(Scan_Selector, meta, path_length/2)
 
 #Scan Plotter
 ACES_Scan_Plotter(meta, scan_list)
@@ -182,8 +188,12 @@ for y in range(0, np.shape(real_data[0])[1]):
 sample_size = 632.816e-6 / 3 #HeNe laser in mm
 sample_size_cm = sample_size / 10
 
+#Interpolation weights kept in memory, so re-running with another ROI or binning skips building them (see ACES_ToolKit.RESAMPLING_MATRICES)
+resampling_cache_bytes = 256e6
+
 OPD_list, OPD_intrp_list, data_intrp_list = \
-    ACES_Interpolator(scan_list, positions, real_data, sample_size, path_length, datatype='white')
+    cache.run(ACES_Interpolator, scan_list, positions, real_data, sample_size, path_length, datatype='white',
+              cache_bytes=resampling_cache_bytes)
 
     
 #Show the result of the interpolation
@@ -221,7 +231,7 @@ for scan_num in range(0, len(scan_list)):
 # Shape of ft_list -> [scan, y, x, and the data]
 # Shape of freq_list -> one freq list per scan
 
-ft_list, freq_list = ACES_Transformer(scan_list, OPD_intrp_list, data_intrp_list, sample_size_cm)
+ft_list, freq_list = cache.run(ACES_Transformer, scan_list, OPD_intrp_list, data_intrp_list, sample_size_cm)
 
 
 #Set the wavelength range to look at (in microns)
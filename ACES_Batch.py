@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unattended processing of many ACES datasets (e.g. a full flight campaign)
+
+Runs ACES_Processor.Process_Dataset over every selected dataset with a bounded pool of
+worker processes and writes a status and timing summary (CSV and JSON) for the batch
+
+    python ACES_Batch.py [config.json] [--base_dir DIR] [--datasets NAME ...] [--glob PATTERN]
+                         [--gang_num N] [--dark {library,require,none}] [--dark_base DIR]
+                         [--overwrite {skip,restore,append,overwrite}] [--workers N] [--read_workers N]
+                         [--summary FILE]
+
+Command line options override the JSON config, which takes the same keys, for example
+
+    {"base_dir": "/Users/lguliano/ACES/Data/", "glob": "2025_*", "gang_num": 4,
+     "dark": "require", "overwrite": "skip", "workers": 2}
+
+Darks are taken from the dark library under dark_base, base_dir + 'DARKS/' if it is not set
+
+Overwrite policy for datasets that already have processed data:
+    skip:      leave them as they are
+    restore:   open them (checks the processed files can be read, the data is not loaded)
+    append:    append the seq and log files added since they were processed
+    overwrite: process them again
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import traceback
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ACES_Processor import Process_Dataset
+from ACES_Storage import Lazy_Data
+from aces_reader.profiling import PROFILER
+
+
+DEFAULT_CONFIG = {'base_dir': '/Users/lguliano/ACES/Data/',
+                  'datasets': None,
+                  'glob': '*',
+                  'gang_num': 4,
+                  'dark': 'library',
+                  'dark_base': None,
+                  'overwrite': 'skip',
+                  'workers': 1,
+                  'read_workers': None,
+                  'summary': None}
+
+
+#Names of the datasets to process: the given list, otherwise every directory under base_dir matching the glob with a Camera/ directory
+def Batch_Datasets(base_dir, datasets=None, pattern='*'):
+
+    if datasets is not None:
+        return list(datasets)
+
+    return sorted(os.path.basename(os.path.normpath(data_dir)) for data_dir in glob.glob(os.path.join(base_dir, pattern, ''))
+                  if os.path.isdir(os.path.join(data_dir, 'Camera')))
+
+#Process one dataset and return its status, only the status is sent back from the worker (not the data)
+def Batch_Dataset(data_dir, base_dir, gang_num, dark, dark_base, overwrite, read_workers):
+
+    status = {'dataset': data_dir, 'status': None, 'frames': 0, 'seconds': 0.0, 'error': ''}
+    start = time.perf_counter()
+    profile_start = len(PROFILER)
+
+    try:
+        processed_dir = base_dir + data_dir + '/Processed/'
+        processed = os.path.isdir(processed_dir) and len(os.listdir(processed_dir)) != 0
+
+        if processed and overwrite == 'skip':
+            status['status'] = 'skipped'
+        else:
+            data_option = {'restore': 'r', 'append': 'a', 'overwrite': 'o'}[overwrite] if processed else 'n'
+            data, meta, logs, full_data_dir = Process_Dataset(data_dir, base_dir, gang_num, data_option, dark, read_workers, lazy=True,
+                                                              dark_base=dark_base)
+            status['status'] = {'r': 'restored', 'a': 'appended'}.get(data_option, 'processed')
+            status['frames'] = len(data)
+            if isinstance(data, Lazy_Data):
+                data.close()
+
+    except Exception as error:
+        status['status'] = 'failed'
+        status['error'] = repr(error)
+        traceback.print_exc()
+
+    status['seconds'] = round(time.perf_counter() - start, 3)
+
+    #Profiling stages of the dataset, recorded in the worker process
+    status['profile'] = PROFILER.report(profile_start)
+
+    return status
+
+#Process every dataset of a config (see DEFAULT_CONFIG), workers datasets at a time
+#Returns the status of every dataset as a DataFrame (in dataset order) and writes it to config['summary'] as CSV and JSON
+#The profiling stages of every dataset are saved to <summary>_profile.json
+def ACES_Batch(config):
+
+    config = {**DEFAULT_CONFIG, **config}
+    if config['overwrite'] not in ['skip', 'restore', 'append', 'overwrite']:
+        raise ValueError('Unknown overwrite policy: '+str(config['overwrite']))
+    if config['dark'] not in ['library', 'require', 'none']:
+        raise ValueError('Unknown dark policy: '+str(config['dark']))
+
+    base_dir = os.path.join(config['base_dir'], '')
+    datasets = Batch_Datasets(base_dir, config['datasets'], config['glob'])
+    print('Processing '+str(len(datasets))+' datasets with '+str(config['workers'])+' workers')
+
+    start = time.perf_counter()
+    profile_start = len(PROFILER)
+    statuses = {}
+    with ProcessPoolExecutor(max_workers=config['workers']) as pool:
+        futures = {pool.submit(Batch_Dataset, data_dir, base_dir, config['gang_num'], config['dark'],
+                               config['dark_base'], config['overwrite'], config['read_workers']): data_dir for data_dir in datasets}
+        for future in as_completed(futures):
+            status = future.result()
+            PROFILER.extend(status.pop('profile'))
+            statuses[futures[future]] = status
+            print(status['dataset']+': '+status['status']+' in '+str(status['seconds'])+' s '+status['error'])
+
+    summary = pd.DataFrame([statuses[data_dir] for data_dir in datasets],
+                           columns=['dataset', 'status', 'frames', 'seconds', 'error'])
+
+    print()
+    print('Batch finished in '+str(round(time.perf_counter() - start, 1))+' s')
+    print(summary['status'].value_counts().to_string())
+
+    #Save the summary next to the data by default
+    summary_file = config['summary']
+    if summary_file is None:
+        summary_file = base_dir + 'ACES_Batch_' + time.strftime('%Y%m%d_%H%M%S')
+    summary_file = os.path.splitext(summary_file)[0]
+    summary.to_csv(summary_file + '.csv', index=False)
+    with open(summary_file + '.json', 'w') as f:
+        json.dump({'config': config, 'datasets': summary.to_dict('records')}, f, indent=2)
+    print('Summary saved to '+summary_file+'.csv/.json')
+    
+    #Time and memory of each processing step over all datasets
+    print()
+    print(PROFILER.summary_table(profile_start))
+    PROFILER.save_report(summary_file + '_profile.json', profile_start)
+
+    return summary
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Process many ACES datasets without user input')
+    parser.add_argument('config', nargs='?', help='JSON config file (same keys as the options)')
+    parser.add_argument('--base_dir', help='Directory holding the datasets')
+    parser.add_argument('--datasets', nargs='+', help='Names of the datasets to process')
+    parser.add_argument('--glob', help='Pattern of the datasets to process (if no datasets are given)')
+    parser.add_argument('--gang_num', type=int, help='Number of subframes per frame')
+    parser.add_argument('--dark', choices=['library', 'require', 'none'], help='Dark subtraction policy')
+    parser.add_argument('--dark_base', help='Directory of the dark library (default base_dir/DARKS/)')
+    parser.add_argument('--overwrite', choices=['skip', 'restore', 'append', 'overwrite'], help='What to do with already processed datasets')
+    parser.add_argument('--workers', type=int, help='Number of datasets processed at the same time')
+    parser.add_argument('--read_workers', type=int, help='Number of processes reading the seq files of each dataset')
+    parser.add_argument('--summary', help='Summary file name (.csv and .json are written)')
+    args = vars(parser.parse_args())
+
+    config = {}
+    config_file = args.pop('config')
+    if config_file is not None:
+        with open(config_file) as f:
+            config = json.load(f)
+    config.update({key: value for key, value in args.items() if value is not None})
+
+    summary = ACES_Batch(config)
+    sys.exit(int((summary['status'] == 'failed').any()))
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stage cache for the ACES analysis pipeline
+
+Each stage (Pixel_Averager, Scan_Selector, ACES_Interpolator, ACES_Transformer, ...) is run through
+ACES_Stage_Cache.run, which stores its output on disk under a key made from:
+    the stage function (name and code) and the code of every function and class it uses from the
+    ACES modules, followed through their globals (e.g. ACES_Interpolator -> Sampler -> ScanOPD),
+    so editing a helper also recomputes the stages that use it
+    the cache_version attribute of the stage, if it has one (bump it when something the code
+    hashing can't see changes, e.g. a library the stage depends on)
+    a fingerprint of every input (array contents, DataFrames, lists of arrays, parameters),
+    leaving out arguments that only change how a stage runs and not its output (EXECUTION_KWARGS)
+
+Running the analysis again with the same inputs loads the stored output instead of computing it,
+and changing one parameter only recomputes the stages downstream of it
+
+Outputs of cached stages are fingerprinted by their key, so passing them to the next stage does
+not need to hash them again (inputs must not be modified in place after they are fingerprinted)
+Fingerprints are only remembered through weak references, the cache never keeps an output alive
+
+Stored outputs are pickle files under cache_dir/<key[:2]>/, the least recently used files are
+removed when the cache grows past max_bytes
+
+    cache = ACES_Stage_Cache(working_dir + 'Cache/')
+    scan_list = cache.run(Scan_Selector, meta, path_length/2)
+"""
+
+import os
+import sys
+import time
+import pickle
+import hashlib
+import inspect
+import weakref
+import numpy as np
+import pandas as pd
+
+
+#Keyword arguments that only change how a stage runs, not its output, left out of the key
+EXECUTION_KWARGS = ('workers', 'cache_bytes')
+
+
+#Functions and classes a stage uses from the modules under root (the ACES modules), found through the global
+#names of its code (and of nested code: comprehensions, lambdas), methods of classes included
+def Code_Dependencies(func, root, found=None):
+
+    if found is None:
+        found = {}
+
+    func = inspect.unwrap(func)
+    if inspect.isclass(func):
+        codes = [inspect.unwrap(m).__code__ for m in vars(func).values() if inspect.isfunction(inspect.unwrap(m))]
+        module_globals = vars(sys.modules[func.__module__]) if func.__module__ in sys.modules else {}
+    else:
+        codes = [getattr(func, '__code__', None)]
+        module_globals = getattr(func, '__globals__', {})
+
+    while len(codes) > 0:
+        code = codes.pop()
+        if code is None:
+            continue
+        codes.extend(const for const in code.co_consts if inspect.iscode(const))
+        for name in code.co_names:
+            obj = module_globals.get(name)
+            if not (inspect.isfunction(obj) or inspect.isclass(obj)):
+                continue
+            obj = inspect.unwrap(obj)
+            module_file = getattr(sys.modules.get(obj.__module__), '__file__', None) or ''
+            qualname = obj.__module__ + '.' + obj.__qualname__
+            if qualname in found or not os.path.abspath(module_file).startswith(root):
+                continue
+            found[qualname] = obj
+            Code_Dependencies(obj, root, found)
+
+    return found
+
+#Code of a function (or of every method of a class), not of a decorator wrapping it
+def Code_Bytes(obj):
+
+    obj = inspect.unwrap(obj)
+    if inspect.isclass(obj):
+        return b''.join(Code_Bytes(m) for name, m in sorted(vars(obj).items()) if inspect.isfunction(inspect.unwrap(m)))
+
+    codes = [getattr(obj, '__code__', None)]
+    code_bytes = b''
+    while len(codes) > 0:
+        code = codes.pop()
+        if code is None:
+            continue
+        code_bytes += code.co_code + repr([c for c in code.co_consts if not inspect.iscode(c)]).encode()
+        codes.extend(const for const in code.co_consts if inspect.iscode(const))
+
+    return code_bytes
+
+
+class ACES_Stage_Cache:
+
+    def __init__(self, cache_dir='/Users/lguliano/ACES/Cache/', max_bytes=20e9):
+        self.cache_dir = os.path.join(cache_dir, '')
+        self.max_bytes = max_bytes
+        #id -> (weak reference to the object, fingerprint)
+        self.fingerprints = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    #Fingerprint (hex string) of an input: contents of arrays and tables, recursively for lists, tuples and dicts
+    def fingerprint(self, obj):
+
+        known = self.fingerprints.get(id(obj))
+        if known is not None:
+            ref, fp = known
+            if ref() is obj:
+                return fp
+
+        h = hashlib.blake2b(digest_size=16)
+        if isinstance(obj, np.ndarray) and obj.dtype != object:
+            h.update(b'ndarray' + str(obj.dtype.descr).encode() + str(obj.shape).encode())
+            h.update(np.ascontiguousarray(obj).view(np.uint8).data)
+        elif isinstance(obj, pd.DataFrame):
+            h.update(b'DataFrame' + str(list(obj.columns)).encode() + str(list(obj.dtypes)).encode())
+            h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+        elif isinstance(obj, (list, tuple)):
+            h.update(type(obj).__name__.encode())
+            for item in obj:
+                h.update(self.fingerprint(item).encode())
+        elif isinstance(obj, dict):
+            h.update(b'dict')
+            for key in sorted(obj, key=repr):
+                h.update(repr(key).encode() + self.fingerprint(obj[key]).encode())
+        elif isinstance(obj, (str, bytes, int, float, complex, bool, type(None), np.generic)):
+            h.update(type(obj).__name__.encode() + repr(obj).encode())
+        else:
+            h.update(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+        fp = h.hexdigest()
+
+        #Only arrays are remembered (weakly), they are the inputs worth not hashing twice
+        if isinstance(obj, np.ndarray):
+            self.remember(obj, fp)
+
+        return fp
+
+    #Remember the fingerprint of an object through a weak reference, forgotten when the object is freed
+    def remember(self, obj, fp):
+
+        obj_id = id(obj)
+
+        def forget(ref):
+            known = self.fingerprints.get(obj_id)
+            if known is not None and known[0] is ref:
+                del self.fingerprints[obj_id]
+
+        self.fingerprints[obj_id] = (weakref.ref(obj, forget), fp)
+
+    #Remember the fingerprint of a stage output (and of each item of a list or tuple output) so it is not hashed as an input
+    #Lists and tuples can't be weakly referenced, only their items are remembered (a list of them is then hashed from
+    #the fingerprints of its items)
+    def register(self, obj, fp):
+
+        if isinstance(obj, (list, tuple)):
+            for i, item in enumerate(obj):
+                self.register(item, fp + ':' + str(i))
+            return
+
+        try:
+            self.remember(obj, fp)
+        except TypeError:
+            #Not weakly referenceable (e.g. numbers), cheap to hash again
+            pass
+
+    #Key of a stage run: the stage function and its dependencies (name and code), its cache_version and the fingerprint of
+    #every argument except the EXECUTION_KWARGS
+    def key(self, func, *args, **kwargs):
+
+        h = hashlib.blake2b(digest_size=20)
+        h.update((func.__module__ + '.' + func.__qualname__).encode())
+        h.update(repr(getattr(func, 'cache_version', None)).encode())
+
+        root = os.path.dirname(os.path.abspath(getattr(sys.modules.get(func.__module__), '__file__', None) or os.getcwd()))
+        h.update(Code_Bytes(func))
+        for qualname, dependency in sorted(Code_Dependencies(func, root).items()):
+            h.update(qualname.encode() + Code_Bytes(dependency))
+
+        h.update(self.fingerprint(args).encode())
+        h.update(self.fingerprint({k: v for k, v in kwargs.items() if k not in EXECUTION_KWARGS}).encode())
+
+        return h.hexdigest()
+
+    def path(self, key):
+        return self.cache_dir + key[:2] + '/' + key + '.pkl'
+
+    #Run func(*args, **kwargs), or load its output if the stage was already run with the same inputs
+    def run(self, func, *args, **kwargs):
+
+        key = self.key(func, *args, **kwargs)
+        stage_file = self.path(key)
+
+        if os.path.isfile(stage_file):
+            print('Loading cached '+func.__name__+' ('+key[:12]+')')
+            with open(stage_file, 'rb') as f:
+                output = pickle.load(f)
+            #Mark as recently used
+            os.utime(stage_file)
+        else:
+            start = time.perf_counter()
+            output = func(*args, **kwargs)
+            print(f"{func.__name__} took:  {time.perf_counter() - start:.4f} seconds, caching as {key[:12]}")
+            self.store(stage_file, output)
+
+        self.register(output, key)
+
+        return output
+
+    #Save a stage output (written to a temporary file first so a partial file is never loaded)
+    def store(self, stage_file, output):
+
+        os.makedirs(os.path.dirname(stage_file), exist_ok=True)
+        with open(stage_file + '.tmp', 'wb') as f:
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(stage_file + '.tmp', stage_file)
+
+        self.evict()
+
+    #Remove the least recently used outputs until the cache is under max_bytes
+    def evict(self):
+
+        files = []
+        for root, dirs, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.pkl'):
+                    stat = os.stat(os.path.join(root, name))
+                    files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+
+        total = sum(size for mtime, size, name in files)
+        for mtime, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            print('Removing cached stage '+os.path.basename(name))
+            os.remove(name)
+            total = total - size
+
+    #Remove every stored output
+    def clear(self):
+
+        for root, dirs, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.pkl'):
+                    os.remove(os.path.join(root, name))
+        self.fingerprints = {}
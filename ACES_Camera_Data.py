@@ -6,218 +6,500 @@ Created on Tue Mar  4 14:40:35 2025
 @author: lguliano
 """
 
-from ReadSeqMod_Ganged import ReadSeq 
+from ReadSeqMod_Ganged import ReadSeqChunks, ReadSeqHeader, ParseMetaTable, RoiFrames, RoiShape, SeqFile, SeqIndex
+from aces_reader.profiling import stage, profiled, current_stage
 
 import os
 import numpy as np
 import pandas as pd
 
 import time
-import h5py
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 # time_stamper function used to assign a time to each subframe from the full frame data
 # Takes the start and end time of series of frames and assigns a time to each subframe
 # Needs to be done over full sequence files due to accuracy limitations on frame timestamps
 # Multiple frames will have the same timestamp, so can't get subframe from just timestamps, need full series
+# Timestamps are int64 nanoseconds since 1970 in meta['timestamp'], use Frame_Times to get datetimes
 
 def time_stamper(meta, num_frames, gang_num):
     
     meta_stamped = meta
+    timestamps = meta_stamped['timestamp']
     
-    time_frame = meta_stamped[-1].timestamp - meta_stamped[0].timestamp
-    
-    seconds_2_nano = time_frame.seconds * 1e9
-    micro_2_nano = time_frame.microseconds * 1e3
-    nanoseconds = seconds_2_nano + micro_2_nano
+    #Time covered by the file in nanoseconds
+    nanoseconds = float(timestamps[-1] - timestamps[0])
     
     #Get the step for each subframe, assuming that the time starts at the first full frame end
-    ns_per_frame = nanoseconds / (len(meta_stamped)-(gang_num-1))
-    ns = pd.Timedelta(str(ns_per_frame)+' ns')
-    
-    #Convert to Panda time objects for greater precision:
-    pandatime = []
-    for m in meta_stamped:
-        pandatime.append(pd.Timestamp(m.timestamp))
+    #Truncated to whole nanoseconds (same as the pandas Timedelta step used before)
+    ns = np.int64(nanoseconds / (len(meta_stamped)-(gang_num-1)))
     
     #Frame number to base time off of, should be the last subframe of the first full frame
     base_fn = gang_num - 1
         
-    #Starting at the second full frame, assign each subframe a time based on the step size
-    for p in range(0,len(meta_stamped)):
-        temptime = pandatime[base_fn] + (ns*(p-base_fn))
+    #Assign each subframe a time based on the step size from the base frame
+    meta_stamped['timestamp'] = timestamps[base_fn] + ns*(np.arange(len(meta_stamped)) - base_fn)
         
-        #For datetime object
-        meta_stamped[p].timestamp = temptime.to_pydatetime()
+    return meta_stamped
+
+#Frame times as pandas Timestamps (DatetimeIndex), only built when asked for
+#Use Frame_Times(meta).to_pydatetime() for datetime objects
+def Frame_Times(meta):
+    return pd.to_datetime(meta['timestamp'], unit='ns')
+
+#Largest frame counter right after a reset, the counter of the camera drops to (near) zero when it is reset
+RESET_LIMIT = 10
+
+#Repair a frameCounter array, returns the repaired counters and the index of the frames after each reset and of each repaired frame
+#A reset is any step back to at most reset_limit (found with np.diff, any number of resets), also when it comes after
+#only a few frames (e.g. 5, 6, 7, 8, 0, 1 is a reset on the fifth frame)
+#Frames before the first reset are numbered from zero and every later segment continues from the end of the one before it
+#Any other step back (to a counter above reset_limit) is an out of order frame and keeps its counter, so the frames after it are not shifted
+#A duplicated counter followed by a skip of two is a stuck counter and is repaired to the missing count in between,
+#other duplicates are repeated frames and keep their counter
+def repair_counter(counter, reset_limit=RESET_LIMIT):
+    
+    counter = np.asarray(counter, dtype=np.int64)
+    fixed = counter.copy()
+    
+    #Index of the first frame after each reset
+    diff = np.diff(counter)
+    resets = np.flatnonzero((diff < 0) & (counter[1:] <= reset_limit)) + 1
+    
+    if len(resets) > 0:
+        #Offset added to each segment so it continues one count after the previous segment
+        #First reset: the first frames become 0..resets[0]-1, so the next segment starts at resets[0]
+        steps = counter[resets-1] + 1 - counter[resets]
+        steps[0] = resets[0] - counter[resets[0]]
+        offsets = np.concatenate([[0], np.cumsum(steps)])
         
-        #For Pandas time object
-        #meta_stamped[p].timestamp = temptime
+        #Segment number of every frame
+        segment = np.searchsorted(resets, np.arange(len(counter)), side='right')
+        fixed = counter + offsets[segment]
         
-    return meta_stamped
+        #Reindex the first frames to start at zero
+        fixed[:resets[0]] = np.arange(resets[0])
+    
+    #Stuck counters: same count as the frame before and two less than the frame after
+    diff = np.diff(fixed)
+    repaired = np.flatnonzero((diff[:-1] == 0) & (diff[1:] == 2)) + 1
+    fixed[repaired] += 1
+    
+    return fixed, resets, repaired
 
-#Reindex frames to ensure that it starts at zero and counts up
-def frame_count_fixer(meta):
+#Reindex frames to ensure that it starts at zero and counts up, stuck counters are repaired (see repair_counter)
+def frame_count_fixer(meta, reset_limit=RESET_LIMIT):
     
     meta_framed = meta
+    counter = np.asarray(meta['frameCounter'], dtype=np.int64)
+    fixed, resets, repaired = repair_counter(counter, reset_limit)
     
-    #Check to see if there is a zero frame
-    good_reset = False
-    for m in meta:
-        if m.frameCounter == 0:
-            good_reset = True
-            break
-    
-    #if there is not a zero index, just return the data
-    if good_reset == False:
-        print('This data did not have a frame reset')
-        print('THERE MAY BE ERRORS ALIGNING THIS DATA WITH THE LOGS')
-        return meta_framed
+    if len(repaired) > 0:
+        print('Repaired stuck frame counters on frame numbers: ', repaired.tolist())
     
-    #If it does have a good reset, check to see if it needs to be reindexed
-    if good_reset == True:    
+    #if there is no reset, just return the data
+    if len(resets) == 0:
         #If frame 0 starts at zero, no need to correct
-        if meta[0].frameCounter == 0:
+        if counter[0] == 0:
             print("No need to reindex")
-            return meta_framed
-        
-        #If it is not zero, then find how many files need to be shifted    
         else:
-            print('Reindexing meta data')
-            index_shift = 0
-            keep_counting = True
-            #Loop and count until it finds the frame that starts at zero
-            while keep_counting == True:
-                if meta[index_shift].frameCounter == 0:
-                    keep_counting = False
-                else:
-                    index_shift = index_shift + 1
-                    
-            #Print out the frame where the reset happened   
-            print()
-            print('Frame counter reset found on frame number: ',index_shift)
-            print()
-            
-            #Print warning if reset occurs late in dataset
-            if index_shift >100:
-                print('########################')
-                print('WARNING!!!!!!!')
-                print('Frame reset occurs late in this dataset')
-                print('You should investigate and make sure files are correct')
-                print('########################')
-            #Reindex the first frames to start at zero
-            for i in range(0,index_shift):
-                meta[i].frameCounter = i
-                
-            #Reindex the rest of the frames
-            for i in range(index_shift,len(meta)):
-                meta[i].frameCounter = meta[i].frameCounter + index_shift
-            
-            #Return the reindexed meta
-            return meta_framed
+            print('This data did not have a frame reset')
+            print('THERE MAY BE ERRORS ALIGNING THIS DATA WITH THE LOGS')
+        meta['frameCounter'] = fixed
+        return meta_framed
+    
+    print('Reindexing meta data')
+    
+    #Print out the frames where the resets happened
+    print()
+    print('Frame counter reset found on frame number: ',resets[0])
+    if len(resets) > 1:
+        print('Additional frame counter resets found on frame numbers: ',resets[1:].tolist())
+    print()
+    
+    #Print warning if reset occurs late in dataset
+    if resets[0] >100:
+        print('########################')
+        print('WARNING!!!!!!!')
+        print('Frame reset occurs late in this dataset')
+        print('You should investigate and make sure files are correct')
+        print('########################')
+    
+    meta['frameCounter'] = fixed
+    
+    #Return the reindexed meta
+    return meta_framed
 
+#Summary of the raw frame counters of each seq file: resets, dropped, duplicated, repaired (stuck) and out of order frames
+#seq_lengths is the number of frames of each file in seq_names (in the order of counter)
+#Counts are taken on the counters continued across resets (see repair_counter), so a reset is not a gap
+#dropped is the number of counts missing from a file (and the jump from the file before), so a late frame is not dropped
+def frame_gap_report(counter, seq_names, seq_lengths, reset_limit=RESET_LIMIT):
+    
+    counter = np.asarray(counter, dtype=np.int64)
+    fixed, resets, repaired = repair_counter(counter, reset_limit)
+    
+    #Steps before the stuck counters were repaired
+    diff = np.diff(fixed)
+    diff[repaired - 1] = 0
+    stuck = np.zeros(len(diff), dtype=bool)
+    stuck[repaired - 1] = True
+    
+    #File of the later frame of each diff
+    file_index = np.repeat(np.arange(len(seq_lengths)), seq_lengths)[1:]
+    num_files = len(seq_lengths)
+    
+    starts = np.concatenate([[0], np.cumsum(seq_lengths)[:-1]]).astype(int)
+    ends = starts + np.asarray(seq_lengths, dtype=int) - 1
+    
+    #Counts missing between the lowest and highest count of each file, starting from the last frame of the file before
+    dropped = np.zeros(num_files, dtype=np.int64)
+    for i in range(0, num_files):
+        counts = fixed[max(starts[i] - 1, 0):ends[i] + 1]
+        if len(counts) > 0:
+            dropped[i] = counts.max() - counts.min() + 1 - len(np.unique(counts))
+    
+    report = pd.DataFrame({
+        'seq': seq_names,
+        'frames': seq_lengths,
+        'first_count': counter[starts],
+        'last_count': counter[ends],
+        'resets': np.bincount(file_index[resets - 1], minlength=num_files),
+        'dropped': dropped,
+        'duplicated': np.bincount(file_index[(diff == 0) & ~stuck], minlength=num_files),
+        'repaired': np.bincount(file_index[stuck], minlength=num_files),
+        'out_of_order': np.bincount(file_index[diff < 0], minlength=num_files),
+        })
+    
+    return report
 
-def ACES_Camera_Data(camera_dir, gang_num=1, frametype='normal'):
-    ############################
- 
-    image_dir = os.path.join(os.path.expanduser('~'), 'ACES', camera_dir)
-    seq_list = os.listdir(image_dir)
+
+#Report gaps in the raw frame counters of each seq file, then reindex the full data set
+#Returns the reindexed meta and the report (see frame_gap_report)
+def Check_Frame_Counts(meta, seq_list, meta_list):
+    
+    report = frame_gap_report(meta['frameCounter'], seq_list, [len(m) for m in meta_list])
+    print()
+    print('Frame counter report (raw counters):')
+    print(report.to_string(index=False))
+    print()
+    
+    return frame_count_fixer(meta), report
+
+#Sorted list of the seq files in a camera directory
+def Seq_List(image_dir):
     
     #Only look at files that are seq files
-    for seq in seq_list:
-        if seq[-3:] != 'seq':
-            seq_list.remove(seq)
+    seq_list = [seq for seq in os.listdir(image_dir) if seq[-3:] == 'seq']
     
     #Sort in order of file name (time)
     seq_list.sort()
     
+    return seq_list
+
+#Open every seq file of a camera directory as a memory-mapped SeqFile (nothing is decoded until indexed)
+#Useful for quick looks, e.g. ACES_Image_Plotter(seq_files[0], 100)
+def ACES_Camera_Files(camera_dir, gang_num=1, seq_names=None):
+    
+    image_dir = os.path.join(os.path.expanduser('~'), 'ACES', camera_dir)
+    if seq_names is None:
+        seq_names = Seq_List(image_dir)
+    
+    return [SeqFile(image_dir+seqs, gang_num) for seqs in seq_names]
+
+#Summary of every seq file in a camera directory from the sidecar indexes (see ReadSeqMod_Ganged.SeqIndex)
+#Only the first call reads the seq files, later calls just load the small index files
+def ACES_Camera_Index(camera_dir, gang_num=1):
+    
+    image_dir = os.path.join(os.path.expanduser('~'), 'ACES', camera_dir)
+    
+    rows = []
+    for seqs in Seq_List(image_dir):
+        Seq = SeqIndex(image_dir+seqs, gang_num)
+        rows.append({'seq': seqs,
+                     'frames': Seq.NumFrames*gang_num,
+                     'first_count': Seq.FirstCount,
+                     'last_count': Seq.LastCount,
+                     'start_time': pd.Timestamp(Seq.StartTime, unit='ns'),
+                     'end_time': pd.Timestamp(Seq.EndTime, unit='ns'),
+                     'int_time': Seq.IntTime,
+                     'fpa_temp': Seq.FpaTemp})
+    
+    return pd.DataFrame(rows)
+
+#Names of the seq files in a camera index that overlap a time range (either end can be None)
+def Select_Seqs(index, start=None, end=None):
+    
+    keep = np.ones(len(index), dtype=bool)
+    if start is not None:
+        keep = keep & (index['end_time'] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        keep = keep & (index['start_time'] <= pd.Timestamp(end)).to_numpy()
+    
+    return list(index['seq'][keep])
+
+
+#Meta data of every frame in a camera directory without reading any image data (loaded from the seq indexes)
+#Time stamped per seq file and reindexed over the full dataset like ACES_Camera_Data
+def ACES_Camera_Meta(camera_dir, gang_num=1, frametype='normal', seq_files=None):
+    
+    if seq_files is None:
+        seq_files = ACES_Camera_Files(camera_dir, gang_num)
+    
+    meta_list = []
+    for sf in seq_files:
+        new_meta = SeqIndex(sf.filename, gang_num).Meta.copy()
+        meta_list.append(time_stamper(new_meta, len(new_meta), gang_num))
+    meta = np.concatenate(meta_list)
+    
+    #Don't perform for darks to avoid incorrect error messages on frame counter
+    if frametype == 'normal':
+        meta, report = Check_Frame_Counts(meta, [os.path.basename(sf.filename) for sf in seq_files], meta_list)
+    
+    return meta
+
+#Write a block of frames into out[start:start+len(frames)], subtracting the dark in the same pass
+#dark must already be cut/binned like the frames, the result is cast to the dtype of out
+#clip=(low, high) limits the result (either end can be None)
+def Write_Frames(out, start, frames, dark=None, clip=None):
+    
+    end = start + len(frames)
+    
+    #Array-likes such as h5py datasets are written from a temporary block
+    if not isinstance(out, np.ndarray):
+        block = np.empty(frames.shape, dtype=out.dtype)
+        Write_Frames(block, 0, frames, dark, clip)
+        out[start:end] = block
+        return
+    
+    target = out[start:end]
+    if dark is None:
+        target[...] = frames
+    else:
+        #Broadcast the dark over every frame, written straight into the output
+        np.subtract(frames, dark, out=target, casting='unsafe')
+    
+    if clip is not None:
+        np.clip(target, clip[0], clip[1], out=target)
+
+#Default output type: binned data are float64 averages, dark subtracted data int32 (can go negative), raw data the native int16
+def Frame_Dtype(dtype, dark, y_bin, x_bin):
+    
+    if dtype is not None:
+        return dtype
+    if y_bin > 1 or x_bin > 1:
+        return np.float64
+    if dark is not None:
+        return np.int32
+    return np.int16
+
+#Streaming version of ACES_Camera_Data for runs too large to hold in memory
+#Yields (data_chunk, meta_chunk) of at most chunk_frames frames, in the same order as ACES_Camera_Data
+#The meta of the full run is built first (small) so the time stamps and frame counts match ACES_Camera_Data
+#dark (full frame) is subtracted from each chunk as in ACES_Camera_Data
+def ACES_Camera_Chunks(camera_dir, gang_num=1, chunk_frames=1000, frametype='normal',
+                       y_range=None, x_range=None, y_bin=1, x_bin=1, dark=None, dtype=None, clip=None):
+    
+    seq_files = ACES_Camera_Files(camera_dir, gang_num)
+    meta = ACES_Camera_Meta(camera_dir, gang_num, frametype, seq_files)
+    
+    dtype = Frame_Dtype(dtype, dark, y_bin, x_bin)
+    if dark is not None:
+        dark = RoiFrames(dark[np.newaxis], y_range, x_range, y_bin, x_bin)[0]
+    
+    #Position of the chunk in the full dataset
+    start = 0
+    for sf in seq_files:
+        for data_chunk, meta_chunk in ReadSeqChunks(sf, gang_num, chunk_frames, y_range, x_range, y_bin, x_bin):
+            end = start + len(data_chunk)
+            out_chunk = np.empty(data_chunk.shape, dtype=dtype)
+            Write_Frames(out_chunk, 0, data_chunk, dark, clip)
+            yield out_chunk, meta[start:end]
+            start = end
+        sf.close()
+
+
+#Worker for the parallel ingest, decodes one seq file straight into its slot of the shared output file
+def _Read_Seq_Slot(seqfile, gang_num, shared_file, shape, dtype, start, roi, dark, clip):
+    
+    start_time = time.perf_counter()
+    
+    data = np.memmap(shared_file, dtype=dtype, mode='r+', shape=shape)
+    with SeqFile(seqfile, gang_num) as sf:
+        new_data, meta_rows, seconds, millisec = sf.decode(0, sf.Seq.NumFrames, *roi[:2])
+        Write_Frames(data, start, RoiFrames(new_data, None, None, *roi[2:]), dark, clip)
+        new_meta = ParseMetaTable(meta_rows, seconds, millisec, gang_num)
+    del data
+    
+    # For each seq file, get a UTC time stamp for each subframe
+    new_meta = time_stamper(new_meta, len(new_meta), gang_num)
+    
+    return new_meta, time.perf_counter() - start_time
+
+#Directory of the memory-mapped output of Parallel_Read: /dev/shm (held in memory) when there is one with room for nbytes,
+#otherwise the default temporary directory. The file is sparse, so running out of room on /dev/shm (64 MB by default in Docker)
+#would only show up as the workers being killed (SIGBUS) while they write into it
+def Shared_Dir(nbytes, shm_dir='/dev/shm'):
+    
+    if not os.path.isdir(shm_dir):
+        return None
+    if shutil.disk_usage(shm_dir).free < nbytes:
+        print(f'Not enough room in {shm_dir} for {nbytes/1e6:.1f} MB, reading through a file in {tempfile.gettempdir()}')
+        return None
+    return shm_dir
+
+#Read the seq files concurrently with a process pool, each file is written into a preallocated output
+#The slot of each file is set by the NumFrames * gang_num of the files before it, so the order is the same as reading serially
+#The output is a memory-mapped temporary file shared with the workers (in /dev/shm when it fits there, so it is held in memory, see Shared_Dir)
+#Without out the memory map itself is returned, its file is removed once the workers are done so the memory is freed with the array
+#(on Windows a mapped file can't be removed and it is left in the temp directory)
+#NOTE: scripts that call this must be run under `if __name__ == '__main__':` on platforms that spawn processes (macOS, Windows)
+#roi is (y_range, x_range, y_bin, x_bin) and dark (already cut/binned) and clip are as in ACES_Camera_Data
+def Parallel_Read(image_dir, seq_list, gang_num, workers, dtype=np.int16, out=None, roi=(None, None, 1, 1),
+                  dark=None, clip=None):
+    
+    #Size the output from the seq headers
+    headers = [ReadSeqHeader(image_dir+seqs) for seqs in seq_list]
+    num_frames = [h.NumFrames*gang_num for h in headers]
+    starts = np.concatenate([[0], np.cumsum(num_frames)[:-1]])
+    sub_rows = int((headers[0].ImageHeight-gang_num)/gang_num)
+    shape = (int(np.sum(num_frames)),) + RoiShape(sub_rows, headers[0].ImageWidth, *roi)
+    dtype = np.dtype(dtype)
+    
+    print('Reading '+str(len(seq_list))+' seq files with '+str(workers)+' workers')
+    
+    nbytes = int(np.prod(shape))*dtype.itemsize
+    fd, shared_file = tempfile.mkstemp(prefix='aces_read_', suffix='.dat', dir=Shared_Dir(nbytes))
+    os.close(fd)
+    try:
+        shared = np.memmap(shared_file, dtype=dtype, mode='w+', shape=shape)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_Read_Seq_Slot, image_dir+seqs, gang_num, shared_file, shape, dtype, int(start), roi, dark, clip): i
+                       for i, (seqs, start) in enumerate(zip(seq_list, starts))}
+            
+            #Keep the meta of each file in its slot so the order does not depend on which worker finishes first
+            meta_list = [None]*len(seq_list)
+            for future in as_completed(futures):
+                i = futures[future]
+                meta_list[i], read_time = future.result()
+                print(f"Read seq file {seq_list[i]} in {read_time:.4f} seconds")
+        
+        if out is None:
+            data = shared
+        else:
+            data = out
+            data[:] = shared
+        del shared
+    finally:
+        try:
+            os.remove(shared_file)
+        except OSError:
+            pass
+    
+    return data, meta_list
+
+
+#Read every seq file of a camera directory into a single array of shape (frames, rows, columns)
+#The output is sized from the seq headers and each file is written straight into its slot (native int16 by default)
+#out can be any array-like with slice assignment and the same shape (e.g. an h5py dataset) to skip holding the data in memory
+#seq_names restricts the read to some of the seq files (e.g. from Select_Seqs)
+#y_range/x_range ([start, stop]) and y_bin/x_bin cut and average the frames while reading, only the ROI pixels are copied out of the seq files
+#dark (full frame) is subtracted while each file is written into the output, so the raw frames are only touched once
+#The output type is dtype (e.g. np.int32 or np.float32), by default float64 when binned, int32 with a dark or the native int16
+#clip=(low, high) limits the dark subtracted values
+@profiled(items=lambda out: len(out[1]))
+def ACES_Camera_Data(camera_dir, gang_num=1, frametype='normal', workers=None, dtype=None, out=None, seq_names=None,
+                     y_range=None, x_range=None, y_bin=1, x_bin=1, dark=None, clip=None):
+    ############################
+ 
+    image_dir = os.path.join(os.path.expanduser('~'), 'ACES', camera_dir)
+    if seq_names is None:
+        seq_list = Seq_List(image_dir)
+    else:
+        seq_list = list(seq_names)
+    
     #################################
     num_seqs = len(seq_list)
     print('Reading from the following '+str(num_seqs)+' seq files...')
     print()
     print(seq_list)
+    
+    roi = (y_range, x_range, y_bin, x_bin)
+    dtype = Frame_Dtype(dtype, dark, y_bin, x_bin)
+    
+    #Bytes read are the frames of the seq files, not the (cut, binned or converted) output
+    record = current_stage()
+    if record is not None:
+        headers = [ReadSeqHeader(image_dir+seqs) for seqs in seq_list]
+        record.bytes = sum(h.NumFrames*h.TrueImageSize for h in headers)
+    
+    #Cut and bin the dark like the frames
+    if dark is not None:
+        print('Subtracting dark frame while reading')
+        dark = RoiFrames(dark[np.newaxis], *roi)[0]
+    
+    #Decode the seq files in parallel (workers > 1), output is already merged in order
+    if workers is not None and workers > 1:
+        concat_start = time.perf_counter()
+        data, meta_list = Parallel_Read(image_dir, seq_list, gang_num, workers, dtype, out, roi, dark, clip)
+        meta = np.concatenate(meta_list)
+        concat_time = time.perf_counter() - concat_start
+        print(f"Parallel read took:  {concat_time:.4f} seconds")
+        
+        if frametype == 'normal':
+            meta, report = Check_Frame_Counts(meta, seq_list, meta_list)
+        
+        return data, meta
 
-    #Build empty list to store data and meta of each file
-    data_list = []
+    #Open the seq files and size the output from their headers
+    seq_files = [SeqFile(image_dir+seqs, gang_num) for seqs in seq_list]
+    num_frames = sum(len(sf) for sf in seq_files)
+    if out is None:
+        data = np.empty((num_frames,)+RoiShape(*seq_files[0].shape[1:], *roi), dtype=dtype)
+    else:
+        data = out
+    
+    #Build empty list to store the meta of each file
     meta_list = []
     
+    #Position of the next file in the output
+    start = 0
+    
     seq_count = 0
-    for seqs in seq_list:
-        
-        #Time each loop
-        start_time = time.perf_counter()
+    for seqs, sf in zip(seq_list, seq_files):
         
         #Increase seq count by one to report the number of the file being read
         seq_count = seq_count + 1
         
-        #Get the specifc file
-        seqfile = image_dir+seqs
-        
         #Print which seq file is being analyzed
         print()
         print()
         print('Reading seq file: '+seqs)
         print('File number '+str(seq_count)+'/'+str(num_seqs))
     
-        #Read in the data
-        new_data,new_meta,new_seq = ReadSeq(seqfile, gang_num=gang_num)
-        
-        #Get data sizes
-        num_frames = np.shape(new_data)[0]
-        #num_rows = np.shape(new_data)[1]
-        #num_columns = np.shape(new_data)[2]
-        
-        # For each seq file, get a UTC time stamp for each subframe
-        new_meta = time_stamper(new_meta, num_frames, gang_num)
+        #Time each file (bytes read from the seq file and frames decoded)
+        with stage('read_seq_file', nbytes=sf.Seq.NumFrames*sf.Seq.TrueImageSize, items=len(sf)) as record:
+            
+            #Decode the file straight into its slot of the output
+            new_data, meta_rows, seconds, millisec = sf.decode(0, sf.Seq.NumFrames, *roi[:2])
+            Write_Frames(data, start, RoiFrames(new_data, None, None, *roi[2:]), dark, clip)
+            new_meta = ParseMetaTable(meta_rows, seconds, millisec, gang_num)
+            start = start + len(new_data)
+            sf.close()
+            
+            # For each seq file, get a UTC time stamp for each subframe
+            new_meta = time_stamper(new_meta, len(new_meta), gang_num)
         
-        read_end = time.perf_counter()
-        read_time = read_end - start_time
-        print(f"Reading data took:  {read_time:.4f} seconds")
+        print(f"Reading data took:  {record.wall:.4f} seconds")
         
-        data_list.append(new_data)
         meta_list.append(new_meta)
     
-    #With each file read, must be merged together, tricky for large datasets
+    #Data is already merged, only the meta of each file needs to be joined
     concat_start = time.perf_counter()
     
-    #Now there is a list of arrays containing the data from each seq file
-    #Utilize h5py to merge all of these and not overwhelm everything
-    temp_h5py = camera_dir+'/temp_data.h5'
-    
-    #Get the shape of the dataset
-    X = np.shape(data_list[0])[2]
-    Y = np.shape(data_list[0])[1]
-    
-    print()
-    print()
-    print('Merging data and meta lists from each sequence file together...')
-    print()
-
-    # Open an HDF5 file in write mode
-    with h5py.File(temp_h5py, 'w') as f:
-
-        #Create array to hold all of the image data
-        image_set = f.create_dataset('image_data', shape=(0, Y, X), maxshape=(None, Y, X), dtype=int)
-        # Append each array to the dataset
-        for arr in data_list:
-            # Resize the dataset
-            image_set.resize(image_set.shape[0] + arr.shape[0], axis=0) 
-            # Write the array to the allocated space
-            image_set[-arr.shape[0]:] = arr 
-    
-    #Read into numpy array
-    with h5py.File(temp_h5py, 'r') as f:
-        h5py_im_data = f['image_data']
-
-        # Create an empty NumPy array of the desired shape and dtype
-        data = np.empty(h5py_im_data.shape, dtype=h5py_im_data.dtype)
-
-        # Read the data directly into the NumPy array
-        h5py_im_data.read_direct(data)
-    
-    #Delete large temporary file
-    os.remove(temp_h5py)
-    
-    
     #Meta is easier, just concate directly to numpy
     meta = np.concatenate(meta_list)
     
@@ -230,7 +512,7 @@ def ACES_Camera_Data(camera_dir, gang_num=1, frametype='normal'):
     #reindex the data to ensure it starts at zero frame count, need to do on the full data set
     #Don't perform for darks to avoid incorrect error messages on frame counter
     if frametype == 'normal':
-        meta = frame_count_fixer(meta)
+        meta, report = Check_Frame_Counts(meta, seq_list, meta_list)
 
     
     
@@ -5,53 +5,252 @@ Created on Thu Apr 10 14:39:12 2025
 
 @author: lguliano
 """
-from ACES_Camera_Data import ACES_Camera_Data
+from ACES_Camera_Data import ACES_Camera_Files, ACES_Camera_Index, Seq_List, Write_Frames
+from ReadSeqMod_Ganged import RoiFrames
+from aces_reader.profiling import stage
 
 import numpy as np
+import pandas as pd
 import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-def ACES_Dark(data, exp_time, gang_num):
-   
-    #Location of dark data, should be a singl SEQ file of the correct exposure time
-    dark_base = '/Users/lguliano/ACES/Data/DARKS/'
-    dark_dir = dark_base + str(exp_time)+'/'
+
+#Per-pixel mean of a stack of frames after iteratively rejecting values more than sigma standard deviations from the mean
+def Sigma_Clipped_Mean(stack, sigma=3.0, iterations=3):
+    
+    stack = stack.astype(np.float64)
+    for i in range(0, iterations):
+        mean = np.nanmean(stack, axis=0)
+        std = np.nanstd(stack, axis=0)
+        clipped = np.abs(stack - mean) > sigma * std
+        if not clipped.any():
+            break
+        stack[clipped] = np.nan
+    
+    return np.nanmean(stack, axis=0)
+
+#Bytes held per pixel of a tile while it is reduced: the int16 stack plus the working memory of the method
+#(the median partitions the stack in place, the sigma clip works on float64 copies and masks of it)
+DARK_TILE_BYTES = {'median': 2, 'sigma_clip': 2 + 25}
+
+#Build a dark frame from a directory of dark seq files without loading the full dark stack
+#The memory-mapped seq files are read in blocks of rows (tiles) covering every frame, and the tiles are reduced in parallel
+#Each tile only copies its own rows out of the seq files (SeqFile.read), so every dark file is read once over all the tiles
+#row_block defaults to the largest block that keeps the tiles being worked on under max_bytes (see DARK_TILE_BYTES)
+#method='median' is the exact per-pixel median (same as np.median over the full stack), 'sigma_clip' a sigma clipped mean
+def Build_Dark(dark_dir, gang_num, method='median', row_block=None, workers=4, max_bytes=512e6, sigma=3.0, iterations=3):
+    
+    if method not in DARK_TILE_BYTES:
+        raise ValueError('Unknown dark method: '+str(method))
+    
+    seq_files = ACES_Camera_Files(dark_dir, gang_num)
+    num_frames = sum(len(sf) for sf in seq_files)
+    rows, columns = seq_files[0].shape[1:]
+    
+    #Rows per tile, each tile holds every frame of its rows
+    if row_block is None:
+        row_block = int(max(1, min(rows, max_bytes // (workers * num_frames * columns * DARK_TILE_BYTES[method]))))
+    
+    print('Building '+method+' dark from '+str(num_frames)+' frames in tiles of '+str(row_block)+' rows')
+    
+    dark_frame = np.empty((rows, columns))
+    
+    #Reduce the rows [y1, y1+row_block) over the full dark stack
+    def Dark_Tile(y1):
+        y2 = min(y1 + row_block, rows)
+        stack = np.empty((num_frames, y2 - y1, columns), dtype=np.int16)
+        start = 0
+        for sf in seq_files:
+            sf.read(y_range=(y1, y2), out=stack[start:start+len(sf)])
+            start = start + len(sf)
+        if method == 'median':
+            dark_frame[y1:y2] = np.median(stack, axis=0, overwrite_input=True)
+        else:
+            dark_frame[y1:y2] = Sigma_Clipped_Mean(stack, sigma, iterations)
+    
+    #Reading the memory map and the median both release the GIL, so threads are enough to use several cores
+    with stage('Build_Dark', nbytes=num_frames*rows*columns*2, items=num_frames), ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(Dark_Tile, range(0, rows, row_block)))
     
-    #If the direcotry exists for that exposure time
-    if os.path.isdir(dark_dir) == True:
+    for sf in seq_files:
+        sf.close()
+    
+    return dark_frame
+
+#Library of every dark under dark_base, indexed once and kept in memory between datasets
+#Any directory holding dark seq files is a dark, the exposure time (ms, rounded like the processor) and FPA temperature come from the seq indexes
+#Recently used dark frames are kept in an LRU cache of cache_size frames
+#An exposure time with no dark data is synthesized by a per-pixel linear fit over the num_fit nearest exposures,
+#only between the shortest and longest exposure of the darks: the fit always uses the nearest exposure on each side of it
+#Outside of that range no dark is returned (like before the library) unless extrapolate=True, since the dark current
+#is only known to be linear over the exposures that were measured
+class DarkLibrary:
+    
+    def __init__(self, dark_base='/Users/lguliano/ACES/Data/DARKS/', cache_size=8, num_fit=2, method='median', extrapolate=False):
+        self.dark_base = dark_base
+        self.cache_size = cache_size
+        self.num_fit = num_fit
+        self.method = method
+        self.extrapolate = extrapolate
+        self.cache = OrderedDict()
+        self.entries = {}
+    
+    #Forget the index and cached frames (e.g. after new darks were taken)
+    def refresh(self):
+        self.cache.clear()
+        self.entries = {}
+    
+    #Table of the darks for a gang number: exp_time, fpa_temp, dark_dir, rows, columns
+    def index(self, gang_num):
+        
+        if gang_num in self.entries:
+            return self.entries[gang_num]
+        
+        rows = []
+        for dark_dir, dirs, files in sorted(os.walk(self.dark_base)):
+            dark_dir = os.path.join(dark_dir, '')
+            if len(Seq_List(dark_dir)) == 0:
+                continue
+            dark_index = ACES_Camera_Index(dark_dir, gang_num)
+            seq_files = ACES_Camera_Files(dark_dir, gang_num, list(dark_index['seq'][:1]))
+            shape = seq_files[0].shape[1:]
+            seq_files[0].close()
+            rows.append({'exp_time': round(dark_index['int_time'][0] * 1e3, 3),
+                         'fpa_temp': dark_index['fpa_temp'].mean(),
+                         'dark_dir': dark_dir,
+                         'rows': shape[0],
+                         'columns': shape[1]})
+        
+        entries = pd.DataFrame(rows, columns=['exp_time', 'fpa_temp', 'dark_dir', 'rows', 'columns'])
+        print('Indexed '+str(len(entries))+' darks under '+self.dark_base+' for gang number '+str(gang_num))
+        self.entries[gang_num] = entries
+        return entries
+    
+    #Dark frame of one indexed dark directory, built and saved as an npy file the first time
+    def load(self, entry, gang_num):
+        
+        key = (entry['dark_dir'], gang_num)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        
+        exp_time = str(entry['exp_time'])
+        dark_npy = entry['dark_dir']+'ACES_Darks_'+exp_time+'_g'+str(gang_num)+'.npy'
+        #Darks saved before the library only have the exposure time in the name
+        legacy_npy = entry['dark_dir']+'ACES_Darks_'+exp_time+'.npy'
         
-        #Set the name of the saved dark file as an npy file
-        dark_npy = dark_dir+'ACES_Darks_'+str(exp_time)+'.npy'
+        dark_frame = None
+        for npy in [dark_npy, legacy_npy]:
+            if os.path.isfile(npy):
+                dark_frame = np.load(npy)
+                if dark_frame.shape == (entry['rows'], entry['columns']):
+                    print('Loading dark frame: '+npy)
+                    break
+                dark_frame = None
         
-        #First check if there is a dark already made and saved as a npy file
-        if os.path.isfile(dark_npy) == False:
-            #If not, create a median dark file from the dataset
+        if dark_frame is None:
             print()
             print('No dark file found for this exposure time...')
-            print('Creating median dark for exposure time: '+str(exp_time))
+            print('Creating '+self.method+' dark for exposure time: '+exp_time)
             print()
-            dark_data, dark_meta = ACES_Camera_Data(dark_dir, gang_num, frametype='Dark')
-            dark_frame = np.median(dark_data, axis=0).astype(int)
-            
-            #Save to dark file
+            dark_frame = Build_Dark(entry['dark_dir'], gang_num, self.method).astype(int)
             print()
             print('Saving dark file to: '+dark_npy)
             np.save(dark_npy, dark_frame)
         
-        #If an npy file is there, use it to perform dark subtraction
-        if os.path.isfile(dark_npy) == True:
-            print()
-            print('Loading dark frame: '+dark_npy)
-            dark_frame= np.load(dark_npy)
-            print()
-            print('Subtracting dark frame from data')
-            for d in range(0,len(data)):
-                data[d,:,:] =  data[d,:,:] - dark_frame
-    
-    #If there is no directory for dark data, exit and inform the user
-    else:
-        print('Dark data does not exist for that exposure time')
-        print('Please verifiy there is dark data at....')
-        print(dark_dir)
-        print('Data returned without dark subtraction')
-        
-    return data
\ No newline at end of file
+        self.cache[key] = dark_frame
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        
+        return dark_frame
+    
+    #Dark frame for an exposure time (ms), from the dark nearest in FPA temperature if several have that exposure time
+    #Returns None (and informs the user) if there are not enough darks to synthesize a missing exposure time,
+    #or it is outside of the range of the darks and extrapolate is False
+    def dark(self, exp_time, gang_num, fpa_temp=None):
+        
+        entries = self.index(gang_num)
+        if len(entries) > 0 and fpa_temp is not None:
+            entries = entries.iloc[np.argsort(np.abs(entries['fpa_temp'].to_numpy() - fpa_temp), kind='stable')]
+        
+        match = np.isclose(entries['exp_time'].to_numpy(dtype=float), exp_time, rtol=0, atol=5e-4)
+        if match.any():
+            return self.load(entries[match].iloc[0], gang_num)
+        
+        #One dark per exposure time (the nearest in temperature), then the num_fit nearest exposure times
+        entries = entries.drop_duplicates('exp_time')
+        if len(entries) < 2:
+            print('Dark data does not exist for that exposure time: '+str(exp_time))
+            print('and at least 2 exposure times are needed to synthesize it, please verifiy there is dark data at....')
+            print(self.dark_base)
+            print('Data returned without dark subtraction')
+            return None
+        
+        exp_times = entries['exp_time'].to_numpy(dtype=float)
+        order = np.argsort(np.abs(exp_times - exp_time), kind='stable')
+        below = order[exp_times[order] < exp_time]
+        above = order[exp_times[order] > exp_time]
+        if len(below) == 0 or len(above) == 0:
+            if not self.extrapolate:
+                print('Dark data does not exist for that exposure time: '+str(exp_time))
+                print('and it is outside of the exposure times of the darks ('+str(exp_times.min())+' to '+str(exp_times.max())+'), so it is not extrapolated')
+                print('Data returned without dark subtraction')
+                return None
+            fit = order[:self.num_fit]
+        else:
+            #Nearest exposure on each side, then the next nearest ones
+            fit = ([below[0], above[0]] + [i for i in order if i != below[0] and i != above[0]])[:max(self.num_fit, 2)]
+        
+        nearest = entries.iloc[fit]
+        key = ('fit', exp_time, gang_num, tuple(nearest['dark_dir']))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        
+        print()
+        print('Synthesizing dark for exposure time '+str(exp_time)+' from exposure times '+str(nearest['exp_time'].tolist()))
+        frames = np.array([self.load(entry, gang_num) for i, entry in nearest.iterrows()], dtype=np.float64)
+        exp_times = nearest['exp_time'].to_numpy(dtype=float)
+        
+        #Least squares line through each pixel of the neighbouring darks
+        slope, offset = np.polyfit(exp_times, frames.reshape(len(frames), -1), 1)
+        dark_frame = np.rint(offset + slope * exp_time).astype(int).reshape(frames.shape[1:])
+        
+        self.cache[key] = dark_frame
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        
+        return dark_frame
+
+#Libraries used by ACES_Dark_Frame (one per dark_base), created on first use so the dark directories are only indexed once per session
+DARK_LIBRARIES = {}
+
+#DarkLibrary of the darks under dark_base (the default DarkLibrary dark_base if None)
+def Dark_Library(dark_base=None):
+    
+    if dark_base not in DARK_LIBRARIES:
+        DARK_LIBRARIES[dark_base] = DarkLibrary() if dark_base is None else DarkLibrary(os.path.join(dark_base, ''))
+    return DARK_LIBRARIES[dark_base]
+
+#Load the dark frame for an exposure time (ms) from the DarkLibrary of dark_base (see Dark_Library)
+#Missing exposure times are synthesized from neighbouring exposures, None is only returned if that is not possible
+def ACES_Dark_Frame(exp_time, gang_num, fpa_temp=None, dark_base=None):
+    
+    return Dark_Library(dark_base).dark(exp_time, gang_num, fpa_temp)
+
+#Dark subtract data that has already been read, in place (result is cast to the dtype of data)
+#y_range/x_range/y_bin/x_bin must match the ones used to read the data (ACES_Camera_Data ROI and binning)
+#The full frame dark is cut and binned the same way before it is subtracted
+#To subtract while reading instead, pass the ACES_Dark_Frame to ACES_Camera_Data(dark=...)
+def ACES_Dark(data, exp_time, gang_num, y_range=None, x_range=None, y_bin=1, x_bin=1, clip=None):
+    
+    dark_frame = ACES_Dark_Frame(exp_time, gang_num)
+    
+    if dark_frame is not None:
+        dark_frame = RoiFrames(dark_frame[np.newaxis], y_range, x_range, y_bin, x_bin)[0]
+        print()
+        print('Subtracting dark frame from data')
+        Write_Frames(data, 0, data, dark_frame, clip)
+        
+    return data
@@ -12,113 +12,266 @@ Processing involves:
     Dark subtracting the dataset
     Interpolating positions of each frame using the log files
 
-Processed data is then saved as a h5py file (data) and a pickle file (meta and logs)
-h5py is better at saving large arrays quickly, but doesn't handle other objects well
-pickle is an easy way to handle objects (like a dataframe or our meta objects), but slow to save large numpy arrays
+Processed data is then saved as a single h5py file (data, meta and logs)
+The data is chunked for reading pixel time series (ACES_Storage), older files can be converted with ACES_Storage.Rechunk_File
+Meta and logs are saved one column per dataset so a restore can load just the columns it needs
+The frame counter report of each seq file (resets, dropped and duplicated frames) is saved as the 'frame_report' table
+Datasets processed before that saved meta and logs to a pickle file, which is still restored
 
 Quick restoration of processed data also happens here with the option to reprocess if needed
+New seq and log files added to a dataset since it was processed can be appended to the processed data,
+processed files that changed since (e.g. the last seq file of a live dataset, still being written) are read again
 
 User will end up with:
     data: numpy array of each camera frame, dark subtracted and frame count aligned
     logs: DataFrame of all logs with utcTime, position_0 (position), position_3 (frame number)
-    meta: array of meta objects containing header info for each frame, including the interpoalted positional values
+    meta: structured array (ReadSeqMod_Ganged.META_DTYPE) with header info for each frame, including the interpoalted positional values
 """
 
 
 import os
 import shutil
 import h5py
-import pickle
 import numpy as np
+import pandas as pd
 
-from ACES_Camera_Data import ACES_Camera_Data
+from ACES_Camera_Data import ACES_Camera_Data, ACES_Camera_Index, ACES_Camera_Meta, frame_count_fixer, frame_gap_report
 from ACES_Log_Data import ACES_Log_Data
-from ACES_Darks import ACES_Dark
+from aces_reader.mimic_log_parser import is_log_file
+from ACES_Darks import ACES_Dark_Frame
 
 from ACES_ToolKit import Camera_Log_Interpolation
+from aces_reader.profiling import PROFILER, stage, profiled
+from ACES_Storage import Save_Data, Save_Meta_Logs, Load_Meta_Logs, Append_Data, Append_Table, Load_Table, Save_Table, Lazy_Data
 
-def ACES_Processor():
- 
-#################################################################
-    ############## PARAMETER SETUP #################
-    #Number of subframes per main frame (ganged frames)
-    gang_num = 4
+#Sorted names of the log files in a log directory (same files and order as the log parser reads them)
+#Other files in the directory are left out, so they are never counted as new logs to append
+def Log_List(log_dir):
+    
+    log_path = os.path.join(os.path.expanduser('~'), 'ACES', log_dir)
+    if os.path.isdir(log_path) == False:
+        raise FileNotFoundError('Log directory does not exist: '+log_path)
+    
+    return sorted(log for log in next(os.walk(log_path))[2] if is_log_file(log))
 
-    #Main data directory
-    base_dir = '/Users/lguliano/ACES/Data/'
+#Dark frame of a dataset from its camera index following the dark policy of Process_Dataset, from the darks under dark_base
+def Dataset_Dark(camera_index, gang_num, dark, data_dir, dark_base):
     
-#################################################################
+    if dark == 'none':
+        return None
     
-    ############### DIRECTORY SELECTION ################
-    #Data directory (get from input)
-    print('The following data directories are available: ')
-    print()
-    print(os.listdir(base_dir))
+    #Exposure time and FPA temperature of the dataset from the seq file indexes (no need to read the data for it)
+    exp_time = round(camera_index['int_time'][0] * 1e3, 3)
+    dark_frame = ACES_Dark_Frame(exp_time, gang_num, camera_index['fpa_temp'].mean(), dark_base)
+    if dark_frame is None and dark == 'require':
+        raise FileNotFoundError('No dark frame for exposure time '+str(exp_time)+' of '+data_dir+' under '+dark_base)
+    
+    return dark_frame
+
+#Size and modification time (ns) of each file in a directory, saved with the processed data to tell later if a file changed
+def File_Stats(directory, names):
+    
+    path = os.path.join(os.path.expanduser('~'), 'ACES', directory)
+    stats = [os.stat(os.path.join(path, name)) for name in names]
+    
+    return [stat.st_size for stat in stats], [stat.st_mtime_ns for stat in stats]
+
+#Save the files (kind 'seq' or 'log') processed into a processed h5 file with their size and modification time
+def Save_File_Stats(f, kind, names, stats):
+    
+    f.attrs[kind+'_sizes'] = np.asarray(stats[0], dtype=np.int64)
+    f.attrs[kind+'_mtimes'] = np.asarray(stats[1], dtype=np.int64)
+    f.attrs[kind+'_files'] = list(names)
+
+#Number of processed files (kind 'seq' or 'log') at the start of names that have not changed since (same size and modification time)
+#Data processed before the sizes were saved can't tell, so its last processed file is taken as changed (e.g. still being written)
+def Unchanged_Files(f, kind, names, stats, data_dir):
+    
+    done = [str(name) for name in f.attrs[kind+'_files']]
+    if names[:len(done)] != done:
+        raise ValueError('Processed '+kind+' files of '+data_dir+' were removed or new files sort before them, overwrite the processed data')
+    
+    if kind+'_sizes' not in f.attrs:
+        return max(len(done) - 1, 0)
+    
+    changed = np.flatnonzero((np.asarray(stats[0][:len(done)]) != f.attrs[kind+'_sizes']) |
+                             (np.asarray(stats[1][:len(done)]) != f.attrs[kind+'_mtimes']))
+    if len(changed) > 0:
+        print('Processed '+kind+' files changed since they were processed: '+str([done[i] for i in changed]))
+        return int(changed[0])
+    
+    return len(done)
+
+#Append the seq and log files added to a dataset since it was processed to its processed h5 file
+#Seq files processed before that changed since (e.g. the last file of a live dataset, still growing) are read again with
+#every file after them, the frames they had are replaced. A changed log file reads all the logs again (they are small)
+#Only those files are read and dark subtracted, the frame counters and positions of the meta table are then redone over
+#the full dataset (meta columns only) so the result is the same as processing everything again
+#Everything is read and computed before the file is written, and the processed file lists are written last, so an append
+#that fails can be run again
+#New files have to sort after the processed ones
+@profiled()
+def Append_Dataset(data_dir, camera_dir, log_dir, save_file_h5, gang_num, dark, dark_base, workers):
+    
+    #Sizes before the files are read: a file that grows while it is read is read again by the next append
+    camera_index = ACES_Camera_Index(camera_dir, gang_num)
+    seq_all = list(camera_index['seq'])
+    seq_stats = File_Stats(camera_dir, seq_all)
+    log_all = Log_List(log_dir)
+    log_stats = File_Stats(log_dir, log_all)
+    
+    with h5py.File(save_file_h5, 'r') as f:
+        if 'seq_files' not in f.attrs or 'raw_frame_counter' not in f:
+            raise ValueError(data_dir+' was processed before appending was possible, overwrite it once first')
+        seq_keep = Unchanged_Files(f, 'seq', seq_all, seq_stats, data_dir)
+        log_keep = Unchanged_Files(f, 'log', log_all, log_stats, data_dir)
+        log_done = len(f.attrs['log_files'])
+        #Rows of the logs from the processed log files (a failed append may have left more)
+        log_rows = int(f.attrs['log_rows']) if 'log_rows' in f.attrs else len(f['logs'][f['logs'].attrs['columns'][0]])
+    
+    new_seqs = seq_all[seq_keep:]
+    new_logs = log_all[log_keep:]
     print()
-    data_dir = input(prompt='Which dataset should be processed?: ')
-    full_data_dir = base_dir + data_dir + '/'
+    print(str(len(new_seqs))+' new or changed seq files and '+str(len(new_logs))+' new or changed log files')
+    if len(new_seqs) == 0 and len(new_logs) == 0:
+        print('Processed data is up to date')
+        return
     
-    #Check to make sure that exists, try again if it doesn't
-    while os.path.isdir(full_data_dir) == False:
-        print()
-        print('That directory does not exist')
-        print('Please select again from the following options: ')
-        print()
-        print(os.listdir(base_dir))
+    #Frames of the files that are kept (unchanged since they were processed)
+    keep_frames = int(np.sum(camera_index['frames'][:seq_keep]))
+    
+    ############ READ THE NEW FILES #########################
+    if len(new_logs) > 0:
+        print('READING NEW DATA LOGS')
+        if log_keep < log_done:
+            #A processed log file changed, all the logs are read again
+            logs, log_start = ACES_Log_Data(log_dir), 0
+        else:
+            logs, log_start = ACES_Log_Data(log_dir, start_idx=log_keep), log_rows
+    
+    with h5py.File(save_file_h5, 'r') as f:
+        raw_counter = f['raw_frame_counter'][:keep_frames]
+        old_logs = Load_Table(f, 'logs', ['position_0', 'position_3'])[:log_start if len(new_logs) > 0 else log_rows]
+    
+    if len(new_seqs) > 0:
+        dark_frame = Dataset_Dark(camera_index, gang_num, dark, data_dir, dark_base)
+        
+        #Raw frame counters, reindexed below with the rest of the dataset
+        data, meta = ACES_Camera_Data(camera_dir, gang_num, frametype='raw', workers=workers, dtype=np.int32,
+                                      dark=dark_frame, seq_names=new_seqs)
+        if keep_frames + len(meta) != np.sum(camera_index['frames']):
+            raise ValueError('Seq files of '+data_dir+' changed while appending, run the append again')
+        
+        new_frames = camera_index['frames'][seq_keep:]
         print()
-        data_dir = input(prompt='Which dataset should be processed?: ')
-        full_data_dir = base_dir + data_dir + '/'
+        print('Frame counter report of the new files (raw counters):')
+        print(frame_gap_report(meta['frameCounter'], new_seqs, new_frames).to_string(index=False))
+        raw_counter = np.concatenate([raw_counter, meta['frameCounter']])
+    
+    #Frame counters, frame counter report and positions of the full dataset
+    counts = {'frameCounter': raw_counter.copy()}
+    frame_report = frame_gap_report(raw_counter, seq_all, list(camera_index['frames']))
+    frame_count_fixer(counts)
+    
+    print()
+    print('Interpolating Camera and Log data to assign distance to each frame')
+    all_logs = old_logs if len(new_logs) == 0 else pd.concat([old_logs, logs[['position_0', 'position_3']]], ignore_index=True)
+    positions = {'frameCounter': counts['frameCounter'], 'pos': None}
+    Camera_Log_Interpolation(positions, all_logs, None)
+    
+    ############ WRITE #########################
+    with h5py.File(save_file_h5, 'a') as f:
+        
+        if len(new_logs) > 0:
+            Append_Table(f, 'logs', logs, start=log_start)
+        
+        if len(new_seqs) > 0:
+            f['raw_frame_counter'].resize((len(raw_counter),))
+            f['raw_frame_counter'][keep_frames:] = raw_counter[keep_frames:]
+            Append_Data(f, data, start=keep_frames)
+            Append_Table(f, 'meta', meta, start=keep_frames)
+        
+        Save_Table(f, 'frame_report', frame_report)
+        f['meta/frameCounter'][:] = counts['frameCounter']
+        f['meta/pos'][:] = positions['pos']
+        
+        #Files processed, last so an append that failed before is done again
+        f.attrs['log_rows'] = log_start + len(logs) if len(new_logs) > 0 else log_rows
+        Save_File_Stats(f, 'log', log_all, log_stats)
+        Save_File_Stats(f, 'seq', seq_all, seq_stats)
+    
+    print()
+    print('New files appended to',save_file_h5)
+
+#Process (or restore) one dataset without any user input, base_dir + data_dir + '/' holds its Camera/ and Logs/ directories
+#data_option is what to do with the dataset: New (n), Overwrite (o), Append new files to (a) or Restore (r) its processed data
+#dark is the dark policy: 'library' subtracts the DarkLibrary dark if there is one, 'require' fails without a dark, 'none' skips it
+#dark_base is the directory of the dark library, base_dir + 'DARKS/' by default
+#workers is the number of processes reading the seq files (see ACES_Camera_Data)
+#meta_fields/log_fields restore only those meta and log columns (e.g. ['pos', 'frameCounter'])
+#lazy restores the data as an ACES_Storage.Lazy_Data, only read from the file when sliced
+#Each step is recorded as a profiling stage (aces_reader.profiling)
+@profiled()
+def Process_Dataset(data_dir, base_dir='/Users/lguliano/ACES/Data/', gang_num=4, data_option='n', dark='library',
+                    workers=None, meta_fields=None, log_fields=None, lazy=False, dark_base=None):
+    
+    full_data_dir = base_dir + data_dir + '/'
+    if dark_base is None:
+        dark_base = base_dir + 'DARKS/'
+    if os.path.isdir(full_data_dir) == False:
+        raise FileNotFoundError('Dataset directory does not exist: '+full_data_dir)
+    if data_option not in ['n', 'o', 'a', 'r']:
+        raise ValueError('Unknown data option: '+str(data_option))
+    if dark not in ['library', 'require', 'none']:
+        raise ValueError('Unknown dark policy: '+str(dark))
         
     #subdirectories
     camera_dir = full_data_dir + 'Camera/'
     log_dir = full_data_dir + 'Logs/'
     processed_dir = full_data_dir + 'Processed/'
-
+    save_file_h5 = processed_dir + data_dir + '_processed_data.h5'
+    save_file_pkl = processed_dir + data_dir + '_processed_meta_logs.pkl'
     
-    ################# DETEREMINE WHAT TO DO WITH DATA ##############
-    #If processed directory exists
-    if os.path.isdir(processed_dir):
-        #And it is not empty
-        if len(os.listdir(processed_dir)) != 0:
-            print('Processed data already exists for this data set')
-            print()
-            data_option = input(prompt='Would you like to Restore (r) or Overwrite (o) this data?: ')
-            
-            while data_option not in ['r', 'o']:
-                print()
-                print('Invalid choice')
-                data_option = input(prompt='Would you like to Restore (r) or Overwrite (o) this data?: ')
-                
-            #Verify before overwriting data
-            if data_option ==  'o':
-                verify = 'no'
-                while verify != 'yes':
-                    print('Are you sure you want to overwrite this data?!')
-                    verify = input('Type `yes` if you are sure you want to overwrite this data (ctrl-c to exit): ')
-       
-        #If processed data directory exists but is empty
-        else:
-            print('Removing EMPTY processed data directory')
-            shutil.rmtree(processed_dir) 
-            #Treat it as new data to process
-            data_option = 'n'
-   
-    #If no processed directory exists yet 
-    else:
-        #Set data option to New (n) to process new dataset
-        print('No processed data exists for this dataset')
+    #If processed data directory exists but is empty, treat it as new data to process
+    if os.path.isdir(processed_dir) and len(os.listdir(processed_dir)) == 0:
+        print('Removing EMPTY processed data directory')
+        shutil.rmtree(processed_dir)
+        if data_option in ['a', 'r']:
+            raise FileNotFoundError('No processed data to restore for '+data_dir)
         data_option = 'n'
- 
+    
+    if data_option == 'n' and os.path.isdir(processed_dir):
+        raise FileExistsError('Processed data already exists for '+data_dir)
+    if data_option in ['a', 'r'] and os.path.isdir(processed_dir) == False:
+        raise FileNotFoundError('No processed data to restore for '+data_dir)
+    
+    ################# APPEND NEW FILES ##############
+    if data_option == 'a':
+        Append_Dataset(data_dir, camera_dir, log_dir, save_file_h5, gang_num, dark, dark_base, workers)
+        
+        #Then restore the full dataset
+        data_option = 'r'
         
     ################# PROCESS NEW DATA ##############        
     if data_option == 'n' or data_option == 'o':
         
+        #Sizes of the files before they are read, so a file still being written is read again by an append
+        log_files = Log_List(log_dir)
+        log_stats = File_Stats(log_dir, log_files)
+        
         ############ READ IN THE LOG DATA #########################
         print('READING DATA LOGS')
-        logs = ACES_Log_Data(log_dir)
+        with stage('read_logs'):
+            logs = ACES_Log_Data(log_dir)
+        
+        #Dark frame for the exposure time and FPA temperature of the dataset
+        with stage('dark'):
+            camera_index = ACES_Camera_Index(camera_dir, gang_num)
+            seq_stats = File_Stats(camera_dir, list(camera_index['seq']))
+            dark_frame = Dataset_Dark(camera_index, gang_num, dark, data_dir, dark_base)
     
         #If overwriting data, first delete exist processed data
-        if data_option == 'o':
+        if data_option == 'o' and os.path.isdir(processed_dir):
             print('Removing processed data')
             shutil.rmtree(processed_dir)
         
@@ -126,31 +279,37 @@ def ACES_Processor():
         print('Creating directory',processed_dir)
         os.mkdir(processed_dir)
         
-        #Read camera data and meta data
-        data, meta = ACES_Camera_Data(camera_dir, gang_num)
-        
-        # Dark subtraction
-        exp_time = round(meta[0].intTime * 1e3, 3)
-        data = ACES_Dark(data, exp_time, gang_num)
+        #Read camera data and meta data, dark subtracted while reading (int32 keeps negative values)
+        data, meta = ACES_Camera_Data(camera_dir, gang_num, workers=workers, dtype=np.int32, dark=dark_frame,
+                                      seq_names=camera_index['seq'])
         
         #Use interpolation of log data to assign positional value to each frame (meta object)
         print()
         print('Interpolating Camera and Log data to assign distance to each frame')
         Camera_Log_Interpolation(meta, logs, data)
         
-        #Save data as H5Py Objects and Meta/Logs as Pickle Objects
+        #Save data, meta and logs as H5Py Objects
         print()
         print('Saving processed data files....')
-        save_file_h5 = processed_dir + data_dir + '_processed_data.h5'
-        save_file_pkl = processed_dir + data_dir + '_processed_meta_logs.pkl'
         
         #Save data to h5py for smaller file size and faster processing
-        with h5py.File(save_file_h5, 'w') as f:
-            f.create_dataset('data', data=data)
+        #Chunked for fast pixel time series reads (see ACES_Storage)
+        with stage('save', nbytes=data.nbytes, items=len(data)), h5py.File(save_file_h5, 'w') as f:
+            Save_Data(f, data)
+            
+            #Files (with their sizes) and raw frame counters processed, so new files can be appended later
+            Save_File_Stats(f, 'seq', list(camera_index['seq']), seq_stats)
+            Save_File_Stats(f, 'log', log_files, log_stats)
+            f.attrs['log_rows'] = len(logs)
+            raw_counter = ACES_Camera_Meta(camera_dir, gang_num, frametype='raw')['frameCounter']
+            f.create_dataset('raw_frame_counter', data=raw_counter, maxshape=(None,), chunks=True)
+            
+            #Resets, dropped, duplicated and out of order frames of each seq file (load with Load_Table(f, 'frame_report'))
+            Save_Table(f, 'frame_report', frame_gap_report(raw_counter, list(camera_index['seq']), list(camera_index['frames'])))
         
-        #Save logs and meta data to pickle object since it handles it better
-        with open(save_file_pkl, 'wb') as e:  
-            pickle.dump([meta, logs], e)
+        #Meta and logs as columns in the same file
+        with stage('save_meta_logs'):
+            Save_Meta_Logs(save_file_h5, meta, logs)
             
         print()
         print('New data files saved under',processed_dir)
@@ -159,42 +318,97 @@ def ACES_Processor():
     if data_option == 'r':
         print('Restoring dataset')
         
-        #Find saved data
-        save_file_h5 = processed_dir + data_dir + '_processed_data.h5'
-        save_file_pkl = processed_dir + data_dir + '_processed_meta_logs.pkl'
-        
         #Restore processed data from h5py object
-        with h5py.File(save_file_h5, 'r') as f:
-            data = np.array(f['data'])
-        
-        # Restore the pickled meta and log data
-        with open(save_file_pkl, 'rb') as e:
-            meta, logs = pickle.load(e)
+        with stage('restore') as record:
+            if lazy:
+                data = Lazy_Data(save_file_h5)
+            else:
+                with h5py.File(save_file_h5, 'r') as f:
+                    data = np.array(f['data'])
+                record.bytes = data.nbytes
+            
+            #Restore the meta and log columns (from the pickle file for older processed data)
+            meta, logs = Load_Meta_Logs(save_file_h5, meta_fields, log_fields, save_file_pkl)
+            record.items = len(meta)
 
     #Return data, meta, and logs for analysis and the name of the working directory
     return data, meta, logs, full_data_dir
 
+#Interactive version of Process_Dataset, asks which dataset to process and what to do with existing processed data
+#meta_fields/log_fields restore only those meta and log columns (e.g. ['pos', 'frameCounter'])
+#lazy restores the data without reading it (see Process_Dataset)
+def ACES_Processor(meta_fields=None, log_fields=None, lazy=False):
+ 
+#################################################################
+    ############## PARAMETER SETUP #################
+    #Number of subframes per main frame (ganged frames)
+    gang_num = 4
 
-#########################################
-#data, meta, logs = ACES_Processor()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    #Main data directory
+    base_dir = '/Users/lguliano/ACES/Data/'
+    
+#################################################################
+    
+    ############### DIRECTORY SELECTION ################
+    #Data directory (get from input)
+    print('The following data directories are available: ')
+    print()
+    print(os.listdir(base_dir))
+    print()
+    data_dir = input(prompt='Which dataset should be processed?: ')
+    full_data_dir = base_dir + data_dir + '/'
+    
+    #Check to make sure that exists, try again if it doesn't
+    while os.path.isdir(full_data_dir) == False:
+        print()
+        print('That directory does not exist')
+        print('Please select again from the following options: ')
+        print()
+        print(os.listdir(base_dir))
+        print()
+        data_dir = input(prompt='Which dataset should be processed?: ')
+        full_data_dir = base_dir + data_dir + '/'
+        
+    processed_dir = full_data_dir + 'Processed/'
 
+    
+    ################# DETEREMINE WHAT TO DO WITH DATA ##############
+    #If processed directory exists and it is not empty
+    if os.path.isdir(processed_dir) and len(os.listdir(processed_dir)) != 0:
+        print('Processed data already exists for this data set')
+        print()
+        data_option = input(prompt='Would you like to Restore (r), Append new files to (a) or Overwrite (o) this data?: ')
+        
+        while data_option not in ['r', 'a', 'o']:
+            print()
+            print('Invalid choice')
+            data_option = input(prompt='Would you like to Restore (r), Append new files to (a) or Overwrite (o) this data?: ')
+            
+        #Verify before overwriting data
+        if data_option ==  'o':
+            verify = 'no'
+            while verify != 'yes':
+                print('Are you sure you want to overwrite this data?!')
+                verify = input('Type `yes` if you are sure you want to overwrite this data (ctrl-c to exit): ')
+   
+    #If no processed data exists yet (an empty processed directory is removed by Process_Dataset)
+    else:
+        #Set data option to New (n) to process new dataset
+        print('No processed data exists for this dataset')
+        data_option = 'n'
+    
+    profile_start = len(PROFILER)
+    data, meta, logs, full_data_dir = Process_Dataset(data_dir, base_dir, gang_num, data_option,
+                                                      meta_fields=meta_fields, log_fields=log_fields, lazy=lazy)
+    
+    #Time and memory of each processing step, saved with the processed data
+    print()
+    print(PROFILER.summary_table(profile_start))
+    if data_option != 'r':
+        PROFILER.save_report(processed_dir + data_dir + '_profile.json', profile_start)
+    
+    return data, meta, logs, full_data_dir
 
 
+#########################################
+#data, meta, logs = ACES_Processor()
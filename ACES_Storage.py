@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HDF5 layout of the processed ACES data
+
+Processed data is mostly read one pixel (or a small ROI) at a time across every frame
+(Sampler, ACES_Transformer, the pixel plotters), so the data is stored in chunks that
+are long in time and small in space: a pixel time series is a few chunk reads instead
+of one read per frame of a contiguous (frame by frame) dataset
+
+A single frame still has to decompress every chunk it crosses, all frames of them, so
+the frames per chunk are capped (max_frames) to keep frame reads quick too (quick looks,
+ACES_Multi_Frame_Image). On 1000 frames of 127 x 640 int32:
+    (976, 16, 16) chunks: 1.5 s per frame,  8 ms per pixel time series
+    ( 64, 16, 16) chunks:  60 ms per frame, 7 ms per pixel time series (default)
+More frames per chunk makes time series a little faster and frames slower, and
+larger tiles make frames faster and time series slower (more pixels decompressed)
+
+Chunks are compressed with the byte shuffle filter + lzf, which is lossless and fast,
+and the frame axis is resizable so data can be appended later
+
+Rechunk_File converts processed files saved before this layout
+
+Lazy_Data opens the frame data without reading it, frames are only read when sliced
+
+The meta table and logs are saved in the same file, one dataset per column (Save_Table),
+so a restore only reads the columns it needs (e.g. pos and frameCounter)
+"""
+
+import os
+import h5py
+import pickle
+import numpy as np
+import pandas as pd
+
+from ReadSeqMod_Ganged import MetaObjectsToTable
+
+
+#Chunk shape for a (frames, rows, columns) dataset: tile x tile pixels over as many frames as fit in chunk_bytes,
+#at most max_frames (a frame read decompresses max_frames frames of every chunk it crosses, see the trade-off above)
+#h5py works best with chunks of roughly 10 KB to 1 MB
+def Chunk_Shape(shape, dtype, tile=16, chunk_bytes=1e6, max_frames=64):
+
+    frames, rows, columns = shape[0], shape[1], shape[2]
+    tile_y = max(1, min(rows, tile))
+    tile_x = max(1, min(columns, tile))
+    chunk_frames = int(chunk_bytes // (tile_y * tile_x * np.dtype(dtype).itemsize))
+    chunk_frames = max(1, min(frames, max_frames, chunk_frames))
+
+    return (chunk_frames, tile_y, tile_x) + tuple(shape[3:])
+
+#Create a chunked, compressed and resizable (along frames) dataset for frame data
+def Create_Data_Dataset(f, name, shape, dtype, tile=16, chunk_bytes=1e6, compression='lzf'):
+
+    return f.create_dataset(name, shape=shape, dtype=dtype,
+                            chunks=Chunk_Shape(shape, dtype, tile, chunk_bytes),
+                            maxshape=(None,) + tuple(shape[1:]),
+                            shuffle=True, compression=compression)
+
+#Save frame data with the time series chunk layout
+#The data is written one block of chunks along the frame axis at a time
+def Save_Data(f, data, name='data', tile=16, chunk_bytes=1e6, compression='lzf'):
+
+    dset = Create_Data_Dataset(f, name, data.shape, data.dtype, tile, chunk_bytes, compression)
+    block = dset.chunks[0]
+    for start in range(0, len(data), block):
+        dset[start:start+block] = data[start:start+block]
+
+    return dset
+
+#Add frames to the end of a dataset made by Save_Data (the frame axis is resizable)
+#start writes them from that frame instead, dropping the frames after it (e.g. the frames of a seq file read again)
+def Append_Data(f, data, name='data', start=None):
+
+    dset = f[name]
+    if start is None:
+        start = len(dset)
+    dset.resize((start + len(data),) + dset.shape[1:])
+    block = dset.chunks[0]
+    for i in range(0, len(data), block):
+        dset[start+i:start+i+block] = data[i:i+block]
+
+    return dset
+
+#Chunk cache (bytes, slots) holding every chunk a frame read crosses, so reading the frames of a chunk one at a time
+#only decompresses the chunks once (the h5py default of 1 MB is smaller than a single 1 MB chunk)
+#Slots are ~100 per cached chunk as recommended by HDF5
+def Chunk_Cache(dset, max_bytes=512e6):
+
+    if dset.chunks is None:
+        return 1024**2, 521
+    chunks_per_frame = int(np.prod([-(-n // c) for n, c in zip(dset.shape[1:], dset.chunks[1:])]))
+    chunk_bytes = int(np.prod(dset.chunks)) * dset.dtype.itemsize
+    nbytes = int(min(max_bytes, max(1024**2, chunks_per_frame * chunk_bytes)))
+
+    return nbytes, 100 * max(1, nbytes // chunk_bytes) + 1
+
+#Frame data of an h5 file that is only read when sliced, data[i], data[:, y1:y2, x1:x2] etc. return numpy arrays
+#Has len, shape, ndim, dtype and size like an array, np.asarray(data) reads everything
+#The chunk cache is sized to the chunk layout (Chunk_Cache), so stepping through frames doesn't decompress the same chunks again
+#The file stays open until close() (or the end of a with block)
+class Lazy_Data:
+
+    def __init__(self, h5_file, name='data'):
+        self.filename = h5_file
+        self.name = name
+        with h5py.File(h5_file, 'r') as f:
+            cache_bytes, cache_slots = Chunk_Cache(f[name])
+        self.file = h5py.File(h5_file, 'r', rdcc_nbytes=cache_bytes, rdcc_nslots=cache_slots)
+        self.dset = self.file[name]
+        self.shape = self.dset.shape
+        self.ndim = self.dset.ndim
+        self.dtype = self.dset.dtype
+        self.size = self.dset.size
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        return np.asarray(self.dset[key])
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.dset[()], dtype=dtype)
+
+    def __repr__(self):
+        return 'Lazy_Data('+self.filename+', shape='+str(self.shape)+', dtype='+str(self.dtype)+')'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.dset = None
+
+    #Pickled as the file (and its modification time, so a changed file is a different object), e.g. for ACES_Stage_Cache
+    def __getstate__(self):
+        return {'filename': self.filename, 'name': self.name, 'mtime_ns': os.stat(self.filename).st_mtime_ns}
+
+    def __setstate__(self, state):
+        self.__init__(state['filename'], state['name'])
+
+#Copy an existing processed (or binned) h5 file to the time series chunk layout
+#Every other dataset, group and attribute is copied as is
+#The file is converted in place (through a temporary file) unless out_file is given
+def Rechunk_File(h5_file, out_file=None, name='data', tile=16, chunk_bytes=1e6, compression='lzf', block_frames=None):
+
+    tmp_file = (out_file or h5_file) + '.rechunk.tmp'
+    print('Rechunking '+h5_file)
+
+    with h5py.File(h5_file, 'r') as f_in, h5py.File(tmp_file, 'w') as f_out:
+        f_out.attrs.update(f_in.attrs)
+        for key in f_in:
+            if key != name:
+                f_in.copy(key, f_out)
+
+        data = f_in[name]
+        dset = Create_Data_Dataset(f_out, name, data.shape, data.dtype, tile, chunk_bytes, compression)
+        dset.attrs.update(data.attrs)
+
+        #Whole chunks along the frame axis of both layouts, so each old chunk is only decompressed once
+        if block_frames is None:
+            old_frames = data.chunks[0] if data.chunks is not None else 1
+            block_frames = -(-max(old_frames, dset.chunks[0]) // dset.chunks[0]) * dset.chunks[0]
+        for start in range(0, len(data), block_frames):
+            dset[start:start+block_frames] = data[start:start+block_frames]
+
+        print('Chunks: '+str(data.chunks)+' -> '+str(dset.chunks))
+
+    os.replace(tmp_file, out_file or h5_file)
+
+#Rechunk every processed data file under a data directory (base_dir/<dataset>/Processed/<dataset>_processed_data.h5)
+#Files that already use the time series layout are skipped
+def Rechunk_Processed(base_dir, tile=16, chunk_bytes=1e6, compression='lzf'):
+
+    for data_dir in sorted(os.listdir(base_dir)):
+        h5_file = base_dir + data_dir + '/Processed/' + data_dir + '_processed_data.h5'
+        if os.path.isfile(h5_file) == False:
+            continue
+
+        with h5py.File(h5_file, 'r') as f:
+            data = f['data']
+            done = data.chunks == Chunk_Shape(data.shape, data.dtype, tile, chunk_bytes)
+
+        if done:
+            print('Already rechunked: '+h5_file)
+        else:
+            Rechunk_File(h5_file, tile=tile, chunk_bytes=chunk_bytes, compression=compression)
+
+#Values of a table column as they are saved in h5py and whether they are datetimes (saved as int64 ns since 1970)
+def Table_Column(table, col):
+
+    values = table[col]
+    if isinstance(table, np.ndarray):
+        return values, False
+
+    if values.dtype == object:
+        if pd.api.types.infer_dtype(values) in ['datetime', 'datetime64', 'date']:
+            values = pd.to_datetime(values)
+        else:
+            values = values.astype(str)
+    values = values.to_numpy()
+    if values.dtype.kind == 'M':
+        return values.astype('datetime64[ns]').astype(np.int64), True
+    if values.dtype == object:
+        values = values.astype(h5py.string_dtype())
+
+    return values, False
+
+#Save a table as one dataset per column under a group, so columns can be loaded on their own
+#table is a structured array (meta) or a DataFrame (logs)
+#Datetime columns (including object columns of datetimes) are stored as int64 ns since 1970
+def Save_Table(f, name, table, compression='lzf'):
+
+    if name in f:
+        del f[name]
+    group = f.create_group(name)
+
+    if isinstance(table, np.ndarray):
+        group.attrs['kind'] = 'structured'
+        columns = list(table.dtype.names)
+    else:
+        group.attrs['kind'] = 'dataframe'
+        columns = [str(col) for col in table.columns]
+
+    datetimes = []
+    for col in columns:
+        values, datetime = Table_Column(table, col)
+        if datetime:
+            datetimes.append(col)
+        group.create_dataset(col, data=values, maxshape=(None,), chunks=True, compression=compression)
+
+    group.attrs['columns'] = columns
+    group.attrs['datetimes'] = datetimes
+
+    return group
+
+#Add rows to the end of a table saved by Save_Table (same columns)
+#start writes them from that row instead, dropping the rows after it (like Append_Data)
+def Append_Table(f, name, table, start=None):
+
+    group = f[name]
+    for col in group.attrs['columns']:
+        values, datetime = Table_Column(table, col)
+        dset = group[col]
+        row = len(dset) if start is None else start
+        dset.resize((row + len(values),))
+        dset[row:] = values
+
+    return group
+
+#Load a table saved by Save_Table, only reading the columns in fields (all columns if None)
+#Returns a structured array or a DataFrame, whichever was saved
+def Load_Table(f, name, fields=None):
+
+    group = f[name]
+    columns = [str(col) for col in group.attrs['columns']]
+    datetimes = [str(col) for col in group.attrs['datetimes']]
+    if fields is not None:
+        missing = [field for field in fields if field not in columns]
+        if len(missing) > 0:
+            raise KeyError('Fields not saved in '+name+': '+str(missing))
+        columns = [col for col in columns if col in fields]
+
+    if group.attrs['kind'] == 'structured':
+        dtype = np.dtype([(col, group[col].dtype) for col in columns])
+        table = np.empty(len(group[columns[0]]) if len(columns) > 0 else 0, dtype=dtype)
+        for col in columns:
+            table[col] = group[col][()]
+        return table
+
+    table = {}
+    for col in columns:
+        values = group[col][()]
+        if col in datetimes:
+            values = values.astype('datetime64[ns]')
+        elif values.dtype == object:
+            values = values.astype(str)
+        table[col] = values
+
+    return pd.DataFrame(table, columns=columns)
+
+#Save the meta table and logs of a processed dataset next to its data (groups 'meta' and 'logs')
+def Save_Meta_Logs(h5_file, meta, logs):
+
+    with h5py.File(h5_file, 'a') as f:
+        Save_Table(f, 'meta', meta)
+        Save_Table(f, 'logs', logs)
+
+#Load the meta table and logs of a processed dataset, only the columns in meta_fields/log_fields if given
+#Datasets processed before the columnar layout fall back to their pickle file
+def Load_Meta_Logs(h5_file, meta_fields=None, log_fields=None, pkl_file=None):
+
+    if os.path.isfile(h5_file):
+        with h5py.File(h5_file, 'r') as f:
+            if 'meta' in f and 'logs' in f:
+                return Load_Table(f, 'meta', meta_fields), Load_Table(f, 'logs', log_fields)
+
+    if pkl_file is None or os.path.isfile(pkl_file) == False:
+        raise FileNotFoundError('No meta or logs saved in '+h5_file)
+
+    print('Restoring meta data and logs from '+pkl_file)
+    with open(pkl_file, 'rb') as e:
+        meta, logs = pickle.load(e)
+
+    #Older processed data saved meta as a list of FrameMeta objects
+    if isinstance(meta, list):
+        meta = MetaObjectsToTable(meta)
+    if meta_fields is not None:
+        meta = meta[list(meta_fields)]
+    if log_fields is not None:
+        logs = logs[list(log_fields)]
+
+    return meta, logs
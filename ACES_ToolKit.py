@@ -12,28 +12,29 @@ Created on Wed Mar 12 17:20:50 2025
 
 import numpy as np
 import h5py
-import pickle
 import pandas as pd
 import os
+import time
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from scipy import sparse
 from scipy.fft import rfft, rfftfreq
 
+from ACES_Storage import Save_Data, Load_Meta_Logs, Lazy_Data
+from aces_reader.profiling import PROFILER, profiled
+
 
 ##########################################################################
 ##########################################################################
 
-#Function that adds interpolated position from log files into the camera meta objects
+#Function that adds interpolated position from log files into the camera meta table
+@profiled()
 def Camera_Log_Interpolation(meta, logs, data):
     
-    #Arrays to fill from camera meta data and log df object to feed into np.interp
-    log_counts = []
-    log_position = []
-    
-    camera_counts = []
-
     #Get array of log positions
-    log_position_array = logs['position_0'].to_numpy()
-    for p in log_position_array:
-        log_position.append(p)
+    log_position = logs['position_0'].to_numpy()
     
     
     ######################
@@ -41,21 +42,16 @@ def Camera_Log_Interpolation(meta, logs, data):
     ######################
     
     #Get array of log counts
-    log_counts_array = logs['position_3'].to_numpy()
-    for c in log_counts_array:
-        log_counts.append(c)
+    log_counts = logs['position_3'].to_numpy()
      
-    #Get an array of the frame counts from the camera data
-    for c in meta:
-        camera_counts.append(c.frameCounter)
+    #Frame counts from the camera data
+    camera_counts = meta['frameCounter']
         
     #Use interpolation to get camera positional values
     camera_position = np.interp(camera_counts, log_counts, log_position)
     
-    #Append positional data to meta objects
-    for i in range(0, len(meta)):
-        #Camera positional data
-        meta[i].pos = camera_position[i]
+    #Write positional data to the pos column of the meta table
+    meta['pos'] = camera_position
  
 ##########################################################################
 ##########################################################################
@@ -69,43 +65,59 @@ def Data_Subset(data, y_range, x_range):
 ##########################################################################
 ##########################################################################
 
-#Average a defined bin size of pixels and return the data
-def Pixel_Averager(data, y_bin=1, x_bin=1, fullframe='n'):
+#Average a defined bin size of pixels and return the data (float64)
+#Frames are binned chunk_frames at a time with a reshape and mean, so data can also be a Lazy_Data or an h5py dataset
+#fullframe='y' averages the whole frame into a single pixel
+#edge sets what happens to the rows/columns left over when the frame isn't a multiple of the bin size:
+#   'drop': left out of the binned data (default)
+#   'partial': averaged into smaller bins on the bottom/right edges
+#   'pad': the last row/column is repeated to fill the edge bins
+@profiled(nbytes=lambda out: out.nbytes, items=len)
+def Pixel_Averager(data, y_bin=1, x_bin=1, fullframe='n', edge='drop', chunk_frames=1024):
+    
+    frames, rows, columns = data.shape[0], data.shape[1], data.shape[2]
     
     #If set to the full frame, bin the full frame
     if fullframe=='y':
-        y_bin = np.shape(data)[0]
-        x_bin = np.shape(data)[1]
+        y_bin = rows
+        x_bin = columns
+    
+    if edge not in ['drop', 'partial', 'pad']:
+        raise ValueError('Unknown edge handling: '+str(edge))
+    
+    #Rows/columns missing from the last bins (partial and pad) or left over (drop)
+    pad_y = -rows % y_bin
+    pad_x = -columns % x_bin
+    if edge == 'drop':
+        y_axis = rows // y_bin
+        x_axis = columns // x_bin
+    else:
+        y_axis = (rows + pad_y) // y_bin
+        x_axis = (columns + pad_x) // x_bin
     
-    print('Creating averaged bins of data '+str(y_bin)+'x'+str(x_bin))
-    #Get the shape of the binned data that will be returned, rounded to nearest whole number
-    y_axis = int(np.shape(data)[1] / y_bin)
-    x_axis = int(np.shape(data)[2] / x_bin)
+    print('Creating averaged bins of data '+str(y_bin)+'x'+str(x_bin)+' ('+str(y_axis)+'x'+str(x_axis)+' binned pixels)')
     
-    #number of frames
-    frames = np.shape(data)[0]
+    #Number of pixels averaged in each bin
+    counts = y_bin * x_bin
+    if edge == 'partial':
+        counts = np.pad(np.ones([rows, columns]), ((0, pad_y), (0, pad_x))).reshape(y_axis, y_bin, x_axis, x_bin).sum(axis=(1,3))
     
     #Array of avearge data with the correct binned frames
     average_data = np.zeros([frames, y_axis, x_axis])
     
-    for y in range(0,y_axis):
-        print('Working on binned row: '+str(y))
-        for x in range(0, x_axis):
-            #Get the correct indices for the binned data
-            y1 = y * y_bin
-            y2 = y1 + y_bin
-            x1 = x * x_bin
-            x2 = x1 + x_bin
-            
-            print('Averaging pxiels: '+str(y1)+':'+str(y2)+','+str(x1)+':'+str(x2))
-            
-            #Get the data for the bin of pixels
-            bin_data = data[:,y1:y2,x1:x2]
-            
-            #average over the y and  axis
-            bin_average = np.average(bin_data, axis=(1,2))
-            #Add to the averaged array
-            average_data[:,y,x] = bin_average
+    for f1 in range(0, frames, chunk_frames):
+        f2 = min(f1 + chunk_frames, frames)
+        block = np.asarray(data[f1:f2], dtype=np.float64)
+        
+        if edge == 'drop':
+            block = block[:, :y_axis*y_bin, :x_axis*x_bin]
+        elif edge == 'pad':
+            block = np.pad(block, ((0, 0), (0, pad_y), (0, pad_x)), mode='edge')
+        else:
+            block = np.pad(block, ((0, 0), (0, pad_y), (0, pad_x)))
+        
+        #Sum every bin at once and divide by the number of pixels in it
+        average_data[f1:f2] = block.reshape(f2-f1, y_axis, y_bin, x_axis, x_bin).sum(axis=(2,4)) / counts
     
     #return the avearged data
     return average_data
@@ -114,6 +126,7 @@ def Pixel_Averager(data, y_bin=1, x_bin=1, fullframe='n'):
 ##########################################################################
 
 #Seperate data into single scans       
+@profiled(items=len)
 def Scan_Selector(meta, path_length):
     print("Selecting Scans")
     
@@ -121,12 +134,7 @@ def Scan_Selector(meta, path_length):
     scan_list = []
     
     #array of the camera positional values
-    cam_pos = []
-    for m in meta:
-        cam_pos.append(m.pos)
-        
-    #Convert to numpy array 
-    cam_pos = np.array(cam_pos)
+    cam_pos = meta['pos']
     
     #Set upper and lower bounds for determining scan
     upper = np.average(cam_pos) + path_length 
@@ -168,12 +176,7 @@ def Scan_Selector(meta, path_length):
 def Positions_and_Real_Data(meta, real_data):
     
     #array of the camera positional values
-    cam_pos = []
-    for m in meta:
-        cam_pos.append(m.pos)
-        
-    #Convert to numpy array 
-    cam_pos = np.array(cam_pos)
+    cam_pos = np.array(meta['pos'])
     
     return cam_pos, real_data
 
@@ -182,22 +185,210 @@ def Positions_and_Real_Data(meta, real_data):
 #ZPD = Zero Path Difference
 #OPD = Optical Path Difference
 
+#OPD of every pixel of a scan without storing it per pixel
+#Each pixel's OPD is the shared positions (or sample grid) shifted by the pixel's ZPD, so only the positions (frames,),
+#the sampled OPD grid (samples,), the ZPD position map (y, x) and the direction of travel are kept
+#Indexed like the (frames, y, x) OPD cube (or the (samples, y, x) sampled OPD cube with sampled=True), OPD[:, y, x] etc.
+#only computes the requested values, np.asarray(OPD) builds the full cube
+class ScanOPD:
+    
+    def __init__(self, pos, OPD_grid, zero_path, direction, sampled=False):
+        self.pos = np.asarray(pos, dtype=np.float64)
+        self.OPD_grid = np.asarray(OPD_grid, dtype=np.float64)
+        self.zero_path = np.asarray(zero_path, dtype=np.float64)
+        self.direction = direction
+        self.sampled = sampled
+        
+        self.shape = (len(self.OPD_grid) if sampled else len(self.pos),) + self.zero_path.shape
+        self.ndim = len(self.shape)
+        self.dtype = np.dtype(np.float64)
+        self.size = int(np.prod(self.shape))
+    
+    #The sampled OPD of the same scan (sharing the same arrays)
+    def Sampled(self):
+        return ScanOPD(self.pos, self.OPD_grid, self.zero_path, self.direction, sampled=True)
+    
+    def __len__(self):
+        return self.shape[0]
+    
+    def __getitem__(self, key):
+        
+        if not isinstance(key, tuple):
+            key = (key,)
+        
+        #Frame (or sample) and pixel indexes, only integers and slices are computed directly
+        if len(key) > self.ndim or not all(isinstance(k, (int, np.integer, slice)) for k in key):
+            return np.asarray(self)[key]
+        key = key + (slice(None),)*(self.ndim - len(key))
+        
+        if self.sampled:
+            #Same sampled OPD for every pixel
+            values = self.OPD_grid[key[0]]
+            pixels = self.zero_path[key[1:]]
+            return np.add.outer(values, np.zeros_like(pixels))
+        
+        #OPD is the distance from ZPD * 2
+        return np.subtract.outer(self.pos[key[0]], self.zero_path[key[1:]]) * 2
+    
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+    
+    def __repr__(self):
+        return 'ScanOPD('+('sampled, ' if self.sampled else '')+'shape='+str(self.shape)+', direction='+self.direction+')'
+
+#Linear interpolation of a scan to its evenly spaced OPD samples as sparse matrices
+#Every pixel of a scan has the same positions and sample grid, only the ZPD differs, so there is one
+#(samples, frames) matrix per distinct ZPD, with 2 weights per row: sample_data = matrix @ pixel_data
+#Matrices are built for each Apply and not kept by the operator, see RESAMPLING_MATRICES to keep them between scans
+class Resampling_Operator:
+    
+    def __init__(self, pos, OPD_grid, direction):
+        self.pos = np.asarray(pos, dtype=np.float64)
+        self.OPD_grid = np.asarray(OPD_grid, dtype=np.float64)
+        self.direction = direction
+        self.key = Resampling_Operator.Trajectory_Key(self.pos, self.OPD_grid, direction)
+    
+    #Key of a scan trajectory: positions, sample grid and direction
+    @staticmethod
+    def Trajectory_Key(pos, OPD_grid, direction):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(np.ascontiguousarray(pos, dtype=np.float64).tobytes())
+        h.update(np.ascontiguousarray(OPD_grid, dtype=np.float64).tobytes())
+        h.update(direction.encode())
+        return h.hexdigest()
+    
+    #Interpolation matrix for the pixels with their ZPD at position zero_path
+    #Same result as np.interp(OPD_grid, OPD, pixel data) with OPD = (pos - zero_path)*2 (reversed for backwards scans)
+    def Matrix(self, zero_path):
+        
+        matrix = RESAMPLING_MATRICES.get((self.key, zero_path))
+        if matrix is not None:
+            return matrix
+        
+        frames = len(self.pos)
+        OPD = (self.pos - zero_path) * 2
+        
+        #Numpy interp can only only INCREASING X values, so work on the inverted OPD for backwards scans
+        frame_index = np.arange(frames)
+        if self.direction == 'negative':
+            OPD = OPD[::-1]
+            frame_index = frame_index[::-1]
+        
+        #Position at or before each sample and the weight of the position after it
+        j = np.searchsorted(OPD, self.OPD_grid, side='right') - 1
+        j_c = np.clip(j, 0, frames-2)
+        x0 = OPD[j_c]
+        x1 = OPD[j_c+1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w = (self.OPD_grid - x0) / (x1 - x0)
+        w[self.OPD_grid == x0] = 0
+        #Samples outside of the scan take the first or last value
+        w[j < 0] = 0
+        w[j >= frames-1] = 1
+        w[self.OPD_grid > OPD[-1]] = 1
+        
+        rows = np.arange(len(self.OPD_grid))
+        matrix = sparse.csr_matrix((np.concatenate([1-w, w]),
+                                    (np.concatenate([rows, rows]), np.concatenate([frame_index[j_c], frame_index[j_c+1]]))),
+                                   shape=(len(self.OPD_grid), frames))
+        #Remove the zero weights of samples on a position
+        matrix.eliminate_zeros()
+        RESAMPLING_MATRICES.put((self.key, zero_path), matrix)
+        
+        return matrix
+    
+    #Interpolate pixel_data (frames, pixels) with the ZPD of each pixel at zero_path (pixels,), returns (samples, pixels)
+    #Pixels are grouped by ZPD so each group is a single sparse matrix product
+    #Done pixel by pixel in memory (pixels, frames) so every group is read and written as whole rows
+    def Apply(self, zero_path, pixel_data):
+        
+        zero_paths, inverse = np.unique(zero_path, return_inverse=True)
+        groups = np.split(np.argsort(inverse, kind='stable'), np.cumsum(np.bincount(inverse))[:-1])
+        
+        pixel_series = np.ascontiguousarray(np.transpose(pixel_data))
+        sample_series = np.empty([pixel_data.shape[1], len(self.OPD_grid)])
+        for zp, pixels in zip(zero_paths, groups):
+            sample_series[pixels] = (self.Matrix(zp) @ pixel_series[pixels].T).T
+        
+        return np.transpose(sample_series)
+
+#Interpolation matrices of the most recently used (scan trajectory, ZPD) pairs, up to max_bytes of matrices
+#Re-analysing the same scans (e.g. with another ROI or binning) reuses their weights instead of building them again
+#A scan has one matrix per distinct ZPD, so the cache is bounded by bytes (RESAMPLING_CACHE_BYTES by default,
+#ACES_Interpolator(cache_bytes=...) to change it, 0 keeps nothing)
+#The cache is per process: with ACES_Interpolator(workers>1) every worker starts with an empty cache and is closed
+#with the pool, so parallel runs build every matrix and keep none (the time goes to the workers instead)
+RESAMPLING_CACHE_BYTES = 256e6
+
+class Resampling_Matrix_Cache:
+    
+    def __init__(self, max_bytes=RESAMPLING_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.matrices = OrderedDict()
+        self.nbytes = 0
+    
+    @staticmethod
+    def Matrix_Bytes(matrix):
+        return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    
+    def get(self, key):
+        matrix = self.matrices.get(key)
+        if matrix is not None:
+            self.matrices.move_to_end(key)
+        return matrix
+    
+    #Keep a matrix, removing the least recently used ones to stay under max_bytes
+    def put(self, key, matrix):
+        nbytes = Resampling_Matrix_Cache.Matrix_Bytes(matrix)
+        if key in self.matrices or nbytes > self.max_bytes:
+            return
+        self.matrices[key] = matrix
+        self.nbytes = self.nbytes + nbytes
+        self.resize(self.max_bytes)
+    
+    #Change max_bytes, removing the least recently used matrices to stay under it
+    def resize(self, max_bytes):
+        self.max_bytes = max_bytes
+        while self.nbytes > self.max_bytes:
+            key, oldest = self.matrices.popitem(last=False)
+            self.nbytes = self.nbytes - Resampling_Matrix_Cache.Matrix_Bytes(oldest)
+    
+    def __len__(self):
+        return len(self.matrices)
+    
+    def clear(self):
+        self.matrices = OrderedDict()
+        self.nbytes = 0
+
+RESAMPLING_MATRICES = Resampling_Matrix_Cache()
+
 #Sort the camera position and real data by position, then evenly sample and return
+#Done for every pixel at once: ZPD from the brightest frame of each pixel (argmax), the same evenly spaced OPD samples
+#for every pixel and the interpolation weights of the scan from its Resampling_Operator
+#OPD and OPD_sample are returned as ScanOPD, indexed like the (frames, y, x) and (samples, y, x) OPD cubes
+@profiled()
 def Sampler(pos, rd, sample_size, path_length, datatype):
     
+    pos = np.asarray(pos, dtype=np.float64)
+    
     #Find direction of travel
     if pos[0] < pos[-1]:
         print('This is a forward moving scan')
         direction = 'positive'
-    if pos[0] > pos[-1]:
+    elif pos[0] > pos[-1]:
         print('This is a backwards moving scan')
         direction = 'negative'
+    else:
+        raise ValueError('Scan starts and ends at the same position, direction of travel is unknown')
     
     #Get the data size
+    frames = np.shape(rd)[0]
     x_axis = np.shape(rd)[2]
     y_axis = np.shape(rd)[1]
     
-       
+    #One column per pixel
+    pixel_data = np.asarray(rd, dtype=np.float64).reshape(frames, y_axis*x_axis)
+    
     ############################################################
     print('Generating an evenly spaced OPD list for each pixel')
     
@@ -216,72 +407,32 @@ def Sampler(pos, rd, sample_size, path_length, datatype):
         
     print('# of samples: '+str(num_samples))
     
-    #Build arrays to store original OPD data and sampled OPD data FOR EACH PIXEL
-    OPD = np.zeros([len(rd),y_axis, x_axis])
-    OPD_sample = np.zeros([int(num_samples+1),y_axis, x_axis])
+    ################################
+    #Find the brightest frame for each pixel and then call that corresponding position ZPD
+    if datatype == 'white':
+        zero_path = pos[np.argmax(pixel_data, axis=0)]
     
-    #Done on a pixel by pixel basis
-    for x in range(0, x_axis):
-        for y in range(0, y_axis):
-            #Get the ordered intensities of a single pixel
-            pixel_data = rd[:,y,x]
-            
-            ################################
-            #Find the brightest frame for that pixel and then call that corresponding position ZPD
-            if datatype == 'white':
-                zero_path = pos[np.where(pixel_data == max(pixel_data))[0][0]]
-            
-            if datatype == 'laser':
-                zero_path = np.average(pos)
-            #################################
-    
-            #Build the OPD list for that pixel with that value as the center
-            OPD_pix_hold = []
-            for p in pos:
-                #OPD is the distance from ZPD * 2
-                OPD_pix = (p - zero_path)*2
-                OPD_pix_hold.append(OPD_pix)
-            
-            #Add list of OPD values for the given pixel
-            OPD[:,y,x] = OPD_pix_hold
-               
-            #Make a list of evenly spaced positional values and interpolate their intensities
-            OPD_temp_sample = []
-            #Make sure that ZPD is included
-            OPD_temp_sample.append(0)
-             
-            #Add an even amount of samples to both sides of ZPD
-            for n in range(1,int(num_samples//2)+1):
-                OPD_temp_sample.append((sample_size * n))
-                OPD_temp_sample.append((sample_size * -n))
-            
-            #Sort the list
-            OPD_temp_sample.sort()
-            
-            #If this scan is traveling backwards, reverse list to keep consistent
-            if direction == 'negative':
-                OPD_temp_sample.reverse()
-            
-            #Append to the main list for each pixel
-            OPD_sample[:,y,x] = OPD_temp_sample
+    if datatype == 'laser':
+        zero_path = np.full(y_axis*x_axis, np.average(pos))
+    #################################
+    
+    #Evenly spaced OPD values with an even amount of samples on both sides of ZPD (included)
+    n = np.arange(-int(num_samples//2), int(num_samples//2)+1)
+    OPD_grid = sample_size * n
+    
+    #If this scan is traveling backwards, reverse list to keep consistent
+    if direction == 'negative':
+        OPD_grid = OPD_grid[::-1]
+    
+    #OPD (distance from ZPD * 2) and the sampled OPD list for each pixel
+    OPD = ScanOPD(pos, OPD_grid, zero_path.reshape(y_axis, x_axis), direction)
+    OPD_sample = OPD.Sampled()
     
     ## Interpolate pixel data to sampled positions
     print('Interpolating pixel values to the evenly spaced OPD list')
     
-    #Create array to hold the data with the same number of new frames as the sampled positions
-    sample_data = np.zeros([len(OPD_sample),y_axis, x_axis])
-    
-    for x in range(0, x_axis):
-        for y in range(0, y_axis):
-            #For a given pixel, interpolate the intensity based of the sampled positions
-            
-            if direction == 'positive':
-                pixel_sample = np.interp(OPD_sample[:,y,x], OPD[:,y,x], rd[:,y,x])
-            #Numpy interp can only only INCREASING X values, so invert OPD and real data for interpolation
-            if direction == 'negative':
-                pixel_sample = np.interp(OPD_sample[:,y,x], OPD[:,y,x][::-1], rd[:,y,x][::-1])
-            #Write interpolated data to sampled_data array
-            sample_data[:,y,x] = pixel_sample
+    sample_data = Resampling_Operator(pos, OPD_grid, direction).Apply(zero_path, pixel_data)
+    sample_data = sample_data.reshape(len(OPD_grid), y_axis, x_axis)
             
     print('Returning evenly spaced position and pixel data')
     print('')
@@ -290,16 +441,102 @@ def Sampler(pos, rd, sample_size, path_length, datatype):
 ##########################################################################
 ##########################################################################
 
-def ACES_Interpolator(scan_list, positions, real_data, sample_size, path_length,datatype='white'):
+#Worker for the parallel interpolation, samples one scan from its slot of the shared real data
+#and writes the sampled data into its slot of the shared output, only the (small) ScanOPDs, timing and profile are sent back
+def _Sample_Scan_Slot(scan, pos, shm_name, shape, dtype, start, stop, out_name, out_shape, sample_size, path_length, datatype):
+    
+    start_time = time.perf_counter()
+    profile_start = len(PROFILER)
+    
+    shm = shared_memory.SharedMemory(name=shm_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    try:
+        real_data = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        data_intrp = np.ndarray(out_shape, dtype=np.float64, buffer=out_shm.buf)
+        OPD, OPD_intrp, data_intrp[scan] = Sampler(pos, real_data[start:stop], sample_size, path_length, datatype)
+        del real_data, data_intrp
+    finally:
+        shm.close()
+        out_shm.close()
+    
+    return OPD, OPD_intrp, time.perf_counter() - start_time, PROFILER.report(profile_start)
+
+#Interpolate the scans concurrently with a process pool
+#The real data of every scan is copied once into shared memory (not pickled for each worker) and every scan has the
+#same number of samples, so the workers write the sampled data straight into a shared (scans, samples, y, x) output
+#NOTE: scripts that call this must be run under `if __name__ == '__main__':` on platforms that spawn processes (macOS, Windows)
+def Parallel_Interpolator(scan_list, positions, real_data, sample_size, path_length, datatype, workers):
+    
+    #Slot of each scan in the shared real data
+    num_frames = [len(rd) for rd in real_data]
+    stops = np.cumsum(num_frames)
+    starts = stops - num_frames
+    shape = (int(np.sum(num_frames)),) + tuple(np.shape(real_data[0])[1:])
+    dtype = np.result_type(*[rd.dtype for rd in real_data])
+    
+    #Same number of samples for every scan (see Sampler)
+    num_samples = abs((2 * path_length * 0.90) // sample_size)
+    if num_samples % 2 == 1:
+        num_samples = num_samples + 1
+    out_shape = (len(scan_list), int(num_samples)+1) + shape[1:]
+    
+    print('Interpolating '+str(len(scan_list))+' scans with '+str(workers)+' workers')
+    
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape))*dtype.itemsize))
+    out_shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(out_shape))*8))
+    try:
+        shared = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        for rd, start, stop in zip(real_data, starts, stops):
+            shared[start:stop] = rd
+        del shared
+        
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_Sample_Scan_Slot, s, positions[s], shm.name, shape, dtype, int(starts[s]), int(stops[s]),
+                                   out_shm.name, out_shape, sample_size, path_length, datatype): s
+                       for s in range(0, len(scan_list))}
+            
+            #Keep each scan in its slot so the order does not depend on which worker finishes first
+            OPD_list = [None]*len(scan_list)
+            OPD_intrp_list = [None]*len(scan_list)
+            for future in as_completed(futures):
+                s = futures[future]
+                OPD_list[s], OPD_intrp_list[s], scan_time, profile = future.result()
+                PROFILER.extend(profile)
+                print(f"Interpolated scan {s+1}/{len(scan_list)} in {scan_time:.4f} seconds")
+        
+        #Copy out of the shared block so it can be released
+        data_intrp = np.ndarray(out_shape, dtype=np.float64, buffer=out_shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+        out_shm.close()
+        out_shm.unlink()
+    
+    return OPD_list, OPD_intrp_list, list(data_intrp)
+
+@profiled(items=lambda out: len(out[0]))
+def ACES_Interpolator(scan_list, positions, real_data, sample_size, path_length,datatype='white', workers=None, cache_bytes=None):
     '''    
         OPD_list: An list of OPDs for each scan
                     OPD_list[x] will be the OPD values (centered at the brightest value as ZPD and double the measured values ) for a single scan
+                    (a ScanOPD, OPD_list[x][:, y, x] is the OPD of one pixel)
         
         OPD_sample_list: A list of the sampled OPD values
                     OPD_sample_list[x] will be the INTERPOLATED OPD values to be evenly spaced by sample size and centered at ZPD
 
         intrp_data_list: List of sampled and nterpolated datasets for each scan 
+        
+        workers: Number of processes interpolating scans at the same time (see Parallel_Interpolator), one after another if None or 1
+        
+        cache_bytes: Bytes of interpolation matrices kept to re-analyse the same scans (see RESAMPLING_MATRICES), unchanged if None
     '''
+    if cache_bytes is not None:
+        RESAMPLING_MATRICES.resize(cache_bytes)
+    
+    #Interpolate the scans in parallel, the lists are in scan order
+    if workers is not None and workers > 1 and len(scan_list) > 1:
+        return Parallel_Interpolator(scan_list, positions, real_data, sample_size, path_length, datatype, workers)
+    
     # For each scan, transform positions and real_data into sample_pos and sample_data
     # Build of list of data for each scan and bundle into single array
     OPD_list = []
@@ -309,6 +546,7 @@ def ACES_Interpolator(scan_list, positions, real_data, sample_size, path_length,
     #Loop for each scan
     for s in range(0, len(scan_list)):
         print('Performing interpolation on scan '+str(s+1)+'/'+str(len(scan_list)))
+        start_time = time.perf_counter()
         
         #Function to interpolate data for each scan at the size of the set sample rate (set to white or laser)
         OPD, OPD_intrp, data_intrp = Sampler(positions[s], real_data[s], sample_size, path_length,datatype)
@@ -317,6 +555,7 @@ def ACES_Interpolator(scan_list, positions, real_data, sample_size, path_length,
         OPD_list.append(OPD)
         OPD_intrp_list.append(OPD_intrp)
         data_intrp_list.append(data_intrp)
+        print(f"Interpolated scan {s+1}/{len(scan_list)} in {time.perf_counter() - start_time:.4f} seconds")
         
     return OPD_list, OPD_intrp_list, data_intrp_list 
 
@@ -374,12 +613,14 @@ def ACES_Binned_Saver(data_sub, meta, logs, data_filename):
     #Save data to h5py for smaller file size and faster processing
     print('Saving datafile: ',save_file_h5)
     with h5py.File(save_file_h5, 'w') as f:
-        f.create_dataset('data', data=data_sub)
+        Save_Data(f, data_sub)
 
 ##########################################################################
 ##########################################################################
  
-def ACES_Restoration(base_dir):
+#meta_fields/log_fields restore only those meta and log columns
+#lazy restores the binned data as an ACES_Storage.Lazy_Data, only read from the file when sliced
+def ACES_Restoration(base_dir, meta_fields=None, log_fields=None, lazy=False):
     #Data directory (get from input)
     print('The following data directories are available: ')
     print()
@@ -404,6 +645,7 @@ def ACES_Restoration(base_dir):
     save_file_h5 = binned_dir + data_dir + '_binned_data.h5'
     
     processed_dir = full_data_dir + 'Processed/'
+    processed_h5 = processed_dir + data_dir + '_processed_data.h5'
     save_file_pkl = processed_dir + data_dir + '_processed_meta_logs.pkl'
     
     #Restore binned data
@@ -411,19 +653,21 @@ def ACES_Restoration(base_dir):
         print()
         print('Restoring binned data subset')
         #Restore processed data from h5py object
-        with h5py.File(save_file_h5, 'r') as f:
-            data = np.array(f['data'])
+        if lazy:
+            data = Lazy_Data(save_file_h5)
+        else:
+            with h5py.File(save_file_h5, 'r') as f:
+                data = np.array(f['data'])
     else:
         print('!!!!!!!!!!!')
         print('NO BINNED DATA EXISTS FOR THIS DATA SET!')
         print('!!!!!!!!!!!')
         
-    #Restore meta data and logs
-    if os.path.isfile(save_file_pkl):
+    #Restore meta data and logs (saved with the processed data, or as a pickle file for older processed data)
+    if os.path.isfile(processed_h5) or os.path.isfile(save_file_pkl):
         print()
         print('Restoring metadata and logs')
-        with open(save_file_pkl, 'rb') as e:
-            meta, logs = pickle.load(e)
+        meta, logs = Load_Meta_Logs(processed_h5, meta_fields, log_fields, save_file_pkl)
     else:
         print('!!!!!!!!!!!')
         print('NO META OR LOG FILES ARE SAVED FOR THIS DATASET!')
@@ -436,6 +680,7 @@ def ACES_Restoration(base_dir):
 ##########################################################################
 
 #Perform a fourier transform of the data
+@profiled(items=lambda out: len(out[0]))
 def ACES_Transformer(scan_list, OPD_intrp_list, data_intrp_list, sample_size_cm):
     
     print()
@@ -53,11 +53,8 @@ def ACES_Multi_Frame_Image(data, n_display):
 def ACES_Scan_Plotter(meta, scan_list):
     
     #array of the camera positional and position values
-    cam_pos = []
-    cam_count = []
-    for m in meta:
-        cam_pos.append(m.pos)
-        cam_count.append(m.frameCounter)
+    cam_pos = meta['pos']
+    cam_count = meta['frameCounter']
         
     #plot full dataset
     plt.plot(cam_count, cam_pos)
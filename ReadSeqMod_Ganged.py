@@ -4,6 +4,16 @@
 ##
 ## Written by J. E. Franklin 02/2020 (jfranklin at g.harvard.edu)
 ##
+## Version 3.5 - ReadSeq and index builds recorded as profiling stages (aces_reader.profiling)
+##
+## Version 3.4 - ROI (y_range, x_range) and pixel binning applied while decoding (RoiFrames)
+##
+## Version 3.3 - Sidecar index (<seqfile>.idx.npz) caching the header, frame offsets and frame meta data
+##
+## Version 3.2 - Frame meta data returned as a columnar structured array (META_DTYPE)
+##
+## Version 3.1 - Vectorized decode of the full frame block (legacy reader kept as ReadSeqLegacy)
+##
 ## Version 3.0 - Updated by LRG to read in ganged files
 ## 
 ## Version 2.1 Changed to fix conflict with Python3
@@ -20,10 +30,13 @@
 ##
 ################################
 
+import os
 import struct
 import numpy as np
 import datetime as dt
 
+from aces_reader.profiling import stage, profiled
+
 
 class Sequence():
   pass
@@ -32,6 +45,25 @@ class FrameMeta():
   pass
 
 
+## Columns of the frame meta data table, one row per un-ganged frame
+## timestamp is nanoseconds since 1970-01-01, pos is filled in later from the logs
+META_DTYPE = np.dtype([('timestamp','i8'),('partNum','S32'),('serNum','S14'),('fpaType','S16'),
+                       ('crc','u4'),('frameCounter','i8'),('frameTime','f8'),('intTime','f8'),
+                       ('freq','f8'),('boardTemp','f8'),('rawNUC','u2'),('colOff','i2'),
+                       ('numCols','i4'),('rowOff','i2'),('numRows','i4'),('intTimeTicks','u4'),
+                       ('yr','i2'),('dy','i2'),('hr','i2'),('mn','i2'),('sc','i2'),('ms','i2'),
+                       ('microsec','i2'),('fpaTemp','f8'),('pos','f8')])
+
+## Byte layout of the fields in a meta row (after re-packing big-endian)
+META_ROW_FIELDS = {'partNum':('S32',2),'serNum':('S14',34),'fpaType':('S16',48),
+                   'crc':('>u4',64),'frameCounter':('>i4',68),'frameTime':('>f4',72),
+                   'intTime':('>f4',76),'freq':('>f4',80),'boardTemp':('>f4',120),
+                   'rawNUC':('>u2',124),'colOff':('>i2',130),'numCols':('>i2',132),
+                   'rowOff':('>i2',136),'numRows':('>i2',138),'intTimeTicks':('>u4',142),
+                   'yr':('>i2',192),'dy':('>i2',194),'hr':('>i2',196),'mn':('>i2',198),
+                   'sc':('>i2',200),'ms':('>i2',202),'microsec':('>i2',204),'fpaTemp':('>f4',476)}
+
+
 def ParseFrame(framenum,gang_num,sub_num,height,width,bindata):
   
   #print('Full frame #: '+str(framenum))
@@ -73,6 +105,14 @@ def ParseFrame(framenum,gang_num,sub_num,height,width,bindata):
   metaraw = bindata[(fmtsize*(sub_num+1)+meta_fmtsize*sub_num):(fmtsize*(sub_num+1)+(meta_fmtsize)*(sub_num+1))]
   meta_temp = struct.unpack_from(meta_fmt,metaraw)
   metaraw = struct.pack('>{}h'.format(width),*meta_temp)
+  
+  ParseMetaRow(Meta,metaraw)
+
+  return [data,Meta]
+
+
+#Fill a FrameMeta object from a meta row that has already been re-packed big-endian
+def ParseMetaRow(Meta,metaraw):
     
   #Reaad all of the metadata
   Meta.partNum = metaraw[2:34].decode('ascii').rstrip('\x00')
@@ -103,10 +143,70 @@ def ParseFrame(framenum,gang_num,sub_num,height,width,bindata):
   Meta.fpaTemp = struct.unpack_from('>f',metaraw[476:480])[0]
   Meta.intTimeTicks = struct.unpack_from('>I',metaraw[142:146])[0]
 
-  return [data,Meta]
+  return Meta
+
+
+#View a block of raw frames (uint8 array of shape [frames, TrueImageSize]) as subframes of shape [frames, gang, rows+1, width]
+#The last row of each subframe is its meta row, nothing is copied (a memory-mapped block is not read yet)
+def SubframeView(rawframes,gang_num,height,width,ImageSizeBytes):
+  
+  num_frames = rawframes.shape[0]
+  
+  #The number of DATA rows for each subframe (assuming last line of each subframe is meta data)
+  sub_rows = int((height-gang_num)/gang_num)
+  
+  #Pixels in a subframe including its meta row
+  sub_pixels = (sub_rows+1)*width
+  
+  #View the image part of every frame as little-endian int16 and split it into subframes
+  pixels = rawframes[:,:ImageSizeBytes].view('<i2')
+  return pixels[:,:gang_num*sub_pixels].reshape(num_frames,gang_num,sub_rows+1,width)
+
+
+#Timestamp of each full frame from the extra 6 bytes after the image, only those bytes are copied
+def FrameTimes(rawframes,ImageSizeBytes):
+  
+  seconds = rawframes[:,ImageSizeBytes:ImageSizeBytes+4].copy().view('<i4')[:,0]
+  millisec = rawframes[:,ImageSizeBytes+4:ImageSizeBytes+6].copy().view('<i2')[:,0]
+  
+  return seconds,millisec
+
+
+#Image rows of a subframe view (see SubframeView) cut to y_range/x_range, still a view
+def RoiView(subframes,y_range=None,x_range=None):
+  
+  images = subframes[:,:,:subframes.shape[2]-1,:]
+  if y_range is not None:
+    images = images[:,:,y_range[0]:y_range[1],:]
+  if x_range is not None:
+    images = images[:,:,:,x_range[0]:x_range[1]]
+  
+  return images
+
+
+#Decode a block of raw frames (uint8 array of shape [frames, TrueImageSize]) in one pass
+#Returns the un-ganged image data, the un-ganged meta rows and the timestamp of each full frame
+#y_range/x_range ([start, stop] rows/columns of the subframe) are cut from the subframe view before un-ganging,
+#so only the ROI pixels are copied (un-ganging can't be a view of a memory-mapped block when gang_num > 1)
+def DecodeFrames(rawframes,gang_num,height,width,ImageSizeBytes,y_range=None,x_range=None):
+  
+  subframes = SubframeView(rawframes,gang_num,height,width,ImageSizeBytes)
+  num_frames = subframes.shape[0]
+  sub_rows = subframes.shape[2] - 1
+  images = RoiView(subframes,y_range,x_range)
+  
+  #Image rows and meta row of every subframe, flattened to un-ganged frames
+  data = images.reshape((num_frames*gang_num,)+images.shape[2:])
+  meta_rows = subframes[:,:,sub_rows,:].reshape(num_frames*gang_num,width)
+  
+  # Grab time stamp from the extra 6 bytes after the image (One timestamp for each FULL frame)
+  seconds,millisec = FrameTimes(rawframes,ImageSizeBytes)
+  
+  return data,meta_rows,seconds,millisec
 
-#Default to non-ganged images unless given otherwise
-def ReadSeq(seqfile,gang_num=1):
+
+#Pull camera and sequence time from the filename
+def ParseSeqName(seqfile):
 
   ## Pull camera (ch4 v o2) and sequence timestamp from filename.
   temp = seqfile.split('/')[-1]
@@ -114,10 +214,18 @@ def ReadSeq(seqfile,gang_num=1):
   Seq = Sequence()
   Seq.Camera = temp[0]
   Seq.SeqTime = dt.datetime.strptime(temp[1].strip('.seq'),'%Y_%m_%d_%H_%M_%S')
+  
+  return Seq
+
+
+#Read the sequence header and pull camera and sequence time from the filename
+def ReadSeqHeader(seqfile):
+
+  Seq = ParseSeqName(seqfile)
 
   ## Open file for binary read
-  fin = open(seqfile,'rb')
-  binhead = fin.read(8192)
+  with open(seqfile,'rb') as fin:
+    binhead = fin.read(8192)
 
   ## Grab meta data for sequence file.
   temp = struct.unpack('<9I',binhead[548:548+36])
@@ -130,6 +238,303 @@ def ReadSeq(seqfile,gang_num=1):
   Seq.TrueImageSize = temp[8]
   Seq.NumPixels = Seq.ImageWidth*Seq.ImageHeight
   
+  return Seq
+
+
+#Memory-mapped seq file, frames are only decoded when they are indexed
+#Indexing is over un-ganged frames: seq[i], seq[a:b], seq[i,y,x] (same order as ReadSeq Data)
+class SeqFile():
+  
+  def __init__(self,seqfile,gang_num=1):
+    self.filename = seqfile
+    self.gang_num = gang_num
+    self.Seq = ReadSeqHeader(seqfile)
+    
+    #Number of image rows in each un-ganged frame
+    self.sub_rows = int((self.Seq.ImageHeight-gang_num)/gang_num)
+    
+    #Raw frames after the 8192 byte header, one row of TrueImageSize bytes per full frame
+    self.raw = np.memmap(seqfile,dtype=np.uint8,mode='r',offset=8192,
+                         shape=(self.Seq.NumFrames,self.Seq.TrueImageSize))
+
+  def __len__(self):
+    return self.Seq.NumFrames*self.gang_num
+
+  @property
+  def shape(self):
+    return (len(self),self.sub_rows,self.Seq.ImageWidth)
+
+  @property
+  def dtype(self):
+    return np.dtype(np.int16)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self,*exc):
+    self.close()
+
+  def close(self):
+    #Dropping the memmap closes the underlying file mapping
+    self.raw = None
+
+  #Decode full frames [fn1:fn2] cut to y_range/x_range, returns views into the memory map (copies of the ROI when ganged)
+  def decode(self,fn1,fn2,y_range=None,x_range=None):
+    return DecodeFrames(self.raw[fn1:fn2],self.gang_num,self.Seq.ImageHeight,
+                        self.Seq.ImageWidth,self.Seq.ImageSizeBytes,y_range,x_range)
+
+  #Subframes of full frames [fn1:fn2] as a view of the memory map (frames, gang, rows+1, width), see SubframeView
+  def subframes(self,fn1,fn2):
+    return SubframeView(self.raw[fn1:fn2],self.gang_num,self.Seq.ImageHeight,
+                        self.Seq.ImageWidth,self.Seq.ImageSizeBytes)
+
+  #Un-ganged frames of full frames [fn1:fn2] cut to y_range/x_range, copied straight from the memory map into out
+  #out is a new int16 array if None, otherwise a C-contiguous array of the right size (e.g. a slice of a larger stack)
+  def read(self,fn1=0,fn2=None,y_range=None,x_range=None,out=None):
+    images = RoiView(self.subframes(fn1,fn2),y_range,x_range)
+    shape = (images.shape[0]*self.gang_num,)+images.shape[2:]
+    if out is None:
+      out = np.empty(shape,dtype=self.dtype)
+    elif out.shape != shape or not out.flags.c_contiguous:
+      raise ValueError('out must be a C-contiguous array of shape {}'.format(shape))
+    out.reshape(images.shape)[...] = images
+    return out
+
+  #Meta data table of full frames [fn1:fn2], only the meta rows and timestamps are copied out of the memory map
+  def meta(self,fn1=0,fn2=None):
+    subframes = self.subframes(fn1,fn2)
+    meta_rows = subframes[:,:,self.sub_rows,:].reshape(subframes.shape[0]*self.gang_num,self.Seq.ImageWidth)
+    seconds,millisec = FrameTimes(self.raw[fn1:fn2],self.Seq.ImageSizeBytes)
+    return ParseMetaTable(meta_rows,seconds,millisec,self.gang_num)
+
+  #Single subframe of a full frame
+  def subframe(self,framenum,sub_num):
+    return self[framenum*self.gang_num+sub_num]
+
+  def __getitem__(self,key):
+    
+    #Extra indices (rows, columns) are applied to the subframe view before un-ganging, so only those pixels are copied
+    if isinstance(key,tuple):
+      key,rest = key[0],key[1:]
+    else:
+      rest = ()
+    
+    if isinstance(key,slice):
+      index = np.arange(*key.indices(len(self)))
+      if len(index) == 0:
+        return np.empty((0,)+self.shape[1:],dtype=self.dtype)[(slice(None),)+rest]
+      #Only touch the full frames that hold the requested subframes
+      fn1 = index.min()//self.gang_num
+      fn2 = index.max()//self.gang_num + 1
+      images = self.subframes(fn1,fn2)[:,:,:self.sub_rows,:][(slice(None),slice(None))+rest]
+      index = index - fn1*self.gang_num
+      return np.array(images[index//self.gang_num,index%self.gang_num])
+    
+    #Single un-ganged frame
+    i = int(key)
+    if i < 0:
+      i = i + len(self)
+    if i < 0 or i >= len(self):
+      raise IndexError('frame {} out of range for {} frames'.format(key,len(self)))
+    images = self.subframes(i//self.gang_num,i//self.gang_num+1)[0,i%self.gang_num,:self.sub_rows,:]
+    return np.array(images[rest])
+
+
+#Average bins of y_bin x x_bin pixels of a stack of frames (frames, rows, columns)
+#Pixels are summed per bin and divided once, rows/columns that don't fill a whole bin are dropped (same as Pixel_Averager)
+def BinFrames(data,y_bin=1,x_bin=1):
+  
+  frames,rows,columns = data.shape
+  y_axis = rows//y_bin
+  x_axis = columns//x_bin
+  
+  data = data[:,:y_axis*y_bin,:x_axis*x_bin].reshape(frames,y_axis,y_bin,x_axis,x_bin)
+  
+  #Integer pixels are summed exactly before dividing
+  if np.issubdtype(data.dtype,np.integer):
+    bin_sum = data.sum(axis=(2,4),dtype=np.int64)
+  else:
+    bin_sum = data.sum(axis=(2,4),dtype=np.float64)
+  
+  return bin_sum/(y_bin*x_bin)
+
+
+#Shape of a frame after RoiFrames
+def RoiShape(rows,columns,y_range=None,x_range=None,y_bin=1,x_bin=1):
+  
+  y1,y2 = (0,rows) if y_range is None else y_range
+  x1,x2 = (0,columns) if x_range is None else x_range
+  
+  return ((y2-y1)//y_bin,(x2-x1)//x_bin)
+
+
+#Cut a stack of decoded frames down to a region of interest and bin it
+#Seq files are cut while decoding (DecodeFrames), this is for stacks that are already decoded (e.g. dark frames)
+#Without binning or a dtype the result is still a view of the input (nothing is read yet)
+def RoiFrames(data,y_range=None,x_range=None,y_bin=1,x_bin=1,dtype=None):
+  
+  if y_range is not None:
+    data = data[:,y_range[0]:y_range[1],:]
+  if x_range is not None:
+    data = data[:,:,x_range[0]:x_range[1]]
+  
+  if y_bin > 1 or x_bin > 1:
+    data = BinFrames(data,y_bin,x_bin)
+  
+  if dtype is None:
+    return data
+  return np.array(data,dtype=dtype)
+
+
+#Decode all meta rows at once into a META_DTYPE table, each subframe gets the timestamp of its full frame
+def ParseMetaTable(meta_rows,seconds,millisec,gang_num):
+  
+  num_rows,width = meta_rows.shape
+  
+  #Meta rows are stored little-endian, re-pack big-endian and view the bytes with the row layout
+  row_dtype = np.dtype({'names':list(META_ROW_FIELDS),
+                        'formats':[f[0] for f in META_ROW_FIELDS.values()],
+                        'offsets':[f[1] for f in META_ROW_FIELDS.values()],
+                        'itemsize':width*2})
+  raw = np.ascontiguousarray(meta_rows,dtype='>i2').view(row_dtype).reshape(num_rows)
+  
+  Meta = np.zeros(num_rows,dtype=META_DTYPE)
+  for name in META_ROW_FIELDS:
+    Meta[name] = raw[name]
+  Meta['numCols'] += 1
+  Meta['numRows'] += 1
+  
+  #Full frame timestamp in nanoseconds, repeated for each subframe
+  timestamp = seconds.astype(np.int64)*1000000000 + millisec.astype(np.int64)*1000000
+  Meta['timestamp'] = np.repeat(timestamp,gang_num)
+  Meta['pos'] = np.nan
+  
+  return Meta
+
+
+#Convert a list of FrameMeta objects (legacy reader, old pickles) to a META_DTYPE table
+def MetaObjectsToTable(meta_objects):
+  
+  Meta = np.zeros(len(meta_objects),dtype=META_DTYPE)
+  Meta['pos'] = np.nan
+  for name in META_DTYPE.names:
+    if name == 'timestamp':
+      Meta[name] = [(m.timestamp - dt.datetime(1970,1,1)) // dt.timedelta(microseconds=1) * 1000 for m in meta_objects]
+    elif all(hasattr(m,name) for m in meta_objects):
+      Meta[name] = [getattr(m,name) for m in meta_objects]
+  
+  return Meta
+
+
+#Default to non-ganged images unless given otherwise
+#Data is returned as int like the legacy reader unless another dtype is given (np.int16 is the native type)
+#y_range/x_range ([start, stop] rows/columns of the subframe) and y_bin/x_bin cut and average the frames while reading
+@profiled(nbytes=lambda out: out[2].NumFrames*out[2].TrueImageSize,items=lambda out: len(out[0]))
+def ReadSeq(seqfile,gang_num=1,dtype=int,y_range=None,x_range=None,y_bin=1,x_bin=1):
+
+  with SeqFile(seqfile,gang_num) as sf:
+    Seq = sf.Seq
+
+    print('Reading {} ganged frames'.format(Seq.NumFrames))
+    print('Converting to {} un-ganged frames'.format(Seq.NumFrames*gang_num))
+  
+    #Decode the ROI of every subframe of every frame at once
+    data,meta_rows,seconds,millisec = sf.decode(0,Seq.NumFrames,y_range,x_range)
+  
+    if y_bin > 1 or x_bin > 1:
+      #Binned data are averages
+      dtype = np.float64
+    Data = RoiFrames(data,None,None,y_bin,x_bin,dtype)
+    Meta = ParseMetaTable(meta_rows,seconds,millisec,gang_num)
+
+  return(Data,Meta,Seq)
+
+
+## Header fields cached in the sidecar index
+INDEX_FIELDS = ['ImageWidth','ImageHeight','ImageBitDepth','ImageBitDepthTrue','ImageSizeBytes','NumFrames','TrueImageSize']
+
+#Header, frame byte offsets and frame meta data of a seq file, cached in a sidecar file next to it (seqfile + '.idx.npz')
+#The sidecar is rebuilt when the seq file size or modification time changes, or for a different gang_num
+#Returns a Sequence with the header fields plus Offsets, Meta (raw, before time stamping), FirstCount/LastCount,
+#StartTime/EndTime (ns since 1970) and IntTime/FpaTemp of the first frame
+def SeqIndex(seqfile,gang_num=1):
+  
+  index_file = seqfile + '.idx.npz'
+  stat = os.stat(seqfile)
+  
+  Seq = None
+  if os.path.isfile(index_file):
+    try:
+      with np.load(index_file) as idx:
+        if idx['size'] == stat.st_size and idx['mtime_ns'] == stat.st_mtime_ns and idx['gang_num'] == gang_num:
+          Seq = ParseSeqName(seqfile)
+          for name in INDEX_FIELDS:
+            setattr(Seq,name,int(idx[name]))
+          Seq.NumPixels = Seq.ImageWidth*Seq.ImageHeight
+          Seq.Offsets = idx['offsets']
+          Seq.Meta = idx['meta']
+    except (OSError,ValueError,KeyError):
+      Seq = None
+  
+  #Build (or rebuild) the index from the seq file
+  if Seq is None:
+    #Only the meta rows and timestamps of each frame are read
+    with SeqFile(seqfile,gang_num) as sf, stage('SeqIndex',items=len(sf)) as record:
+      Seq = sf.Seq
+      Seq.Meta = sf.meta()
+      record.bytes = Seq.NumFrames*(gang_num*Seq.ImageWidth*2 + 6)
+    Seq.Offsets = 8192 + np.arange(Seq.NumFrames,dtype=np.int64)*Seq.TrueImageSize
+    
+    fields = {name:getattr(Seq,name) for name in INDEX_FIELDS}
+    try:
+      #Write to a temporary file first so a partial index is never read
+      with open(index_file + '.tmp','wb') as f:
+        np.savez(f,size=stat.st_size,mtime_ns=stat.st_mtime_ns,gang_num=gang_num,
+                 offsets=Seq.Offsets,meta=Seq.Meta,**fields)
+      os.replace(index_file + '.tmp',index_file)
+    except OSError:
+      #Read-only data directory, the index is just not cached
+      pass
+  
+  Seq.gang_num = gang_num
+  if len(Seq.Meta) > 0:
+    Seq.FirstCount = int(Seq.Meta['frameCounter'][0])
+    Seq.LastCount = int(Seq.Meta['frameCounter'][-1])
+    Seq.StartTime = int(Seq.Meta['timestamp'][0])
+    Seq.EndTime = int(Seq.Meta['timestamp'][-1])
+    Seq.IntTime = float(Seq.Meta['intTime'][0])
+    Seq.FpaTemp = float(Seq.Meta['fpaTemp'][0])
+  
+  return Seq
+
+
+#Stream a seq file in blocks of chunk_frames un-ganged frames (rounded up to whole full frames)
+#Yields (data_chunk, meta_chunk) so only one chunk is held in memory, data is the native int16 (float when binned)
+def ReadSeqChunks(seqfile,gang_num=1,chunk_frames=1000,y_range=None,x_range=None,y_bin=1,x_bin=1):
+
+  #Accept an already opened SeqFile
+  if isinstance(seqfile,SeqFile):
+    sf = seqfile
+  else:
+    sf = SeqFile(seqfile,gang_num)
+  
+  #Number of full frames per chunk
+  chunk_full = max(1,-(-chunk_frames//sf.gang_num))
+  
+  for fn in range(0,sf.Seq.NumFrames,chunk_full):
+    data,meta_rows,seconds,millisec = sf.decode(fn,fn+chunk_full,y_range,x_range)
+    yield np.array(RoiFrames(data,None,None,y_bin,x_bin)),ParseMetaTable(meta_rows,seconds,millisec,sf.gang_num)
+
+
+#Original frame by frame reader, kept as a reference for ReadSeq (see ReadSeq_Benchmark.py)
+def ReadSeqLegacy(seqfile,gang_num=1):
+
+  Seq = ReadSeqHeader(seqfile)
+
+  ## Open file for binary read and skip the header
+  fin = open(seqfile,'rb')
+  fin.seek(8192)
+  
   ## Read raw frames
   rawframes = [fin.read(Seq.TrueImageSize) for i in range(Seq.NumFrames)]
   fin.close()
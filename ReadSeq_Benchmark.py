@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the seq file readers in ReadSeqMod_Ganged
+
+Reads the same seq file with the legacy frame by frame reader (ReadSeqLegacy)
+and the vectorized reader (ReadSeq), checks that the image data is identical
+and reports the number of un-ganged frames read per second for each
+
+If no seq file is given, a synthetic one is written to a temporary directory
+
+    python ReadSeq_Benchmark.py [seqfile] [-g GANG_NUM] [-n NUM_FRAMES]
+"""
+
+import os
+import struct
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from ReadSeqMod_Ganged import ReadSeq, ReadSeqLegacy
+
+
+#Build the meta row of a subframe, stored as little-endian int16 of the big-endian meta bytes
+def Synthetic_Meta_Row(frame_counter, width):
+    metaraw = bytearray(width * 2)
+    metaraw[2:34] = b'ACES-SYNTHETIC'.ljust(32, b'\x00')
+    metaraw[34:48] = b'0001'.ljust(14, b'\x00')
+    metaraw[48:64] = b'InGaAs'.ljust(16, b'\x00')
+    metaraw[68:80] = struct.pack('>iff', frame_counter, 0.01, 0.005)
+    metaraw[120:124] = struct.pack('>f', 35.5)
+    metaraw[192:206] = struct.pack('>7h', 2025, 1, 0, 0, frame_counter // 100, frame_counter % 1000, 0)
+    metaraw[476:480] = struct.pack('>f', -20.25)
+    return np.frombuffer(bytes(metaraw), dtype='>i2')
+
+
+#Write a seq file with random image data and a valid header/timestamp for each full frame
+#first_frame continues the frame counters and times of the files before it (full frames), name is the seq file name
+def Synthetic_Seq(seq_dir, num_frames, gang_num, sub_rows=127, width=640, first_frame=0, name='ch4_camera_2025_01_01_00_00_00.seq'):
+
+    height = gang_num * (sub_rows + 1)
+    image_size = height * width * 2
+    #Each stored frame is padded past the image and timestamp bytes
+    true_size = (image_size + 6 + 511) // 512 * 512
+
+    header = bytearray(8192)
+    header[548:548+36] = struct.pack('<9I', width, height, 16, 14, image_size, 0, num_frames, 0, true_size)
+
+    seqfile = os.path.join(seq_dir, name)
+    rng = np.random.default_rng(first_frame)
+    with open(seqfile, 'wb') as f:
+        f.write(header)
+        for fn in range(first_frame, first_frame + num_frames):
+            frame = bytearray(true_size)
+            pixels = rng.integers(0, 2**14, (gang_num, sub_rows + 1, width), dtype='<i2')
+            for sub_num in range(gang_num):
+                pixels[sub_num, -1] = Synthetic_Meta_Row(fn * gang_num + sub_num, width)
+            frame[:image_size] = pixels.tobytes()
+            frame[image_size:image_size+6] = struct.pack('<lh', 1735689600 + fn // 100, (fn % 100) * 10)
+            f.write(frame)
+
+    return seqfile
+
+
+#Time a reader and return the data and the number of un-ganged frames per second
+def Time_Reader(reader, seqfile, gang_num):
+    start = time.perf_counter()
+    data, meta, seq = reader(seqfile, gang_num=gang_num)
+    elapsed = time.perf_counter() - start
+    return data, len(data) / elapsed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare the legacy and vectorized seq readers')
+    parser.add_argument('seqfile', nargs='?', help='Sequence file to read (synthetic file if not given)')
+    parser.add_argument('-g', '--gang_num', type=int, default=4, help='Number of subframes per frame')
+    parser.add_argument('-n', '--num_frames', type=int, default=200, help='Number of full frames in the synthetic file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        seqfile = args.seqfile
+        if seqfile is None:
+            seqfile = Synthetic_Seq(tmp + '/', args.num_frames, args.gang_num)
+
+        legacy_data, legacy_fps = Time_Reader(ReadSeqLegacy, seqfile, args.gang_num)
+        data, fps = Time_Reader(ReadSeq, seqfile, args.gang_num)
+
+        print()
+        print('Legacy reader:     {:10.1f} frames/s'.format(legacy_fps))
+        print('Vectorized reader: {:10.1f} frames/s'.format(fps))
+        print('Speed up:          {:10.1f}x'.format(fps / legacy_fps))
+        print('Identical data:    {}'.format(data.dtype == legacy_data.dtype and np.array_equal(data, legacy_data)))
@@ -15,13 +15,14 @@ import datetime as dt
 from aces_reader.mimic_log_parser import parse_mimic_logs
 
 
-def ACES_Log_Data(log_dir):
+#start_idx skips the first log files (sorted by name), e.g. the ones already processed
+def ACES_Log_Data(log_dir, start_idx=0):
 
     # Set where the logs will be read from
     data_dir = os.path.join(os.path.expanduser('~'), 'ACES', log_dir)
     
     #Read in the data from the logs and grab the data frame
-    log_dictionary = parse_mimic_logs(os.path.join(data_dir))
+    log_dictionary = parse_mimic_logs(os.path.join(data_dir), start_idx=start_idx)
     log_df = log_dictionary['df']
     
     
@@ -30,14 +31,11 @@ def ACES_Log_Data(log_dir):
     
     
     ### BUILD UTC TIME ARRAY
-    for i in range(0,len(log_df)):
-        temp_time = dt.datetime(1970,1,1) + dt.timedelta(seconds=log_df['time'][i])
-        
-        #Datetime Object
-        log_df['utcTime'][i] = temp_time
+    #Datetime Object of each row, set as a whole column (setting rows of the float utcTime column one by one fails on newer pandas)
+    log_df['utcTime'] = [dt.datetime(1970,1,1) + dt.timedelta(seconds=t) for t in log_df['time']]
     
-        #Convert to pandas time object for better precision
-        #log_df['utcTime'][i] = pd.Timestamp(temp_time)
+    #Convert to pandas time object for better precision
+    #log_df['utcTime'] = pd.to_datetime(log_df['time'], unit='s')
         
     #####################
     #REMOVE THE USELESS ENTRIES
@@ -5,19 +5,29 @@ import struct
 import numpy as np
 import pandas as pd
 
+from aces_reader.profiling import profiled
 
+
+def is_log_file(file):
+    """Whether a file in a log directory is a log file, anything else is skipped."""
+    #return file.startswith('mimic_')
+    return file.startswith('modulator_')
+
+
+@profiled(items=lambda result: len(result['df']))
 def parse_mimic_logs(dir, logs_to_cat=np.inf, program_rate=2000, start_idx=0):
+    """start_idx skips the first log files (sorted by name, counting only log files, see is_log_file)."""
     concatenated_df = None
     info = {}
     logs_read = 0
     for (root, dirs, files) in os.walk(dir, topdown=True):
-        for idx, file in enumerate(sorted(files)):
-            if idx < start_idx:
-                continue
-
-            #if not file.startswith('mimic_'):
-            if not file.startswith('modulator_'):
+        for file in sorted(files):
+            if not is_log_file(file):
                 logging.warning(f"Skipped spurious file named {file}")
+
+        log_files = sorted(file for file in files if is_log_file(file))
+        for idx, file in enumerate(log_files):
+            if idx < start_idx:
                 continue
 
             if logs_read > logs_to_cat:
@@ -52,7 +62,7 @@ def parse_mimic_logs(dir, logs_to_cat=np.inf, program_rate=2000, start_idx=0):
             df = pd.DataFrame(rows, columns=columns)
 
             # Skip the dummy data
-            if idx == len(files) - 1:
+            if idx == len(log_files) - 1:
                 logging.info("Cutting dummy data.")
                 df = df.loc[df['step'] != -9999]
 
@@ -64,6 +74,9 @@ def parse_mimic_logs(dir, logs_to_cat=np.inf, program_rate=2000, start_idx=0):
 
             logs_read += 1
 
+    if concatenated_df is None:
+        raise FileNotFoundError(f"No log files to parse in {dir} (from log file {start_idx})")
+
     # Interpolate the UTC times based on an assumed steady program rate.
     logging.info(f"Interpolating mimic UTC times based on a program rate of {program_rate} Hz.")
     start_step = concatenated_df.step[0]
@@ -0,0 +1,275 @@
+"""
+Stage timing and memory profiling for the ACES pipeline.
+
+Wrap a stage in `stage(name)` (context manager) or decorate a function with `profiled()`
+to record its wall time, CPU time, memory, bytes read and items processed:
+
+    with stage('read_seq', nbytes=size) as record:
+        ...
+        record.items += len(frames)
+
+    @profiled(items=len)
+    def parse_mimic_logs(...):
+        ...
+
+`current_stage()` gives the record of the stage running, e.g. for a function decorated with
+`profiled()` to add the bytes it read.
+
+Stages opened inside another stage are recorded with their full path ('process/read_seq').
+Records are kept by the module-level PROFILER until `reset()`; `save_report()` writes them
+as JSON or CSV and `summary_table()` formats totals per stage.
+
+Memory is recorded two ways:
+    peak_rss          highest RSS of the process while the stage ran, sampled every
+                      `sample_interval` seconds in a thread (needs psutil, None without it),
+                      peak_rss_delta is how far it rose above the RSS when the stage started
+    process_peak_rss  RSS high-water mark of the whole process since it started (ru_maxrss)
+                      when the stage finished: it never goes down, so it only says something
+                      about a stage when that stage set a new high-water mark
+
+Records are per process: stages run in worker processes are only kept by that worker.
+"""
+import contextlib
+import csv
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+FIELDS = ['stage', 'path', 'start', 'wall', 'cpu', 'peak_rss', 'peak_rss_delta', 'process_peak_rss', 'bytes', 'items']
+
+
+def current_rss():
+    """Resident set size of this process in bytes (None without psutil)."""
+    if psutil is None:
+        return None
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def peak_rss():
+    """High-water mark of the resident set size of this process since it started, in bytes (None where it is not available)."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class RssSampler:
+    """Highest RSS of this process between `start()` and `stop()`, sampled every `interval` seconds in a thread."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start_rss = None
+        self.peak = None
+        self._process = None
+        self._done = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = self._process.memory_info().rss
+        self.peak = rss if self.peak is None else max(self.peak, rss)
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        if psutil is None:
+            return self
+        self._process = psutil.Process(os.getpid())
+        self._sample()
+        self.start_rss = self.peak
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return self
+        self._done.set()
+        self._thread.join()
+        self._sample()
+        return self
+
+
+class StageRecord:
+    """Measurements of one run of a stage, bytes and items can be added while the stage runs."""
+
+    def __init__(self, name, path, nbytes=0, items=0):
+        self.stage = name
+        self.path = path
+        self.start = time.time()
+        self.wall = None
+        self.cpu = None
+        self.peak_rss = None
+        self.peak_rss_delta = None
+        self.process_peak_rss = None
+        self.bytes = nbytes
+        self.items = items
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in FIELDS}
+
+
+class Profiler:
+
+    def __init__(self, sample_interval=0.01):
+        self.records = []
+        self.enabled = True
+        self.sample_interval = sample_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def stage(self, name, nbytes=0, items=0):
+        """Record the wall time, CPU time, peak RSS while it runs, bytes and items of the enclosed block."""
+        if not self.enabled:
+            yield StageRecord(name, name, nbytes, items)
+            return
+
+        stack = self._stack()
+        record = StageRecord(name, '/'.join([outer.stage for outer in stack] + [name]), nbytes, items)
+        stack.append(record)
+        sampler = RssSampler(self.sample_interval).start()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall = time.perf_counter() - wall_start
+            record.cpu = time.process_time() - cpu_start
+            sampler.stop()
+            record.peak_rss = sampler.peak
+            if sampler.peak is not None:
+                record.peak_rss_delta = sampler.peak - sampler.start_rss
+            record.process_peak_rss = peak_rss()
+            stack.pop()
+            with self._lock:
+                self.records.append(record)
+            logging.debug(f"{record.path}: {record.wall:.4f} s wall, {record.cpu:.4f} s CPU")
+
+    def current(self):
+        """Record of the innermost stage running in this thread (None outside a stage or when disabled)."""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def profiled(self, name=None, nbytes=None, items=None):
+        """
+        Decorator recording every call of a function as a stage (named after the function by default).
+        `nbytes` and `items` are optional functions of the return value giving the bytes and items processed.
+        """
+        def decorator(func):
+            stage_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name) as record:
+                    result = func(*args, **kwargs)
+                    if nbytes is not None:
+                        record.bytes = nbytes(result)
+                    if items is not None:
+                        record.items = items(result)
+                return result
+
+            return wrapper
+
+        return decorator
+
+    def report(self, since=0):
+        """Every record (from record number `since`) as a list of dicts, in the order the stages finished."""
+        with self._lock:
+            return [record.as_dict() for record in self.records[since:]]
+
+    def extend(self, records):
+        """Add records reported by another profiler (e.g. from a worker process)."""
+        with self._lock:
+            for values in records:
+                record = StageRecord(values['stage'], values['path'])
+                for field in FIELDS:
+                    setattr(record, field, values.get(field))
+                self.records.append(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+
+    def summary(self, since=0):
+        """Totals per stage path: calls, wall, cpu, max peak RSS (and process high-water mark), bytes, items and throughput."""
+        totals = {}
+        for record in self.report(since):
+            total = totals.setdefault(record['path'], {'path': record['path'], 'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+                                                       'peak_rss': None, 'process_peak_rss': None, 'bytes': 0, 'items': 0})
+            total['calls'] += 1
+            total['wall'] += record['wall'] or 0.0
+            total['cpu'] += record['cpu'] or 0.0
+            if record['peak_rss'] is not None:
+                total['peak_rss'] = max(total['peak_rss'] or 0, record['peak_rss'])
+            if record.get('process_peak_rss') is not None:
+                total['process_peak_rss'] = max(total['process_peak_rss'] or 0, record['process_peak_rss'])
+            total['bytes'] += record['bytes'] or 0
+            total['items'] += record['items'] or 0
+
+        for total in totals.values():
+            total['mb_per_s'] = total['bytes'] / 1e6 / total['wall'] if total['wall'] > 0 else None
+            total['items_per_s'] = total['items'] / total['wall'] if total['wall'] > 0 else None
+
+        return sorted(totals.values(), key=lambda total: total['path'])
+
+    def summary_table(self, since=0):
+        """Summary as a fixed width text table (peak MB is the stage peak RSS, hwm MB the process high-water mark)."""
+        lines = [f"{'stage':<48} {'calls':>6} {'wall s':>10} {'cpu s':>10} {'peak MB':>9} {'hwm MB':>9} {'MB/s':>9} {'items/s':>11}"]
+        for total in self.summary(since):
+            peak = f"{total['peak_rss'] / 1e6:9.1f}" if total['peak_rss'] is not None else f"{'-':>9}"
+            hwm = f"{total['process_peak_rss'] / 1e6:9.1f}" if total['process_peak_rss'] is not None else f"{'-':>9}"
+            rate = f"{total['mb_per_s']:9.1f}" if total['mb_per_s'] is not None and total['bytes'] else f"{'-':>9}"
+            items = f"{total['items_per_s']:11.1f}" if total['items_per_s'] is not None and total['items'] else f"{'-':>11}"
+            lines.append(f"{total['path']:<48} {total['calls']:>6} {total['wall']:>10.4f} {total['cpu']:>10.4f} {peak} {hwm} {rate} {items}")
+        return '\n'.join(lines)
+
+    def save_report(self, path, since=0):
+        """Write the records (from `since`) to `path`, as CSV if it ends with .csv, otherwise JSON (with the summary)."""
+        records = self.report(since)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(records)
+        else:
+            with open(path, 'w') as f:
+                json.dump({'records': records, 'summary': self.summary(since)}, f, indent=2)
+        return path
+
+
+PROFILER = Profiler()
+
+stage = PROFILER.stage
+current_stage = PROFILER.current
+profiled = PROFILER.profiled
+report = PROFILER.report
+reset = PROFILER.reset
+summary = PROFILER.summary
+summary_table = PROFILER.summary_table
+save_report = PROFILER.save_report
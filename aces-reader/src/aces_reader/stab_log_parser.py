@@ -7,7 +7,10 @@ import numpy as np
 import pandas as pd
 from anglewrapper import wrap
 
+from aces_reader.profiling import profiled
 
+
+@profiled(items=len)
 def parse_stab_logs(dir, logs_to_cat=np.inf, program_rate=1000, start_idx=0):
     """
     stab_data = struct(
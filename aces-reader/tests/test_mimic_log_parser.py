@@ -1,9 +1,12 @@
 import os
+import struct
 
+import numpy as np
 import pandas as pd
+import pytest
 from matplotlib import pyplot as plt
 
-from aces_reader.mimic_log_parser import parse_mimic_logs
+from aces_reader.mimic_log_parser import is_log_file, parse_mimic_logs
 
 
 def test_parse_mimic_logs(fixtures):
@@ -41,3 +44,30 @@ def test_parse_mimic_logs(fixtures):
     plt.ylabel('utcTime (s)')
     plt.title(f"utcTimes v. Time")
     plt.legend()
+
+
+def write_modulator_log(path, first_step, rows, header=False):
+    values = []
+    if header:
+        values += [0.0] * 8
+    for step in range(first_step, first_step + rows):
+        values += [step / 2000, 1.7e9 + step / 2000, step, 0, 0, step * 1e-3, 0, 0, step, 0, 0]
+    with open(path, 'wb') as f:
+        f.write(struct.pack('>' + 'd' * len(values), *values))
+
+
+def test_parse_skips_other_files_and_counts_log_files(tmp_path):
+    write_modulator_log(tmp_path / 'modulator_2024_03_25_14_32_08.bin', 0, 20, header=True)
+    write_modulator_log(tmp_path / 'modulator_2024_03_25_14_32_38.bin', 20, 20)
+    (tmp_path / 'config.txt').write_text('not a log')
+    (tmp_path / 'notes.txt').write_text('not a log')
+    assert [is_log_file(f) for f in sorted(os.listdir(tmp_path))] == [False, True, True, False]
+
+    df = parse_mimic_logs(str(tmp_path))['df']
+    np.testing.assert_array_equal(df['step'], np.arange(40))
+
+    appended = parse_mimic_logs(str(tmp_path), start_idx=1)['df']
+    np.testing.assert_array_equal(appended['step'], np.arange(20, 40))
+
+    with pytest.raises(FileNotFoundError):
+        parse_mimic_logs(str(tmp_path), start_idx=2)
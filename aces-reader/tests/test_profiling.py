@@ -0,0 +1,111 @@
+import csv
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+
+from aces_reader.profiling import Profiler
+
+
+def test_stage_records_nested_paths():
+    profiler = Profiler()
+    with profiler.stage('process', nbytes=100) as outer:
+        with profiler.stage('read') as inner:
+            inner.items += 5
+            time.sleep(0.01)
+        outer.items = 2
+
+    records = profiler.report()
+    assert [r['path'] for r in records] == ['process/read', 'process']
+    assert records[0]['items'] == 5
+    assert records[0]['wall'] >= 0.01
+    assert records[1]['bytes'] == 100
+    assert records[1]['wall'] >= records[0]['wall']
+    assert records[1]['cpu'] >= 0
+
+
+def test_profiled_decorator_and_summary():
+    profiler = Profiler()
+
+    @profiler.profiled(items=len, nbytes=lambda result: 8 * len(result))
+    def make_list(n):
+        return list(range(n))
+
+    assert make_list(10) == list(range(10))
+    make_list(30)
+
+    summary = profiler.summary()
+    assert len(summary) == 1
+    assert summary[0]['path'] == 'make_list'
+    assert summary[0]['calls'] == 2
+    assert summary[0]['items'] == 40
+    assert summary[0]['bytes'] == 320
+    assert 'make_list' in profiler.summary_table()
+
+
+def test_stage_recorded_on_error():
+    profiler = Profiler()
+    try:
+        with profiler.stage('fails'):
+            raise ValueError
+    except ValueError:
+        pass
+    assert profiler.report()[0]['stage'] == 'fails'
+
+
+def test_save_report(tmp_path):
+    profiler = Profiler()
+    with profiler.stage('a'):
+        pass
+
+    json_file = profiler.save_report(os.path.join(tmp_path, 'report.json'))
+    with open(json_file) as f:
+        saved = json.load(f)
+    assert saved['records'][0]['stage'] == 'a'
+    assert saved['summary'][0]['calls'] == 1
+
+    csv_file = profiler.save_report(os.path.join(tmp_path, 'report.csv'))
+    with open(csv_file) as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0]['path'] == 'a'
+
+    profiler.extend(saved['records'])
+    assert len(profiler.report()) == 2
+    profiler.reset()
+    assert profiler.report() == []
+
+
+def test_peak_rss_is_sampled_per_stage():
+    pytest.importorskip('psutil')
+    profiler = Profiler(sample_interval=0.005)
+    with profiler.stage('allocate'):
+        data = np.ones(25_000_000)
+        time.sleep(0.05)
+        del data
+    with profiler.stage('small'):
+        time.sleep(0.02)
+
+    allocate, small = profiler.report()
+    assert allocate['peak_rss_delta'] > 150e6
+    assert small['peak_rss_delta'] < 50e6
+    assert small['peak_rss'] < allocate['peak_rss']
+    # The process high-water mark does not go back down after the allocation
+    assert small['process_peak_rss'] > small['peak_rss'] + 150e6
+    assert 'hwm MB' in profiler.summary_table()
+
+
+def test_current_stage_is_the_innermost_record():
+    profiler = Profiler()
+    assert profiler.current() is None
+
+    @profiler.profiled()
+    def read():
+        profiler.current().bytes = 1000
+        with profiler.stage('decode'):
+            assert profiler.current().path == 'read/decode'
+
+    read()
+    assert profiler.current() is None
+    assert [r['bytes'] for r in profiler.report()] == [0, 1000]
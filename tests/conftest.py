@@ -0,0 +1,53 @@
+import os.path
+import struct
+import sys
+
+import pytest
+
+# The pipeline modules live at the top of the repository, next to this directory (ACES_Log_Data under aces-reader/)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(1, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'aces-reader')))
+
+from ReadSeq_Benchmark import Synthetic_Seq  # noqa: E402
+
+
+@pytest.fixture(params=[1, 4], ids=['gang1', 'gang4'])
+def seqfile(request, tmp_path):
+    yield Synthetic_Seq(str(tmp_path) + '/', num_frames=12, gang_num=request.param, sub_rows=15, width=256), request.param
+
+
+#Write a modulator log file: one row per frame count from first_count, position = count / 1000 (header row on the first file)
+def Synthetic_Log(log_dir, name, first_count, rows, header=False):
+    values = [0.0] * 8 if header else []
+    for count in range(first_count, first_count + rows):
+        values += [count / 2000, 1.7e9 + count / 2000, count, 0, 0, count / 1000, 0, 0, count, 0, 0]
+    with open(os.path.join(log_dir, name), 'wb') as f:
+        f.write(struct.pack('>' + 'd' * len(values), *values))
+
+
+#Dataset directory base_dir/data_dir with a Camera/ seq file for each number of full frames in seq_frames (gang 4)
+#and a Logs/ modulator log file for each number of counts in log_rows
+def Synthetic_Dataset(base_dir, data_dir, seq_frames, log_rows):
+    camera_dir = os.path.join(base_dir, data_dir, 'Camera', '')
+    log_dir = os.path.join(base_dir, data_dir, 'Logs', '')
+    os.makedirs(camera_dir, exist_ok=True)
+    os.makedirs(log_dir, exist_ok=True)
+
+    first_frame = 0
+    for i, num_frames in enumerate(seq_frames):
+        Synthetic_Seq(camera_dir, num_frames, 4, sub_rows=3, width=256, first_frame=first_frame,
+                      name='ch4_camera_2025_01_01_00_00_%02d.seq' % i)
+        first_frame = first_frame + num_frames
+
+    first_count = 0
+    for i, rows in enumerate(log_rows):
+        Synthetic_Log(log_dir, 'modulator_2025_01_01_00_00_%02d.bin' % i, first_count, rows, header=(i == 0))
+        first_count = first_count + rows
+
+
+@pytest.fixture
+def make_dataset(tmp_path):
+    def make(data_dir, seq_frames, log_rows):
+        Synthetic_Dataset(str(tmp_path), data_dir, seq_frames, log_rows)
+        return str(tmp_path) + '/'
+    return make
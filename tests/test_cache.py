@@ -0,0 +1,73 @@
+import gc
+import importlib
+import sys
+import weakref
+
+import numpy as np
+
+from ACES_Cache import ACES_Stage_Cache
+
+STAGE_MODULE = '''
+import numpy as np
+
+def Helper(data):
+    return data * {scale}
+
+def Stage(data_list, workers=None):
+    return [Helper(data) for data in data_list], [np.sum(data) for data in data_list]
+'''
+
+
+def load_stage_module(tmp_path, scale):
+    (tmp_path / 'cache_stage_module.py').write_text(STAGE_MODULE.format(scale=scale))
+    sys.dont_write_bytecode, write_bytecode = True, sys.dont_write_bytecode
+    try:
+        if 'cache_stage_module' in sys.modules:
+            return importlib.reload(sys.modules['cache_stage_module'])
+        sys.path.insert(0, str(tmp_path))
+        return importlib.import_module('cache_stage_module')
+    finally:
+        sys.dont_write_bytecode = write_bytecode
+
+
+def test_key_follows_helper_code_and_ignores_workers(tmp_path):
+    cache = ACES_Stage_Cache(str(tmp_path / 'cache'))
+    data_list = [np.arange(10.0), np.ones(5)]
+    try:
+        module = load_stage_module(tmp_path, 2)
+        key = cache.key(module.Stage, data_list)
+        assert cache.key(module.Stage, data_list, workers=4) == key
+        assert cache.key(module.Stage, data_list, workers=4, cache_bytes=0) == key
+
+        module.Stage.cache_version = 2
+        assert cache.key(module.Stage, data_list) != key
+        del module.Stage.cache_version
+
+        module = load_stage_module(tmp_path, 3)
+        assert cache.key(module.Stage, data_list) != key
+    finally:
+        sys.modules.pop('cache_stage_module', None)
+        sys.path.remove(str(tmp_path))
+
+
+def test_outputs_are_not_kept_alive(tmp_path):
+    cache = ACES_Stage_Cache(str(tmp_path / 'cache'))
+    module = load_stage_module(tmp_path, 2)
+    try:
+        data_list = [np.arange(10.0), np.ones(5)]
+        scaled, sums = cache.run(module.Stage, data_list)
+        key = cache.key(module.Stage, scaled)
+
+        #Loaded from disk: the same fingerprints, from the stage key, not from the contents
+        scaled_again, sums_again = cache.run(module.Stage, data_list)
+        np.testing.assert_array_equal(scaled_again[0], scaled[0])
+        assert cache.key(module.Stage, scaled_again) == key
+
+        refs = [weakref.ref(data) for data in scaled + scaled_again]
+        del scaled, sums, scaled_again, sums_again
+        gc.collect()
+        assert all(ref() is None for ref in refs)
+        assert len(cache.fingerprints) == len(data_list)
+    finally:
+        sys.modules.pop('cache_stage_module', None)
+        sys.path.remove(str(tmp_path))
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+
+import ACES_Camera_Data as ACES_Camera_Data_Module
+from ACES_Camera_Data import ACES_Camera_Chunks, ACES_Camera_Data, Shared_Dir
+from ReadSeq_Benchmark import Synthetic_Seq
+
+
+def test_camera_chunks_match_camera_data(seqfile):
+    seqfile, gang_num = seqfile
+    camera_dir = os.path.dirname(seqfile) + '/'
+    data, meta = ACES_Camera_Data(camera_dir, gang_num)
+
+    chunks = list(ACES_Camera_Chunks(camera_dir, gang_num, chunk_frames=5))
+    np.testing.assert_array_equal(np.concatenate([c[0] for c in chunks]), data)
+    np.testing.assert_array_equal(np.concatenate([c[1] for c in chunks])['frameCounter'], meta['frameCounter'])
+    np.testing.assert_array_equal(np.concatenate([c[1] for c in chunks])['timestamp'], meta['timestamp'])
+
+
+def test_camera_chunks_memory_is_bounded_by_chunk(tmp_path):
+    # No sidecar index exists yet, so the meta of the run is built from the seq file too
+    seqfile = Synthetic_Seq(str(tmp_path) + '/', num_frames=200, gang_num=4, sub_rows=15, width=256)
+    file_size = os.path.getsize(seqfile)
+
+    tracemalloc.start()
+    for data_chunk, meta_chunk in ACES_Camera_Chunks(str(tmp_path) + '/', 4, chunk_frames=40):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert os.path.isfile(seqfile + '.idx.npz')
+    assert peak < file_size / 4
+
+
+def test_parallel_read_matches_serial(seqfile):
+    seqfile, gang_num = seqfile
+    camera_dir = os.path.dirname(seqfile) + '/'
+    data, meta = ACES_Camera_Data(camera_dir, gang_num)
+    shared_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    before = set(os.listdir(shared_dir)) if shared_dir else set()
+
+    parallel_data, parallel_meta = ACES_Camera_Data(camera_dir, gang_num, workers=2)
+
+    # The returned array owns the shared block, no copy is made and no file is left behind
+    assert isinstance(parallel_data, np.memmap)
+    if shared_dir:
+        assert not [f for f in set(os.listdir(shared_dir)) - before if f.startswith('aces_read_')]
+    np.testing.assert_array_equal(parallel_data, data)
+    np.testing.assert_array_equal(parallel_meta['timestamp'], meta['timestamp'])
+    np.testing.assert_array_equal(parallel_meta['frameCounter'], meta['frameCounter'])
+
+
+def test_parallel_read_falls_back_when_shm_is_full(seqfile, monkeypatch):
+    seqfile, gang_num = seqfile
+    camera_dir = os.path.dirname(seqfile) + '/'
+    data, meta = ACES_Camera_Data(camera_dir, gang_num)
+
+    monkeypatch.setattr(ACES_Camera_Data_Module.shutil, 'disk_usage', lambda path: SimpleNamespace(total=1e6, used=1e6, free=0))
+    assert Shared_Dir(1) is None
+    mkstemp = tempfile.mkstemp
+    shared_dirs = []
+    monkeypatch.setattr(ACES_Camera_Data_Module.tempfile, 'mkstemp',
+                        lambda **kwargs: shared_dirs.append(kwargs['dir']) or mkstemp(**kwargs))
+
+    parallel_data, parallel_meta = ACES_Camera_Data(camera_dir, gang_num, workers=2)
+    assert shared_dirs == [None]
+    np.testing.assert_array_equal(parallel_data, data)
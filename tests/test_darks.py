@@ -0,0 +1,98 @@
+import os
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from ACES_Darks import Build_Dark, DarkLibrary, Sigma_Clipped_Mean
+from ReadSeq_Benchmark import Synthetic_Seq
+from ReadSeqMod_Ganged import ReadSeq
+
+
+def test_build_dark_matches_full_stack(seqfile):
+    seqfile, gang_num = seqfile
+    dark_dir = os.path.dirname(seqfile) + '/'
+    data, meta, seq = ReadSeq(seqfile, gang_num)
+
+    np.testing.assert_array_equal(Build_Dark(dark_dir, gang_num, row_block=4, workers=2), np.median(data, axis=0))
+    np.testing.assert_allclose(Build_Dark(dark_dir, gang_num, method='sigma_clip', row_block=4, workers=2),
+                               Sigma_Clipped_Mean(data))
+
+
+def test_build_dark_memory_is_bounded_by_max_bytes(tmp_path):
+    Synthetic_Seq(str(tmp_path) + '/', num_frames=100, gang_num=4, sub_rows=15, width=256)
+
+    tracemalloc.start()
+    Build_Dark(str(tmp_path) + '/', 4, workers=2, max_bytes=1e6)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # The full dark stack is 3 MB of int16
+    assert peak < 1.5e6
+
+
+#Library with a dark directory (and its saved npy frame) for each exposure time, no seq files needed
+def make_library(tmp_path, exp_times, shape=(4, 5), **kwargs):
+    library = DarkLibrary(str(tmp_path) + '/', **kwargs)
+    rows = []
+    for exp_time in exp_times:
+        dark_dir = str(tmp_path / str(exp_time)) + '/'
+        os.makedirs(dark_dir)
+        np.save(dark_dir + 'ACES_Darks_' + str(exp_time) + '_g1.npy', np.full(shape, int(100 + 10 * exp_time)))
+        rows.append({'exp_time': exp_time, 'fpa_temp': 80.0, 'dark_dir': dark_dir, 'rows': shape[0], 'columns': shape[1]})
+    library.entries[1] = pd.DataFrame(rows)
+    return library
+
+
+def test_dark_library_exact_and_synthesized(tmp_path):
+    library = make_library(tmp_path, [1.0, 3.0, 10.0])
+    np.testing.assert_array_equal(library.dark(3.0, 1), 130)
+    # Between the nearest exposures on each side: 3 and 10
+    np.testing.assert_array_equal(library.dark(5.0, 1), 150)
+    # Outside of the exposures of the darks: skipped unless extrapolating
+    assert library.dark(20.0, 1) is None
+    assert library.dark(0.5, 1) is None
+    library.extrapolate = True
+    np.testing.assert_array_equal(library.dark(20.0, 1), 300)
+
+
+def test_dark_library_cache_is_lru(tmp_path):
+    library = make_library(tmp_path, [1.0, 3.0, 10.0], cache_size=2)
+    first = library.dark(1.0, 1)
+    library.dark(3.0, 1)
+    assert library.dark(1.0, 1) is first
+    library.dark(10.0, 1)
+    # 3.0 was the least recently used
+    assert [key[0] for key in library.cache] == [str(tmp_path / '1.0') + '/', str(tmp_path / '10.0') + '/']
+    os.remove(str(tmp_path / '1.0') + '/ACES_Darks_1.0_g1.npy')
+    assert library.dark(1.0, 1) is first
+
+
+def test_dark_library_falls_back_to_legacy_npy(tmp_path):
+    library = make_library(tmp_path, [2.0])
+    dark_dir = str(tmp_path / '2.0') + '/'
+    os.rename(dark_dir + 'ACES_Darks_2.0_g1.npy', dark_dir + 'ACES_Darks_2.0.npy')
+    np.testing.assert_array_equal(library.dark(2.0, 1), 120)
+
+
+def test_dark_library_ignores_npy_of_another_shape(tmp_path):
+    # A legacy frame of another shape (e.g. another gang number) is not used, the dark is built from the seq files
+    dark_dir = str(tmp_path / 'dark') + '/'
+    os.makedirs(dark_dir)
+    seqfile = Synthetic_Seq(dark_dir, num_frames=12, gang_num=1, sub_rows=15, width=256)
+    library = DarkLibrary(str(tmp_path) + '/')
+    exp_time = library.index(1)['exp_time'][0]
+    np.save(dark_dir + 'ACES_Darks_' + str(exp_time) + '.npy', np.zeros((2, 2)))
+
+    data, meta, seq = ReadSeq(seqfile, 1)
+    np.testing.assert_array_equal(library.dark(exp_time, 1), np.median(data, axis=0).astype(int))
+    assert os.path.isfile(dark_dir + 'ACES_Darks_' + str(exp_time) + '_g1.npy')
+
+
+def test_dark_library_indexes_seq_directories(tmp_path):
+    dark_dir = str(tmp_path / 'dark') + '/'
+    os.makedirs(dark_dir)
+    Synthetic_Seq(dark_dir, num_frames=12, gang_num=4, sub_rows=15, width=256)
+    entries = DarkLibrary(str(tmp_path) + '/').index(4)
+    assert entries['dark_dir'].tolist() == [dark_dir]
+    assert entries[['rows', 'columns']].values.tolist() == [[15, 256]]
@@ -0,0 +1,57 @@
+import numpy as np
+
+from ACES_Camera_Data import frame_count_fixer, frame_gap_report, repair_counter
+
+
+def test_multiple_resets_continue_counting():
+    counter = np.array([500, 501, 0, 1, 2, 200, 201, 0, 1])
+    fixed, resets, repaired = repair_counter(counter)
+    np.testing.assert_array_equal(fixed, [0, 1, 2, 3, 4, 202, 203, 204, 205])
+    np.testing.assert_array_equal(resets, [2, 7])
+    assert len(repaired) == 0
+
+
+def test_out_of_order_frame_is_not_a_reset():
+    counter = np.array([97, 98, 100, 99, 101, 102])
+    meta = {'frameCounter': counter.copy()}
+    frame_count_fixer(meta)
+    np.testing.assert_array_equal(meta['frameCounter'], counter)
+
+    report = frame_gap_report(counter, ['a.seq'], [6])
+    assert report['resets'][0] == 0
+    assert report['out_of_order'][0] == 1
+    assert report['dropped'][0] == 0
+
+
+def test_duplicates_are_repaired_or_reported():
+    # A stuck counter (100, 100, 102) is repaired, a repeated frame (104, 104, 105) keeps its counter
+    counter = np.array([99, 100, 100, 102, 103, 104, 104, 105, 108])
+    fixed, resets, repaired = repair_counter(counter)
+    np.testing.assert_array_equal(fixed, [99, 100, 101, 102, 103, 104, 104, 105, 108])
+    np.testing.assert_array_equal(repaired, [2])
+
+    report = frame_gap_report(counter, ['a.seq', 'b.seq'], [5, 4])
+    assert report['repaired'].tolist() == [1, 0]
+    assert report['duplicated'].tolist() == [0, 1]
+    assert report['dropped'].tolist() == [0, 2]
+    assert report['first_count'].tolist() == [99, 104]
+    assert report['last_count'].tolist() == [103, 108]
+
+
+def test_report_counts_reset_in_its_file():
+    counter = np.array([700, 701, 702, 0, 1, 3, 4])
+    report = frame_gap_report(counter, ['a.seq', 'b.seq'], [3, 4])
+    assert report['resets'].tolist() == [0, 1]
+    assert report['dropped'].tolist() == [0, 1]
+    assert report['out_of_order'].tolist() == [0, 0]
+
+
+def test_early_reset_is_found():
+    # Reset after only a few frames, with counters that never went above the reset limit
+    meta = {'frameCounter': np.array([5, 6, 7, 8, 0, 1, 2, 3])}
+    frame_count_fixer(meta)
+    np.testing.assert_array_equal(meta['frameCounter'], np.arange(8))
+
+    fixed, resets, repaired = repair_counter([5, 6, 7, 8, 0, 1, 2, 3, 1, 2])
+    np.testing.assert_array_equal(resets, [4, 8])
+    np.testing.assert_array_equal(fixed, np.arange(10))
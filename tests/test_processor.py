@@ -0,0 +1,118 @@
+import os
+import shutil
+
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+
+import ACES_Darks
+import ACES_Processor
+from ACES_Processor import Process_Dataset
+from ACES_Storage import Load_Table
+from ReadSeq_Benchmark import Synthetic_Seq
+
+
+@pytest.fixture(autouse=True)
+def dark_libraries(monkeypatch):
+    # Every test indexes its own dark directories
+    monkeypatch.setattr(ACES_Darks, 'DARK_LIBRARIES', {})
+
+
+def test_darks_come_from_the_dark_base(make_dataset):
+    base_dir = make_dataset('run', [10, 10], [100])
+    data, meta, logs, full_data_dir = Process_Dataset('run', base_dir, 4, 'n', 'none')
+
+    # No darks under base_dir/DARKS/ yet
+    with pytest.raises(FileNotFoundError):
+        Process_Dataset('run', base_dir, 4, 'o', 'require')
+
+    dark_dir = base_dir + 'DARKS/5ms/'
+    os.makedirs(dark_dir)
+    Synthetic_Seq(dark_dir, 6, 4, sub_rows=3, width=256, first_frame=1000)
+    ACES_Darks.Dark_Library(base_dir + 'DARKS/').refresh()
+    dark_data, meta, logs, full_data_dir = Process_Dataset('run', base_dir, 4, 'o', 'require')
+    dark_frame = ACES_Darks.Dark_Library(base_dir + 'DARKS/').dark(5.0, 4)
+    np.testing.assert_array_equal(dark_data, data - dark_frame)
+
+    # Or from any other directory
+    other_base = base_dir + 'other_darks/'
+    os.rename(base_dir + 'DARKS/', other_base)
+    other_data, meta, logs, full_data_dir = Process_Dataset('run', base_dir, 4, 'o', 'require', dark_base=other_base)
+    np.testing.assert_array_equal(other_data, dark_data)
+
+
+#Process a copy of the dataset from scratch and check an appended dataset is the same
+def assert_same_as_full_process(base_dir, data_dir, appended):
+    full_dir = data_dir + '_full'
+    shutil.rmtree(base_dir + full_dir, ignore_errors=True)
+    os.makedirs(base_dir + full_dir)
+    for sub_dir in ['Camera', 'Logs']:
+        shutil.copytree(base_dir + data_dir + '/' + sub_dir, base_dir + full_dir + '/' + sub_dir,
+                        ignore=shutil.ignore_patterns('*.idx.npz'))
+    Process_Dataset(full_dir, base_dir, 4, 'n', 'none')
+    full = Process_Dataset(full_dir, base_dir, 4, 'r', 'none')
+
+    data, meta, logs, full_data_dir = appended
+    np.testing.assert_array_equal(data, full[0])
+    for field in meta.dtype.names:
+        np.testing.assert_array_equal(meta[field], full[1][field])
+    pd.testing.assert_frame_equal(logs, full[2])
+
+    with h5py.File(processed_file(base_dir, data_dir), 'r') as f, h5py.File(processed_file(base_dir, full_dir), 'r') as g:
+        pd.testing.assert_frame_equal(Load_Table(f, 'frame_report'), Load_Table(g, 'frame_report'))
+        np.testing.assert_array_equal(f['raw_frame_counter'][()], g['raw_frame_counter'][()])
+
+
+def processed_file(base_dir, data_dir):
+    return base_dir + data_dir + '/Processed/' + data_dir + '_processed_data.h5'
+
+
+def test_append_matches_full_process(make_dataset):
+    base_dir = make_dataset('run', [20, 20], [120, 50])
+    Process_Dataset('run', base_dir, 4, 'n', 'none')
+
+    # New seq and log files
+    make_dataset('run', [20, 20, 10], [120, 50, 30])
+    assert_same_as_full_process(base_dir, 'run', Process_Dataset('run', base_dir, 4, 'a', 'none'))
+
+
+def test_append_reads_grown_files_again(make_dataset):
+    base_dir = make_dataset('run', [20, 20], [120, 50])
+    Process_Dataset('run', base_dir, 4, 'n', 'none')
+
+    # The last seq and log files were still being written when the dataset was processed
+    make_dataset('run', [20, 30, 10], [120, 100, 30])
+    assert_same_as_full_process(base_dir, 'run', Process_Dataset('run', base_dir, 4, 'a', 'none'))
+
+    # Up to date, nothing is read
+    data, meta, logs, full_data_dir = Process_Dataset('run', base_dir, 4, 'a', 'none')
+    assert len(data) == 60 * 4
+
+
+def test_append_to_data_processed_without_file_sizes(make_dataset):
+    base_dir = make_dataset('run', [20, 20], [120, 50])
+    Process_Dataset('run', base_dir, 4, 'n', 'none')
+    with h5py.File(processed_file(base_dir, 'run'), 'a') as f:
+        for name in ['seq_sizes', 'seq_mtimes', 'log_sizes', 'log_mtimes', 'log_rows']:
+            del f.attrs[name]
+
+    # The last processed files are read again as they can't be checked
+    make_dataset('run', [20, 30], [120, 100])
+    assert_same_as_full_process(base_dir, 'run', Process_Dataset('run', base_dir, 4, 'a', 'none'))
+
+
+def test_failed_append_can_be_run_again(make_dataset, monkeypatch):
+    base_dir = make_dataset('run', [20, 20], [120, 50])
+    Process_Dataset('run', base_dir, 4, 'n', 'none')
+    make_dataset('run', [20, 30, 10], [120, 100, 30])
+
+    # Fails after the data and tables were written, before the processed files are
+    def fail(*args):
+        raise OSError('disk full')
+    monkeypatch.setattr(ACES_Processor, 'Save_File_Stats', fail)
+    with pytest.raises(OSError):
+        Process_Dataset('run', base_dir, 4, 'a', 'none')
+    monkeypatch.undo()
+
+    assert_same_as_full_process(base_dir, 'run', Process_Dataset('run', base_dir, 4, 'a', 'none'))
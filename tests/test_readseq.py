@@ -0,0 +1,105 @@
+import os
+import tracemalloc
+
+import numpy as np
+from aces_reader import profiling
+
+from ReadSeq_Benchmark import Synthetic_Seq
+from ReadSeqMod_Ganged import (META_DTYPE, BinFrames, MetaObjectsToTable, ReadSeq, ReadSeqChunks, ReadSeqLegacy, SeqFile,
+                               SeqIndex)
+
+
+def assert_meta_equal(meta, expected):
+    assert meta.dtype == expected.dtype
+    for name in META_DTYPE.names:
+        np.testing.assert_array_equal(meta[name], expected[name], err_msg=name)
+
+
+def test_readseq_matches_legacy_data(seqfile):
+    seqfile, gang_num = seqfile
+    data, meta, seq = ReadSeq(seqfile, gang_num)
+    legacy_data, legacy_meta, legacy_seq = ReadSeqLegacy(seqfile, gang_num)
+
+    assert data.dtype == legacy_data.dtype
+    assert data.shape == legacy_data.shape == (12 * gang_num, 15, 256)
+    np.testing.assert_array_equal(data, legacy_data)
+
+
+def test_readseq_matches_legacy_meta(seqfile):
+    seqfile, gang_num = seqfile
+    data, meta, seq = ReadSeq(seqfile, gang_num)
+    legacy_data, legacy_meta, legacy_seq = ReadSeqLegacy(seqfile, gang_num)
+    legacy_meta = MetaObjectsToTable(legacy_meta)
+
+    assert meta.dtype == META_DTYPE
+    assert_meta_equal(meta, legacy_meta)
+    np.testing.assert_array_equal(meta['frameCounter'], np.arange(12 * gang_num))
+
+
+def test_seqfile_indexing_matches_readseq(seqfile):
+    seqfile, gang_num = seqfile
+    data, meta, seq = ReadSeq(seqfile, gang_num, dtype=np.int16)
+
+    with SeqFile(seqfile, gang_num) as sf:
+        assert sf.shape == data.shape
+        np.testing.assert_array_equal(sf[:], data)
+        np.testing.assert_array_equal(sf[5], data[5])
+        np.testing.assert_array_equal(sf[-1], data[-1])
+        np.testing.assert_array_equal(sf[3:40:7, 2:9, ::3], data[3:40:7, 2:9, ::3])
+        np.testing.assert_array_equal(sf[1:6, 4], data[1:6, 4])
+        np.testing.assert_array_equal(sf[2, [0, 3], 5], data[2, [0, 3], 5])
+        assert_meta_equal(sf.meta(), meta)
+        assert_meta_equal(sf.meta(2, 5), meta[2 * gang_num:5 * gang_num])
+
+
+def test_seq_index_reads_only_meta_rows(tmp_path):
+    seqfile = Synthetic_Seq(str(tmp_path) + '/', num_frames=100, gang_num=4, sub_rows=15, width=256)
+    data, meta, seq = ReadSeq(seqfile, 4, dtype=np.int16)
+    del data
+
+    tracemalloc.start()
+    Seq = SeqIndex(seqfile, 4)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert os.path.isfile(seqfile + '.idx.npz')
+    assert peak < os.path.getsize(seqfile) / 4
+    assert_meta_equal(Seq.Meta, meta)
+    assert_meta_equal(SeqIndex(seqfile, 4).Meta, meta)
+
+
+def test_readseq_roi_and_bins_match_full_read(seqfile):
+    seqfile, gang_num = seqfile
+    data, meta, seq = ReadSeq(seqfile, gang_num)
+
+    roi_data, roi_meta, roi_seq = ReadSeq(seqfile, gang_num, y_range=[2, 11], x_range=[5, 200])
+    assert roi_data.dtype == data.dtype
+    np.testing.assert_array_equal(roi_data, data[:, 2:11, 5:200])
+    assert_meta_equal(roi_meta, meta)
+
+    binned, binned_meta, binned_seq = ReadSeq(seqfile, gang_num, y_range=[2, 11], x_range=[5, 200], y_bin=2, x_bin=4)
+    np.testing.assert_array_equal(binned, BinFrames(data[:, 2:11, 5:200], 2, 4))
+
+    chunks = list(ReadSeqChunks(seqfile, gang_num, 5, y_range=[2, 11], x_range=[5, 200]))
+    np.testing.assert_array_equal(np.concatenate([c[0] for c in chunks]), data[:, 2:11, 5:200])
+
+
+def test_readseq_roi_copies_only_the_roi(tmp_path):
+    seqfile = Synthetic_Seq(str(tmp_path) + '/', num_frames=100, gang_num=4, sub_rows=15, width=256)
+
+    tracemalloc.start()
+    data, meta, seq = ReadSeq(seqfile, 4, dtype=np.int16, y_range=[0, 4], x_range=[0, 4])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert data.shape == (400, 4, 4)
+    assert peak < os.path.getsize(seqfile) / 4
+
+
+def test_readseq_reports_bytes_read_not_decoded(seqfile):
+    seq, gang_num = seqfile
+    since = len(profiling.PROFILER)
+    data, meta, Seq = ReadSeq(seq, gang_num, y_range=[0, 2], x_range=[0, 4])
+    record = [r for r in profiling.report(since) if r['stage'] == 'ReadSeq'][-1]
+    assert record['bytes'] == Seq.NumFrames*Seq.TrueImageSize
+    assert record['items'] == len(data)
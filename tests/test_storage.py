@@ -0,0 +1,92 @@
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+
+from ACES_Storage import (Append_Table, Chunk_Shape, Lazy_Data, Load_Meta_Logs, Load_Table, Rechunk_File, Save_Data,
+                          Save_Table)
+from ReadSeqMod_Ganged import META_DTYPE
+
+
+def test_chunk_shape_caps_frames_per_chunk():
+    assert Chunk_Shape((1000, 127, 640), np.int32) == (64, 16, 16)
+    assert Chunk_Shape((1000, 127, 640), np.int32, max_frames=1024) == (976, 16, 16)
+    assert Chunk_Shape((10, 4, 5), np.float64) == (10, 4, 5)
+
+
+def test_rechunk_file_keeps_data(tmp_path):
+    h5_file = str(tmp_path / 'processed.h5')
+    data = np.arange(300 * 20 * 24, dtype=np.int32).reshape(300, 20, 24)
+    with h5py.File(h5_file, 'w') as f:
+        f.create_dataset('data', data=data, chunks=(300, 4, 4))
+        f.create_dataset('raw_frame_counter', data=np.arange(300))
+        f.attrs['seq_files'] = ['a.seq']
+
+    Rechunk_File(h5_file)
+
+    with h5py.File(h5_file, 'r') as f:
+        assert f['data'].chunks == Chunk_Shape(data.shape, data.dtype)
+        np.testing.assert_array_equal(f['data'][()], data)
+        np.testing.assert_array_equal(f['raw_frame_counter'][()], np.arange(300))
+        assert list(f.attrs['seq_files']) == ['a.seq']
+
+    with h5py.File(str(tmp_path / 'saved.h5'), 'w') as f:
+        np.testing.assert_array_equal(Save_Data(f, data)[()], data)
+
+
+def test_lazy_data_cache_holds_a_frame_of_chunks(tmp_path):
+    h5_file = str(tmp_path / 'processed.h5')
+    data = np.arange(200 * 40 * 70, dtype=np.int32).reshape(200, 40, 70)
+    with h5py.File(h5_file, 'w') as f:
+        Save_Data(f, data)
+
+    with Lazy_Data(h5_file) as lazy:
+        chunks = lazy.dset.chunks
+        chunks_per_frame = -(-40 // chunks[1]) * -(-70 // chunks[2])
+        cache_bytes = lazy.file.id.get_access_plist().get_cache()[2]
+        assert cache_bytes >= chunks_per_frame * np.prod(chunks) * 4
+        np.testing.assert_array_equal(lazy[5], data[5])
+        np.testing.assert_array_equal(lazy[:, 3, 4], data[:, 3, 4])
+
+
+def test_tables_round_trip(tmp_path):
+    meta = np.zeros(6, dtype=META_DTYPE)
+    meta['timestamp'] = 1735689600 * 10**9 + np.arange(6) * 10**6
+    meta['partNum'] = b'ISC0403 partnumber padded to 32b'
+    meta['serNum'] = b'SN1234'
+    meta['frameCounter'] = np.arange(6)
+    meta['pos'] = [np.nan, 1.5, 2.5, np.nan, 4.5, 5.5]
+
+    times = pd.date_range('2025-01-01 00:00:00', periods=4, freq='250ms')
+    logs = pd.DataFrame({'time': times,
+                         'py_time': pd.Series(list(times.to_pydatetime()), dtype=object),
+                         'state': ['move', 'hold', 'move', 'hold'],
+                         'pos': [0.0, 0.25, 0.5, 0.75]})
+
+    h5_file = str(tmp_path / 'processed.h5')
+    with h5py.File(h5_file, 'w') as f:
+        Save_Table(f, 'meta', meta[:4])
+        Save_Table(f, 'logs', logs[:3])
+        Append_Table(f, 'meta', meta[4:])
+        Append_Table(f, 'logs', logs[3:])
+        # Datetimes are stored as int64 nanoseconds
+        assert f['logs/time'].dtype == np.int64
+        assert f['logs/py_time'][0] == times[0].value
+
+    loaded_meta, loaded_logs = Load_Meta_Logs(h5_file)
+    assert loaded_meta.dtype == META_DTYPE
+    for field in META_DTYPE.names:
+        np.testing.assert_array_equal(loaded_meta[field], meta[field])
+    pd.testing.assert_frame_equal(loaded_logs, logs.assign(py_time=times), check_dtype=False)
+    assert loaded_logs['time'].dtype == 'datetime64[ns]'
+    assert loaded_logs['py_time'].dtype == 'datetime64[ns]'
+
+    # Only some fields
+    some_meta, some_logs = Load_Meta_Logs(h5_file, meta_fields=['partNum', 'pos'], log_fields=['state'])
+    assert some_meta.dtype.names == ('partNum', 'pos')
+    np.testing.assert_array_equal(some_meta['partNum'], meta['partNum'])
+    assert some_logs.columns.tolist() == ['state']
+    assert some_logs['state'].tolist() == logs['state'].tolist()
+
+    with h5py.File(h5_file, 'r') as f, pytest.raises(KeyError):
+        Load_Table(f, 'meta', ['not_a_field'])
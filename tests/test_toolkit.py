@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+
+from ACES_ToolKit import RESAMPLING_MATRICES, ACES_Interpolator, Pixel_Averager, Sampler
+
+
+#Pixel_Averager before it was vectorized (one np.average per bin), printing removed
+def Pixel_Averager_Legacy(data, y_bin=1, x_bin=1):
+    y_axis = int(np.shape(data)[1] / y_bin)
+    x_axis = int(np.shape(data)[2] / x_bin)
+    frames = np.shape(data)[0]
+    average_data = np.zeros([frames, y_axis, x_axis])
+    for y in range(0, y_axis):
+        for x in range(0, x_axis):
+            y1 = y * y_bin
+            y2 = y1 + y_bin
+            x1 = x * x_bin
+            x2 = x1 + x_bin
+            bin_data = data[:, y1:y2, x1:x2]
+            average_data[:, y, x] = np.average(bin_data, axis=(1, 2))
+    return average_data
+
+
+#Sampler before it was vectorized (ZPD, OPD lists and np.interp pixel by pixel), printing removed
+def Sampler_Legacy(pos, rd, sample_size, path_length, datatype):
+    if pos[0] < pos[-1]:
+        direction = 'positive'
+    if pos[0] > pos[-1]:
+        direction = 'negative'
+    x_axis = np.shape(rd)[2]
+    y_axis = np.shape(rd)[1]
+    full_travel = 2 * path_length * 0.90
+    num_samples = abs(full_travel // sample_size)
+    if num_samples % 2 == 1:
+        num_samples = num_samples + 1
+
+    OPD = np.zeros([len(rd), y_axis, x_axis])
+    OPD_sample = np.zeros([int(num_samples+1), y_axis, x_axis])
+    for x in range(0, x_axis):
+        for y in range(0, y_axis):
+            pixel_data = rd[:, y, x]
+            if datatype == 'white':
+                zero_path = pos[np.where(pixel_data == max(pixel_data))[0][0]]
+            if datatype == 'laser':
+                zero_path = np.average(pos)
+            OPD[:, y, x] = [(p - zero_path)*2 for p in pos]
+            OPD_temp_sample = [0]
+            for n in range(1, int(num_samples//2)+1):
+                OPD_temp_sample.append((sample_size * n))
+                OPD_temp_sample.append((sample_size * -n))
+            OPD_temp_sample.sort()
+            if direction == 'negative':
+                OPD_temp_sample.reverse()
+            OPD_sample[:, y, x] = OPD_temp_sample
+
+    sample_data = np.zeros([len(OPD_sample), y_axis, x_axis])
+    for x in range(0, x_axis):
+        for y in range(0, y_axis):
+            if direction == 'positive':
+                pixel_sample = np.interp(OPD_sample[:, y, x], OPD[:, y, x], rd[:, y, x])
+            if direction == 'negative':
+                pixel_sample = np.interp(OPD_sample[:, y, x], OPD[:, y, x][::-1], rd[:, y, x][::-1])
+            sample_data[:, y, x] = pixel_sample
+    return OPD, OPD_sample, sample_data
+
+
+@pytest.mark.parametrize('y_bin, x_bin', [(1, 1), (2, 2), (3, 5), (7, 4)])
+def test_pixel_averager_matches_legacy(y_bin, x_bin):
+    data = np.random.default_rng(0).integers(0, 4000, size=(30, 20, 22)).astype(np.int16)
+    np.testing.assert_allclose(Pixel_Averager(data, y_bin, x_bin, chunk_frames=7),
+                               Pixel_Averager_Legacy(data, y_bin, x_bin), rtol=1e-12)
+
+
+@pytest.mark.parametrize('direction', ['positive', 'negative'])
+@pytest.mark.parametrize('datatype', ['white', 'laser'])
+def test_sampler_matches_legacy(direction, datatype):
+    rng = np.random.default_rng(1)
+    #Uneven steps with some repeated positions, like the camera positions interpolated from the logs
+    pos = np.round(np.cumsum(rng.uniform(0, 0.01, 150)) - 0.6, 3)
+    if direction == 'negative':
+        pos = pos[::-1]
+    #Few distinct brightest frames, so several pixels share a ZPD
+    rd = rng.normal(100, 5, size=(150, 6, 7))
+    rd[rng.integers(60, 66, size=(6, 7)), np.arange(6)[:, None], np.arange(7)] += 1000
+
+    OPD, OPD_sample, sample_data = Sampler(pos, rd, 0.012, 0.35, datatype)
+    OPD_legacy, OPD_sample_legacy, sample_data_legacy = Sampler_Legacy(pos, rd, 0.012, 0.35, datatype)
+
+    np.testing.assert_allclose(np.asarray(OPD), OPD_legacy, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(np.asarray(OPD_sample), OPD_sample_legacy, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(sample_data, sample_data_legacy, rtol=1e-10, atol=1e-9)
+
+
+def test_resampling_matrices_are_kept_only_within_max_bytes():
+    rng = np.random.default_rng(2)
+    pos = np.linspace(-0.3, 0.3, 120)
+    rd = rng.normal(100, 5, size=(120, 8, 8))
+    max_bytes = RESAMPLING_MATRICES.max_bytes
+    RESAMPLING_MATRICES.clear()
+
+    try:
+        #Kept by default, the same scan again is built from the kept matrices
+        expected = Sampler(pos, rd, 0.01, 0.3, 'white')[2]
+        kept = len(RESAMPLING_MATRICES)
+        assert kept > 0
+        np.testing.assert_array_equal(Sampler(pos, rd, 0.01, 0.3, 'white')[2], expected)
+        assert len(RESAMPLING_MATRICES) == kept
+
+        RESAMPLING_MATRICES.resize(20000)
+        assert 0 < RESAMPLING_MATRICES.nbytes <= 20000
+        np.testing.assert_array_equal(Sampler(pos, rd, 0.01, 0.3, 'white')[2], expected)
+        assert 0 < RESAMPLING_MATRICES.nbytes <= 20000
+
+        RESAMPLING_MATRICES.resize(0)
+        assert len(RESAMPLING_MATRICES) == 0
+        np.testing.assert_array_equal(Sampler(pos, rd, 0.01, 0.3, 'white')[2], expected)
+        assert len(RESAMPLING_MATRICES) == 0
+    finally:
+        RESAMPLING_MATRICES.resize(max_bytes)
+        RESAMPLING_MATRICES.clear()
+
+
+def test_parallel_interpolator_matches_serial():
+    rng = np.random.default_rng(3)
+    positions = []
+    real_data = []
+    #Forward and backward scans of different lengths, like the scans found by Scan_Selector
+    for s, num_frames in enumerate([140, 125, 150, 131]):
+        pos = np.round(np.cumsum(rng.uniform(0, 0.01, num_frames)) - 0.6, 3)
+        positions.append(pos if s % 2 == 0 else pos[::-1])
+        rd = rng.normal(100, 5, size=(num_frames, 5, 6))
+        rd[rng.integers(55, 65, size=(5, 6)), np.arange(5)[:, None], np.arange(6)] += 1000
+        real_data.append(rd)
+    scan_list = list(range(len(positions)))
+
+    OPD_list, OPD_intrp_list, data_intrp_list = ACES_Interpolator(scan_list, positions, real_data, 0.012, 0.35)
+    OPD_parallel, OPD_intrp_parallel, data_intrp_parallel = \
+        ACES_Interpolator(scan_list, positions, real_data, 0.012, 0.35, workers=2)
+
+    assert len(OPD_parallel) == len(OPD_intrp_parallel) == len(data_intrp_parallel) == len(scan_list)
+    for s in scan_list:
+        assert OPD_parallel[s].direction == OPD_list[s].direction
+        np.testing.assert_array_equal(np.asarray(OPD_parallel[s]), np.asarray(OPD_list[s]))
+        np.testing.assert_array_equal(np.asarray(OPD_intrp_parallel[s]), np.asarray(OPD_intrp_list[s]))
+        np.testing.assert_array_equal(data_intrp_parallel[s], data_intrp_list[s])